@@ -37,16 +37,20 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework.authtoken',
-    'core',
+    'core.apps.CoreConfig',
     'user',
-    'recipe',
+    'recipe.apps.RecipeConfig',
 
 ]
 
 MIDDLEWARE = [
+    # First, so its timings cover the rest of the stack.
+    'core.middleware.RequestTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'core.middleware.ReplicaRoutingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -81,14 +85,79 @@ WSGI_APPLICATION = 'app.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        # Django's PostgreSQL backend plus the health check below.
+        'ENGINE': 'core.backends.postgresql',
         'HOST': os.environ.get('DB_HOST'),
         'NAME': os.environ.get('DB_NAME'),
         'USER': os.environ.get('DB_USER'),
-        'PASSWORD': os.environ.get('DB_PASS')
+        'PASSWORD': os.environ.get('DB_PASS'),
+        # Keep connections open between requests instead of connecting
+        # for each one, 0 restores the old behaviour.
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+        # Check a reused connection still works before a request first
+        # uses it, see core.backends.postgresql.
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Read replicas as a comma separated list of host[:port], for example
+# DB_REPLICA_HOSTS=replica1,replica2:5433.  Each becomes a replicaN alias
+# sharing the primary's credentials.
+REPLICA_DATABASES = []
+for i, address in enumerate(
+        filter(None, os.environ.get('DB_REPLICA_HOSTS', '').split(',')),
+        start=1):
+    host, _, port = address.partition(':')
+    REPLICA_DATABASES.append(f'replica{i}')
+    DATABASES[f'replica{i}'] = dict(
+        DATABASES['default'],
+        HOST=host,
+        PORT=port,
+        TEST={'MIRROR': 'default'},
+    )
+
+# Safe method requests read from one replica each, see core.routers.
+# After a client writes, its reads stay on the primary for this many
+# seconds so it sees its own changes despite replication lag.  Those
+# flags live in the default cache, which must then be shared by every
+# worker; the system checks reject the local memory cache.
+DATABASE_ROUTERS = ['core.routers.PrimaryReplicaRouter']
+REPLICA_STICKY_SECONDS = int(os.environ.get('DB_REPLICA_STICKY_SECONDS', 5))
+
+
+# Request timing: per-route histograms served at /metrics, and the same
+# timings sent back to clients in a Server-Timing header.  The header
+# tells any client each request's query count and database time, so it
+# is off unless SERVER_TIMING=1.  METRICS_TOKEN set means scrapes must
+# send it as a bearer token.
+REQUEST_METRICS_ENABLED = bool(int(os.environ.get('REQUEST_METRICS', 1)))
+SERVER_TIMING_ENABLED = bool(int(os.environ.get('SERVER_TIMING', 0)))
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+
+# Cache
+# https://docs.djangoproject.com/en/2.1/topics/cache/
+# The cache also carries the list versions cached lists are stored
+# under.  Local memory suits a single worker process; use the file based
+# backend so several workers on one host share them.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'recipe-app',
+    }
+}
+
+
+# Token authentication cache
+# Entries in core.authentication.token_cache per worker process, and the
+# seconds a cached token is trusted before it is looked up again.
+
+TOKEN_AUTH_CACHE_SIZE = 10000
+TOKEN_AUTH_CACHE_TTL = 60
+# Log the cache hit rate after this many lookups, 0 disables the log.
+TOKEN_AUTH_CACHE_REPORT_EVERY = 10000
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
@@ -132,5 +201,70 @@ MEDIA_URL = '/media/'
 STATIC_ROOT = '/vol/web/static'
 MEDIA_ROOT = '/vol/web/media'
 
+# How core.views.media hands files over once it has checked them:
+# 'django' streams them from the worker, 'x-accel-redirect' leaves it to
+# nginx through the internal location at MEDIA_ACCEL_PREFIX (see
+# proxy/nginx.conf) and 'x-sendfile' to Apache or lighttpd by path.
+MEDIA_DELIVERY = os.environ.get('MEDIA_DELIVERY', 'django')
+MEDIA_ACCEL_PREFIX = '/protected-media/'
+# Stored media names are never reused, so browsers may keep them for good
+# (but not shared caches, see core.views.media).
+MEDIA_CACHE_MAX_AGE = 60 * 60 * 24 * 365
+
 # Custom user model
-AUTH_USER_MODEL = 'core.User'
\ No newline at end of file
+AUTH_USER_MODEL = 'core.User'
+
+
+# Django REST framework
+# The JSON renderer and parser use orjson when it is installed and give
+# the same results as DRF's own classes.
+
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': (
+        'core.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'core.parsers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
+}
+
+
+# Recipe API
+
+# Seconds a cached tag or ingredient list is kept.  Writes invalidate
+# entries right away, so this only bounds memory use.
+RECIPE_LIST_CACHE_TIMEOUT = 300
+
+# Largest list accepted by the bulk create endpoints in one request.
+RECIPE_BULK_CREATE_MAX_ITEMS = 1000
+
+# Widths in pixels of the resized copies made for each recipe image, and
+# the number of worker threads making them.
+RECIPE_IMAGE_WIDTHS = (160, 480, 960)
+RECIPE_IMAGE_WORKERS = 2
+
+# Widths and formats recipe images can be requested in on demand.  The
+# copies are kept in a directory under MEDIA_ROOT and the least recently
+# used are deleted once they take more than RECIPE_IMAGE_CACHE_MAX_BYTES.
+RECIPE_IMAGE_CACHE_WIDTHS = (80, 160, 320, 480, 640, 960, 1280, 1920)
+RECIPE_IMAGE_CACHE_FORMATS = ('jpeg', 'png', 'webp')
+RECIPE_IMAGE_CACHE_DIR = 'cache/recipe'
+RECIPE_IMAGE_CACHE_MAX_BYTES = int(
+    os.environ.get('RECIPE_IMAGE_CACHE_MAX_BYTES', 1024 ** 3)
+)
+
+# Text search configuration used to build and query recipe vectors.
+RECIPE_SEARCH_CONFIG = 'english'
+
+# Rows fetched from the server side cursor at a time by the export.
+RECIPE_EXPORT_CHUNK_SIZE = 500
+
+# Default and largest number of objects the popular endpoints return.
+RECIPE_POPULAR_LIMIT = 10
+RECIPE_POPULAR_MAX_LIMIT = 100
+
+# Most recipes a shopping list can be built from in one request.
+RECIPE_SHOPPING_LIST_MAX_RECIPES = 100
@@ -15,11 +15,21 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
-from django.conf.urls.static import static
 from django.conf import settings
 
+from core import views as core_views
+
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('health/ready/', core_views.ready, name='ready'),
+    path('metrics', core_views.metrics_view, name='metrics'),
     path('api/user/', include('user.urls')),
     path('api/recipe/', include('recipe.urls')),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+]
+
+# Media on another host, like a CDN, is not routed here.
+if settings.MEDIA_URL.startswith('/'):
+    urlpatterns.append(path(
+        f'{settings.MEDIA_URL[1:]}<path:path>', core_views.media,
+        name='media'
+    ))
@@ -0,0 +1,129 @@
+import copy
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from rest_framework.authentication import TokenAuthentication
+
+
+logger = logging.getLogger(__name__)
+
+
+class TokenCache:
+    """Thread safe LRU cache of token keys to (user, token) pairs"""
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._keys_by_user = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return the cached (user, token) for a key, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1], entry[2]
+
+    def set(self, key, user, token):
+        """Cache a user and token under a key"""
+        with self._lock:
+            self._remove(key)
+            expires = time.monotonic() + self.ttl
+            self._entries[key] = (expires, user, token)
+            self._keys_by_user.setdefault(user.pk, set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, key):
+        """Drop a single token key"""
+        with self._lock:
+            self._remove(key)
+
+    def invalidate_user(self, user_id):
+        """Drop every token key cached for a user"""
+        with self._lock:
+            for key in list(self._keys_by_user.get(user_id, ())):
+                self._remove(key)
+
+    def clear(self):
+        """Drop all entries and reset the counters"""
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_user.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """Return the lookup counters and hit rate"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'size': len(self._entries),
+            }
+
+    def _remove(self, key):
+        """Remove a key, the caller must hold the lock"""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        keys = self._keys_by_user.get(entry[1].pk)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_user[entry[1].pk]
+
+
+token_cache = TokenCache(
+    max_size=settings.TOKEN_AUTH_CACHE_SIZE,
+    ttl=settings.TOKEN_AUTH_CACHE_TTL,
+)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """Token authentication that caches token lookups in process"""
+    # The cache lives in each worker process.  Receivers in core.signals
+    # invalidate it when a token or user changes in this process, and
+    # the TTL bounds how long other workers can lag behind.
+
+    def authenticate_credentials(self, key):
+        """Return the user and token for a key, hitting the cache first"""
+        cached = token_cache.get(key)
+        if cached is None:
+            user, token = super().authenticate_credentials(key)
+            token_cache.set(key, user, token)
+        else:
+            user, token = cached
+        self._report_stats()
+
+        # Hand out a copy so changes made while serving one request do
+        # not leak into the next request with the same token.
+        return copy.copy(user), token
+
+    def _report_stats(self):
+        """Log the hit rate every TOKEN_AUTH_CACHE_REPORT_EVERY lookups"""
+        every = settings.TOKEN_AUTH_CACHE_REPORT_EVERY
+        stats = token_cache.stats()
+        if every and (stats['hits'] + stats['misses']) % every == 0:
+            logger.info(
+                'Token cache: %(hits)d hits, %(misses)d misses, '
+                'hit rate %(hit_rate).2f, %(size)d entries',
+                stats
+            )
@@ -0,0 +1,22 @@
+from django.db.backends.postgresql import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """PostgreSQL connection checked before its first use in a request"""
+    # Set at the start of each request by
+    # core.signals.check_stale_connections.
+    health_check_pending = False
+
+    def ensure_connection(self):
+        """Connect, first closing a reused connection the server dropped"""
+        # Django only notices a dead connection after a query on it
+        # fails, so the first request after a database restart or an
+        # idle timeout would error.  Checking here, rather than as the
+        # request starts, only costs a round trip on the connections a
+        # request actually uses.
+        if self.health_check_pending:
+            self.health_check_pending = False
+            if self.connection is not None and \
+                    not self.in_atomic_block and not self.is_usable():
+                self.close()
+        super().ensure_connection()
@@ -0,0 +1,209 @@
+import io
+import itertools
+import json
+import math
+import time
+import tracemalloc
+from contextlib import ExitStack
+
+from PIL import Image
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, reset_queries
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core.models import Recipe
+
+
+# Users signed up by the user:create case, deleted once the run is over.
+SIGNUP_EMAIL_PREFIX = 'benchmark-signup-'
+
+
+def percentile(samples, pct):
+    """Return the nearest rank percentile of a list of samples"""
+    ordered = sorted(samples)
+    rank = max(math.ceil(pct / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+class Command(BaseCommand):
+    """Command to benchmark the API endpoints in process"""
+    help = 'Report latency, query count and peak memory for each route'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--email', default='seed0@example.com',
+                            help='user to make the requests as')
+        parser.add_argument('--password', default='benchmark')
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--warmup', type=int, default=5)
+        parser.add_argument('--output', default='benchmark.json')
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1:
+            raise CommandError('--iterations must be at least 1')
+        try:
+            user = get_user_model().objects.get(email=options['email'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(
+                f'No user {options["email"]}, run seed_data first'
+            )
+        token, _ = Token.objects.get_or_create(user=user)
+        recipe = Recipe.objects.filter(user=user).order_by('id').first()
+        if recipe is None:
+            raise CommandError(f'{options["email"]} has no recipes')
+
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        results = {}
+        cases = self._cases(user, recipe, options)
+        with override_settings(ALLOWED_HOSTS=['testserver']):
+            try:
+                for name, method, url, data in cases:
+                    results[name] = self._run(client, method, url, data,
+                                              options)
+            finally:
+                self._clean_up()
+        for name in results:
+            self.stdout.write(
+                f'{name}: p50 {results[name]["p50_ms"]:.2f}ms '
+                f'p95 {results[name]["p95_ms"]:.2f}ms '
+                f'p99 {results[name]["p99_ms"]:.2f}ms '
+                f'{results[name]["queries"]} queries '
+                f'{results[name]["peak_memory_kb"]:.0f}KiB'
+            )
+
+        report = {
+            'config': {
+                'email': options['email'],
+                'iterations': options['iterations'],
+                'warmup': options['warmup'],
+                'recipes': Recipe.objects.filter(user=user).count(),
+            },
+            'results': results,
+        }
+        with open(options['output'], 'w') as f:
+            json.dump(report, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(
+            f'Results written to {options["output"]}'
+        ))
+
+    def _cases(self, user, recipe, options):
+        """Return (name, method, url, data) for every route to measure"""
+        # Data given as a callable is called for every request.
+        credentials = {
+            'email': user.email,
+            'password': options['password'],
+        }
+        signups = itertools.count()
+        recipe_ids = Recipe.objects.filter(user=user).order_by(
+            'id'
+        ).values_list('id', flat=True)[:10]
+        self._ensure_image(recipe)
+        return [
+            ('recipe:tag-list', 'get', reverse('recipe:tag-list'), None),
+            ('recipe:tag-popular', 'get', reverse('recipe:tag-popular'),
+             None),
+            ('recipe:ingredient-list', 'get',
+             reverse('recipe:ingredient-list'), None),
+            ('recipe:ingredient-popular', 'get',
+             reverse('recipe:ingredient-popular'), None),
+            ('recipe:recipe-list', 'get', reverse('recipe:recipe-list'),
+             None),
+            ('recipe:recipe-detail', 'get',
+             reverse('recipe:recipe-detail', args=[recipe.id]), None),
+            ('recipe:recipe-export', 'get', reverse('recipe:recipe-export'),
+             None),
+            ('recipe:recipe-shopping-list', 'get',
+             reverse('recipe:recipe-shopping-list'),
+             {'recipes': ','.join(str(pk) for pk in recipe_ids)}),
+            ('recipe:recipe-upload-image', 'get',
+             reverse('recipe:recipe-upload-image', args=[recipe.id]), None),
+            ('recipe:recipe-image', 'get',
+             reverse('recipe:recipe-image', args=[recipe.id, 320, 'jpeg']),
+             None),
+            ('user:create', 'post', reverse('user:create'), lambda: {
+                'email': f'{SIGNUP_EMAIL_PREFIX}{next(signups)}@example.com',
+                'password': options['password'],
+                'name': 'Benchmark',
+            }),
+            ('user:me', 'get', reverse('user:me'), None),
+            ('user:token', 'post', reverse('user:token'), credentials),
+        ]
+
+    def _ensure_image(self, recipe):
+        """Give the recipe an image for the image routes if it has none"""
+        if recipe.image:
+            return
+        buffer = io.BytesIO()
+        Image.new('RGB', (1200, 800), 'orange').save(buffer, format='JPEG')
+        recipe.image.save('benchmark.jpg', ContentFile(buffer.getvalue()))
+        self.stdout.write(
+            f'Gave recipe {recipe.id} an image to benchmark the image routes'
+        )
+
+    def _clean_up(self):
+        """Delete what the write cases created"""
+        get_user_model().objects.filter(
+            email__startswith=SIGNUP_EMAIL_PREFIX
+        ).delete()
+
+    def _request(self, client, method, url, data):
+        """Make a request, reading a streamed body to its end"""
+        res = getattr(client, method)(url, data() if callable(data) else data)
+        if res.streaming:
+            for _ in res.streaming_content:
+                pass
+
+        return res
+
+    def _run(self, client, method, url, data, options):
+        """Time one route and record its queries and peak memory"""
+        def request():
+            return self._request(client, method, url, data)
+
+        for _ in range(options['warmup']):
+            request()
+
+        timings = []
+        for _ in range(options['iterations']):
+            start = time.perf_counter()
+            res = request()
+            timings.append((time.perf_counter() - start) * 1000)
+
+        # Count queries and trace memory on separate requests so neither
+        # skews the timings above.  The query log is capped in length, so
+        # empty it first, and read the count before the next request
+        # clears it again.
+        # Reads may go to the replicas, so count queries on every alias.
+        reset_queries()
+        with ExitStack() as stack:
+            contexts = [
+                stack.enter_context(CaptureQueriesContext(connection))
+                for connection in connections.all()
+            ]
+            request()
+        queries = sum(len(context.captured_queries) for context in contexts)
+        tracemalloc.start()
+        try:
+            request()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        return {
+            'method': method.upper(),
+            'url': url,
+            'status': res.status_code,
+            'p50_ms': percentile(timings, 50),
+            'p95_ms': percentile(timings, 95),
+            'p99_ms': percentile(timings, 99),
+            'mean_ms': sum(timings) / len(timings),
+            'queries': queries,
+            'peak_memory_kb': peak / 1024,
+        }
@@ -0,0 +1,105 @@
+import json
+import time
+from io import BytesIO
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from core.models import Recipe
+from core.parsers import FastJSONParser
+from core.renderers import FastJSONRenderer
+
+from recipe.serializers import RecipeValuesSerializer
+
+
+def best_time(func, iterations):
+    """Return the fastest of `iterations` calls to `func` in seconds"""
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    return min(timings)
+
+
+class Command(BaseCommand):
+    """Command to compare the stock and fast JSON renderer and parser"""
+    help = 'Report JSON render and parse times for the recipe list payload'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--email', default='seed0@example.com',
+                            help='user whose recipes make the payload')
+        parser.add_argument('--limit', type=int, default=10000,
+                            help='number of recipes in the payload')
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--output', default=None)
+
+    def handle(self, *args, **options):
+        try:
+            user = get_user_model().objects.get(email=options['email'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(
+                f'No user {options["email"]}, run seed_data first'
+            )
+        rows = Recipe.objects.filter(user=user).order_by('-id').values(
+            *RecipeValuesSerializer.columns
+        )[:options['limit']]
+        data = RecipeValuesSerializer(list(rows)).data
+        if not data:
+            raise CommandError(f'{options["email"]} has no recipes')
+
+        stock = JSONRenderer().render(data)
+        if FastJSONRenderer().render(data) != stock:
+            raise CommandError('The renderers produced different output')
+        if FastJSONParser().parse(BytesIO(stock)) != \
+                JSONParser().parse(BytesIO(stock)):
+            raise CommandError('The parsers produced different data')
+
+        iterations = options['iterations']
+        results = {}
+        for name, renderer, parser in (
+                ('stock', JSONRenderer(), JSONParser()),
+                ('fast', FastJSONRenderer(), FastJSONParser())):
+            results[name] = {
+                'render_ms': best_time(
+                    lambda: renderer.render(data), iterations
+                ) * 1000,
+                'parse_ms': best_time(
+                    lambda: parser.parse(BytesIO(stock)), iterations
+                ) * 1000,
+            }
+            self.stdout.write(
+                f'{name}: render {results[name]["render_ms"]:.2f}ms '
+                f'parse {results[name]["parse_ms"]:.2f}ms'
+            )
+
+        speedup = {
+            key: results['stock'][key] / results['fast'][key]
+            for key in ('render_ms', 'parse_ms')
+        }
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(data)} recipes, {len(stock)} bytes: render '
+            f'{speedup["render_ms"]:.1f}x, parse {speedup["parse_ms"]:.1f}x '
+            f'faster, output identical'
+        ))
+
+        if options['output']:
+            report = {
+                'config': {
+                    'email': options['email'],
+                    'recipes': len(data),
+                    'bytes': len(stock),
+                    'iterations': iterations,
+                },
+                'results': results,
+                'speedup': {
+                    'render': speedup['render_ms'],
+                    'parse': speedup['parse_ms'],
+                },
+            }
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
@@ -0,0 +1,149 @@
+import json
+import statistics
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import CommandError
+from django.db import connections
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core.management.commands import benchmark_api
+from core.middleware import record_query
+from core.models import Recipe
+
+
+TIMING_MIDDLEWARE = 'core.middleware.RequestTimingMiddleware'
+
+
+class Command(benchmark_api.Command):
+    """Command to measure what the request timing middleware costs"""
+    help = 'Compare route latency with and without RequestTimingMiddleware'
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--max-overhead', type=float, default=2.0,
+                            help='percent of added latency to fail above')
+        parser.set_defaults(output='benchmark_metrics.json')
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1:
+            raise CommandError('--iterations must be at least 1')
+        try:
+            user = get_user_model().objects.get(email=options['email'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(
+                f'No user {options["email"]}, run seed_data first'
+            )
+        token, _ = Token.objects.get_or_create(user=user)
+        recipe = Recipe.objects.filter(user=user).order_by('id').first()
+        if recipe is None:
+            raise CommandError(f'{options["email"]} has no recipes')
+
+        without = [name for name in settings.MIDDLEWARE
+                   if name != TIMING_MIDDLEWARE]
+        configs = {
+            'without': without,
+            'with': [TIMING_MIDDLEWARE, *without],
+        }
+        cases = self._cases(user, recipe, options)
+        timings = {name: {case[0]: [] for case in cases} for name in configs}
+        with override_settings(ALLOWED_HOSTS=['testserver'],
+                               REQUEST_METRICS_ENABLED=True):
+            # A client loads the middleware on its first request and
+            # keeps it, so each configuration gets its own.
+            clients = {}
+            for name, middleware in configs.items():
+                clients[name] = APIClient()
+                clients[name].credentials(
+                    HTTP_AUTHORIZATION=f'Token {token.key}'
+                )
+                with override_settings(MIDDLEWARE=middleware):
+                    clients[name].get(reverse('user:me'))
+
+            # Alternating the configurations request by request spreads
+            # drift, like caches warming or other load on the machine,
+            # evenly over both.
+            try:
+                for case, method, url, data in cases:
+                    for _ in range(options['warmup']):
+                        for client in clients.values():
+                            self._request(client, method, url, data)
+                    for i in range(options['iterations']):
+                        order = list(configs) if i % 2 else \
+                            list(configs)[::-1]
+                        for name in order:
+                            with self._query_timing(name == 'with'):
+                                start = time.perf_counter()
+                                self._request(
+                                    clients[name], method, url, data
+                                )
+                                timings[name][case].append(
+                                    (time.perf_counter() - start) * 1000
+                                )
+            finally:
+                self._clean_up()
+
+        results = {}
+        for case, *_ in cases:
+            base = statistics.median(timings['without'][case])
+            timed = statistics.median(timings['with'][case])
+            results[case] = {
+                'without_ms': base,
+                'with_ms': timed,
+                'overhead_pct': (timed - base) / base * 100,
+            }
+            self.stdout.write(
+                f'{case}: {base:.3f}ms -> {timed:.3f}ms '
+                f'({results[case]["overhead_pct"]:+.2f}%)'
+            )
+        # Averaged per route, so slow routes don't hide the cost on
+        # fast ones.
+        overhead = statistics.mean(
+            result['overhead_pct'] for result in results.values()
+        )
+
+        with open(options['output'], 'w') as f:
+            json.dump({
+                'config': {
+                    'email': options['email'],
+                    'iterations': options['iterations'],
+                },
+                'results': results,
+                'overhead_pct': overhead,
+            }, f, indent=2)
+
+        if overhead > options['max_overhead']:
+            raise CommandError(
+                f'Timing middleware adds {overhead:.2f}%, more than '
+                f'{options["max_overhead"]}%'
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Timing middleware adds {overhead:.2f}% on average'
+        ))
+
+    @contextmanager
+    def _query_timing(self, enabled):
+        """Install record_query on the connections only if `enabled`"""
+        # core.signals installs it on every connection, so the baseline
+        # would otherwise pay the per-query cost too.  The setting stops
+        # connections opened during the request getting it back.
+        for connection in connections.all():
+            wrappers = connection.execute_wrappers
+            if enabled and record_query not in wrappers:
+                wrappers.append(record_query)
+            elif not enabled and record_query in wrappers:
+                wrappers.remove(record_query)
+        try:
+            with override_settings(REQUEST_METRICS_ENABLED=enabled):
+                yield
+        finally:
+            if not enabled and settings.REQUEST_METRICS_ENABLED:
+                for connection in connections.all():
+                    if record_query not in connection.execute_wrappers:
+                        connection.execute_wrappers.append(record_query)
@@ -0,0 +1,94 @@
+import json
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Prefetch
+
+from rest_framework.renderers import JSONRenderer
+
+from core.models import Tag, Ingredient, Recipe
+
+from recipe.serializers import RecipeSerializer, RecipeValuesSerializer
+
+
+class Command(BaseCommand):
+    """Command to compare the recipe list serializers"""
+    help = 'Report recipe list throughput of the model and values() paths'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--email', default='seed0@example.com',
+                            help='user whose recipes are serialized')
+        parser.add_argument('--limit', type=int, default=10000,
+                            help='number of recipes serialized per run')
+        parser.add_argument('--iterations', type=int, default=5)
+        parser.add_argument('--output', default=None)
+
+    def handle(self, *args, **options):
+        try:
+            user = get_user_model().objects.get(email=options['email'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(
+                f'No user {options["email"]}, run seed_data first'
+            )
+        recipes = Recipe.objects.filter(user=user).order_by('-id')
+        if not recipes.exists():
+            raise CommandError(f'{options["email"]} has no recipes')
+
+        # The same queries RecipeViewSet.list runs for each path
+        limit = options['limit']
+        paths = {
+            'serializer': lambda: RecipeSerializer(
+                recipes.prefetch_related(
+                    Prefetch('tags', queryset=Tag.objects.order_by('id')),
+                    Prefetch('ingredients',
+                             queryset=Ingredient.objects.order_by('id'))
+                )[:limit],
+                many=True
+            ).data,
+            'values': lambda: RecipeValuesSerializer(
+                list(recipes.values(*RecipeValuesSerializer.columns)[:limit])
+            ).data,
+        }
+
+        renderer = JSONRenderer()
+        outputs = {}
+        results = {}
+        for name, serialize in paths.items():
+            data = serialize()
+            outputs[name] = renderer.render(data)
+            timings = []
+            for _ in range(options['iterations']):
+                start = time.perf_counter()
+                renderer.render(serialize())
+                timings.append(time.perf_counter() - start)
+            best = min(timings)
+            results[name] = {
+                'best_ms': best * 1000,
+                'recipes_per_second': len(data) / best,
+            }
+            self.stdout.write(
+                f'{name}: {results[name]["best_ms"]:.1f}ms '
+                f'{results[name]["recipes_per_second"]:.0f} recipes/s'
+            )
+
+        if outputs['serializer'] != outputs['values']:
+            raise CommandError('The serializers rendered different output')
+        speedup = results['serializer']['best_ms'] / \
+            results['values']['best_ms']
+        self.stdout.write(self.style.SUCCESS(
+            f'values() path is {speedup:.1f}x faster, output identical'
+        ))
+
+        if options['output']:
+            report = {
+                'config': {
+                    'email': options['email'],
+                    'recipes': len(data),
+                    'iterations': options['iterations'],
+                },
+                'results': results,
+                'speedup': speedup,
+            }
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
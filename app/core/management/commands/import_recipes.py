@@ -0,0 +1,265 @@
+import csv
+import io
+import itertools
+import json
+import os
+import sys
+from collections import Counter
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from core.models import Tag, Ingredient, Recipe, ImportProgress
+
+from recipe.cache import bump_list_version
+from recipe.search import update_search_vectors
+from recipe.usage import adjust_usage
+
+
+RECIPE_FIELDS = ('title', 'time_minutes', 'price', 'link')
+LINKS = (('tags', Tag), ('ingredients', Ingredient))
+
+
+class Command(BaseCommand):
+    """Command to bulk import recipes from a JSONL or CSV catalog"""
+    help = 'Import recipes with their tag and ingredient names in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='JSONL or CSV file, - for stdin')
+        parser.add_argument('--format', choices=('jsonl', 'csv'),
+                            help='defaults to the file extension')
+        parser.add_argument('--user',
+                            help='email of the owner of records that '
+                                 'have no user field')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--copy', action='store_true',
+                            help='load rows with COPY instead of INSERT')
+        parser.add_argument('--job',
+                            help='name progress is saved under, defaults '
+                                 'to the absolute path')
+        parser.add_argument('--restart', action='store_true',
+                            help='ignore saved progress for the job')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if path == '-' and not options['job']:
+            raise CommandError('--job is required when reading stdin')
+        job = options['job'] or os.path.abspath(path)
+        fmt = options['format'] or (
+            'csv' if path.lower().endswith('.csv') else 'jsonl'
+        )
+
+        progress, _ = ImportProgress.objects.get_or_create(source=job)
+        if options['restart']:
+            progress.records = 0
+            progress.completed = False
+            progress.save()
+        if progress.completed:
+            self.stdout.write(f'{job} was already imported')
+            return
+        if progress.records:
+            self.stdout.write(f'Resuming after record {progress.records}')
+
+        self.default_user = options['user']
+        self.use_copy = options['copy']
+        self.users = {}
+        self.names = {}
+        stream = sys.stdin if path == '-' else \
+            open(path, newline='', encoding='utf-8')
+        with stream:
+            # Committed records are skipped by reading past them, which
+            # works for pipes as well as files.
+            records = itertools.islice(
+                self._read(stream, fmt), progress.records, None
+            )
+            while True:
+                batch = list(itertools.islice(records, options['batch_size']))
+                if not batch:
+                    break
+                with transaction.atomic():
+                    touched = self._import_batch(batch, progress.records)
+                    progress.records += len(batch)
+                    progress.save()
+                    # Bulk inserts skip the receivers that invalidate
+                    # cached lists.  The bump waits for this batch to
+                    # commit, so a later failure can't leave it stale.
+                    for user_id in touched:
+                        bump_list_version(user_id, Tag)
+                        bump_list_version(user_id, Ingredient)
+                self.stdout.write(f'Imported {progress.records} records')
+
+        progress.completed = True
+        progress.save()
+        self.stdout.write(self.style.SUCCESS(
+            f'Finished importing {progress.records} records'
+        ))
+
+    def _read(self, stream, fmt):
+        """Yield each record of the source as a dict"""
+        if fmt == 'csv':
+            for row in csv.DictReader(stream):
+                for name, _ in LINKS:
+                    # the CSV export joins names the same way
+                    row[name] = (row.get(name) or '').split(';')
+                yield row
+            return
+
+        for number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as exc:
+                raise CommandError(f'Line {number}: {exc}')
+
+    def _import_batch(self, records, offset):
+        """Insert a batch of records, returning the IDs of their users"""
+        now = timezone.now()
+        recipes = []
+        links = {name: [] for name, _ in LINKS}
+        for number, record in enumerate(records, start=offset + 1):
+            user_id = self._user_id(record, number)
+            recipes.append((user_id, self._clean(record, number)))
+            for name, _ in LINKS:
+                links[name].append(self._names(record, name, number))
+
+        ids = self._allocate_ids(len(recipes))
+        self._insert(Recipe, ['id', 'user_id', *RECIPE_FIELDS, 'modified'], [
+            (recipe_id, user_id, *values, now)
+            for recipe_id, (user_id, values) in zip(ids, recipes)
+        ])
+        for name, model in LINKS:
+            self._link(name, model, ids, recipes, links[name], now)
+        update_search_vectors(ids)
+
+        return {user_id for user_id, _ in recipes}
+
+    def _user_id(self, record, number):
+        """Return the ID of the user owning a record"""
+        email = record.get('user') or self.default_user
+        if not email:
+            raise CommandError(f'Record {number}: no user, pass --user')
+        if email not in self.users:
+            try:
+                self.users[email] = get_user_model().objects.values_list(
+                    'id', flat=True
+                ).get(email=email)
+            except get_user_model().DoesNotExist:
+                raise CommandError(f'Record {number}: no user {email}')
+
+        return self.users[email]
+
+    def _clean(self, record, number):
+        """Validate a record's recipe fields with the model's rules"""
+        values = []
+        for name in RECIPE_FIELDS:
+            field = Recipe._meta.get_field(name)
+            value = record.get(name)
+            if value is None and name == 'link':
+                value = ''
+            try:
+                values.append(field.clean(value, None))
+            except ValidationError as exc:
+                raise CommandError(
+                    f'Record {number}: {name}: {" ".join(exc.messages)}'
+                )
+
+        return values
+
+    def _names(self, record, name, number):
+        """Return a record's distinct tag or ingredient names in order"""
+        value = record.get(name) or []
+        if isinstance(value, str):
+            value = value.split(';')
+        names = []
+        for item in value:
+            item = str(item).strip()
+            if len(item) > 255:
+                raise CommandError(
+                    f'Record {number}: {name}: {item[:20]}... is too long'
+                )
+            if item and item not in names:
+                names.append(item)
+
+        return names
+
+    def _allocate_ids(self, count):
+        """Reserve primary keys for a batch of recipes"""
+        # Taking IDs from the sequence up front lets the through rows be
+        # built without reading the recipes back, and works for COPY.
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT nextval(pg_get_serial_sequence(%s, %s)) '
+                'FROM generate_series(1, %s)',
+                [Recipe._meta.db_table, 'id', count]
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def _link(self, name, model, ids, recipes, names, now):
+        """Link the batch's recipes to their tags or ingredients by name"""
+        name_map = {}
+        missing = {}
+        for (user_id, _), record_names in zip(recipes, names):
+            if user_id not in name_map:
+                name_map[user_id] = self._name_map(model, user_id)
+            missing.setdefault(user_id, []).extend(
+                attr_name for attr_name in record_names
+                if attr_name not in name_map[user_id]
+            )
+        for user_id, attr_names in missing.items():
+            name_map[user_id].update(
+                model.objects.upsert_names(user_id, attr_names)
+            )
+
+        field = Recipe._meta.get_field(name)
+        rows = [
+            (recipe_id, name_map[user_id][attr_name])
+            for recipe_id, (user_id, _), record_names
+            in zip(ids, recipes, names)
+            for attr_name in record_names
+        ]
+        self._insert(
+            field.remote_field.through,
+            [field.m2m_column_name(), field.m2m_reverse_name()],
+            rows
+        )
+        # Linking changes the assigned_only lists and the recipe counts,
+        # see recipe.signals.
+        adjust_usage(model, Counter(attr_id for _, attr_id in rows),
+                     modified=now)
+
+    def _name_map(self, model, user_id):
+        """Return a user's name to ID map for tags or ingredients"""
+        key = (model, user_id)
+        if key not in self.names:
+            self.names[key] = dict(
+                model.objects.filter(user_id=user_id).values_list('name', 'id')
+            )
+
+        return self.names[key]
+
+    def _insert(self, model, columns, rows):
+        """Insert rows given as tuples lined up with `columns`"""
+        if not rows:
+            return
+        if not self.use_copy:
+            model.objects.bulk_create(
+                model(**dict(zip(columns, row))) for row in rows
+            )
+            return
+
+        # Strings are quoted, which keeps empty ones from loading as NULL
+        buffer = io.StringIO()
+        csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC).writerows(rows)
+        buffer.seek(0)
+        quote = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.copy_expert(
+                f'COPY {quote(model._meta.db_table)} '
+                f'({", ".join(quote(column) for column in columns)}) '
+                f'FROM STDIN WITH (FORMAT csv)',
+                buffer
+            )
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from recipe.usage import USAGE_LINKS, recount_usage
+
+
+class Command(BaseCommand):
+    """Command to repair the recipe counts of tags and ingredients"""
+    help = 'Recompute how many recipes use each tag and ingredient'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000,
+                            help='objects recounted per transaction')
+
+    def handle(self, *args, **options):
+        for model in USAGE_LINKS:
+            fixed = 0
+            last_id = 0
+            while True:
+                # Batches keep each UPDATE's row locks short lived on
+                # tables that are being written to.
+                ids = list(model.objects.filter(pk__gt=last_id).order_by(
+                    'pk'
+                ).values_list('pk', flat=True)[:options['batch_size']])
+                if not ids:
+                    break
+                fixed += recount_usage(model, ids)
+                last_id = ids[-1]
+            self.stdout.write(
+                f'Fixed {fixed} {model._meta.verbose_name} counts'
+            )
+        self.stdout.write(self.style.SUCCESS('Recipe counts are up to date'))
@@ -0,0 +1,121 @@
+import random
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from rest_framework.authtoken.models import Token
+
+from core.models import Tag, Ingredient, Recipe
+
+from recipe.search import update_search_vectors
+from recipe.usage import recount_usage
+
+
+class Command(BaseCommand):
+    """Command to fill the database with a synthetic dataset"""
+    help = 'Bulk insert users with recipes, tags and ingredients'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10)
+        parser.add_argument('--recipes', type=int, default=100,
+                            help='recipes per user')
+        parser.add_argument('--tags', type=int, default=20,
+                            help='tags per user')
+        parser.add_argument('--ingredients', type=int, default=30,
+                            help='ingredients per user')
+        parser.add_argument('--links', type=int, default=3,
+                            help='tags and ingredients linked per recipe')
+        parser.add_argument('--password', default='benchmark')
+        parser.add_argument('--email-prefix', default='seed')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=0,
+                            help='random seed for the recipe links')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        batch_size = options['batch_size']
+        prefix = options['email_prefix']
+        # Hashing is deliberately slow, so every user shares one hash.
+        password = make_password(options['password'])
+
+        with transaction.atomic():
+            users = get_user_model().objects.bulk_create(
+                (
+                    get_user_model()(
+                        email=f'{prefix}{i}@example.com',
+                        name=f'Seed User {i}',
+                        password=password,
+                    )
+                    for i in range(options['users'])
+                ),
+                batch_size=batch_size
+            )
+            Token.objects.bulk_create(
+                (Token(user=user, key=Token().generate_key())
+                 for user in users),
+                batch_size=batch_size
+            )
+            tags = self._create_attrs(Tag, users, options['tags'],
+                                      batch_size)
+            ingredients = self._create_attrs(
+                Ingredient, users, options['ingredients'], batch_size
+            )
+            recipes = Recipe.objects.bulk_create(
+                (
+                    Recipe(
+                        user=user,
+                        title=f'Recipe {i}',
+                        time_minutes=rng.randint(5, 180),
+                        price=rng.randint(100, 99999) / 100,
+                    )
+                    for user in users
+                    for i in range(options['recipes'])
+                ),
+                batch_size=batch_size
+            )
+            for field, attrs in (('tags', tags), ('ingredients', ingredients)):
+                self._link(rng, field, recipes, attrs, options['links'],
+                           batch_size)
+            # bulk inserts skip the receivers that maintain the vectors
+            # and recipe counts
+            update_search_vectors([recipe.id for recipe in recipes])
+            recount_usage(Tag, [tag.id for tag in tags])
+            recount_usage(Ingredient, [attr.id for attr in ingredients])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {len(users)} users, {len(recipes)} recipes, '
+            f'{len(tags)} tags and {len(ingredients)} ingredients'
+        ))
+
+    def _create_attrs(self, model, users, count, batch_size):
+        """Bulk insert `count` tags or ingredients for every user"""
+        return model.objects.bulk_create(
+            (
+                model(user=user, name=f'{model.__name__} {i}')
+                for user in users
+                for i in range(count)
+            ),
+            batch_size=batch_size
+        )
+
+    def _link(self, rng, field, recipes, attrs, links, batch_size):
+        """Bulk insert random links between recipes and their user's attrs"""
+        by_user = {}
+        for attr in attrs:
+            by_user.setdefault(attr.user_id, []).append(attr.id)
+
+        through = getattr(Recipe, field).through
+        column = Recipe._meta.get_field(field).m2m_reverse_name()
+        through.objects.bulk_create(
+            (
+                through(**{'recipe_id': recipe.id, column: attr_id})
+                for recipe in recipes
+                for attr_id in rng.sample(
+                    by_user.get(recipe.user_id, []),
+                    min(links, len(by_user.get(recipe.user_id, [])))
+                )
+            ),
+            batch_size=batch_size
+        )
@@ -2,19 +2,44 @@ import time
 
 from django.db import connections
 from django.db.utils import OperationalError
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 
 
 class Command(BaseCommand):
     """Command to pause database connection until db is available"""
 
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+        parser.add_argument('--timeout', type=float, default=60,
+                            help='seconds to wait before giving up')
+        parser.add_argument('--delay', type=float, default=0.5,
+                            help='seconds before the first retry')
+        parser.add_argument('--max-delay', type=float, default=5,
+                            help='upper bound on the wait between probes')
+
     def handle(self, *args, **options):
         self.stdout.write('Waiting for database...')
-        db_conn = None
-        while not db_conn:
+        connection = connections[options['database']]
+        deadline = time.monotonic() + options['timeout']
+        delay = options['delay']
+        while True:
             try:
-                db_conn = connections['default']
+                # Looking the connection up doesn't connect, so open it
+                # and run a query to know the server accepts them.
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+                break
             except OperationalError:
-                self.stdout.write('Database unavailable, waiting 1 second...')
-                time.sleep(1)
+                connection.close()
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise CommandError(
+                        f'Database unavailable after {options["timeout"]}s'
+                    )
+                wait = min(delay, remaining)
+                self.stdout.write(
+                    f'Database unavailable, waiting {wait:g} seconds...'
+                )
+                time.sleep(wait)
+                delay = min(delay * 2, options['max_delay'])
         self.stdout.write('Database available!')
@@ -0,0 +1,178 @@
+import bisect
+import threading
+
+
+# Seconds, from a fast cached list to a slow export.
+DURATION_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10
+)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Every metric created below, in the order they are rendered.
+REGISTRY = []
+# One lock for all of them, so a request's observations are recorded
+# with a single acquisition.
+LOCK = threading.Lock()
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n') \
+        .replace('"', r'\"')
+
+
+def _format_labels(names, values, extra=''):
+    pairs = [
+        f'{name}="{_escape(value)}"' for name, value in zip(names, values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Base for metrics kept per set of label values in this process"""
+    # Each worker process keeps its own values, so with several workers
+    # every process needs to be scraped.
+    type = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._series = {}
+        REGISTRY.append(self)
+
+    def clear(self):
+        """Drop every recorded series"""
+        with LOCK:
+            self._series.clear()
+
+    def collect(self):
+        """Yield the lines of the text exposition format"""
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} {self.type}'
+        # Copy the histogram buckets so requests can keep recording
+        # while the lines are built.
+        with LOCK:
+            series = sorted(
+                (values, list(state) if isinstance(state, list) else state)
+                for values, state in self._series.items()
+            )
+        for values, state in series:
+            yield from self.collect_series(values, state)
+
+    def collect_series(self, values, state):
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """Count of events that only goes up"""
+    type = 'counter'
+
+    def inc(self, *values, amount=1):
+        """Add `amount` to the series for the label values"""
+        with LOCK:
+            self._inc(values, amount)
+
+    def _inc(self, values, amount):
+        self._series[values] = self._series.get(values, 0) + amount
+
+    def collect_series(self, values, state):
+        yield f'{self.name}{_format_labels(self.labels, values)} ' \
+            f'{_format_value(state)}'
+
+
+class Histogram(Metric):
+    """Distribution of observations over fixed buckets"""
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labels=(),
+                 buckets=DURATION_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(float(bound) for bound in buckets))
+
+    def observe(self, value, *values):
+        """Record an observation in the series for the label values"""
+        with LOCK:
+            self._observe(value, values)
+
+    def _observe(self, value, values):
+        # Only the bucket the value falls in is counted here, the
+        # cumulative counts are worked out when rendering.
+        state = self._series.get(values)
+        if state is None:
+            state = self._series[values] = [0] * (len(self.buckets) + 2)
+        state[bisect.bisect_left(self.buckets, value)] += 1
+        state[-1] += value
+
+    def collect_series(self, values, state):
+        *counts, total = state
+        cumulative = 0
+        for bound, count in zip((*self.buckets, '+Inf'), counts):
+            cumulative += count
+            le = 'le="+Inf"' if bound == '+Inf' else \
+                f'le="{_format_value(bound)}"'
+            yield f'{self.name}_bucket' \
+                f'{_format_labels(self.labels, values, le)} {cumulative}'
+        labels = _format_labels(self.labels, values)
+        yield f'{self.name}_sum{labels} {_format_value(total)}'
+        yield f'{self.name}_count{labels} {cumulative}'
+
+
+def render():
+    """Return every registered metric in the text exposition format"""
+    return '\n'.join(
+        line for metric in REGISTRY for line in metric.collect()
+    ) + '\n'
+
+
+ROUTE_LABELS = ('view', 'action', 'method')
+
+request_duration = Histogram(
+    'http_request_duration_seconds',
+    'Time spent handling requests, including middleware.',
+    ROUTE_LABELS
+)
+request_db_duration = Histogram(
+    'http_request_db_duration_seconds',
+    'Time spent running SQL queries while handling requests.',
+    ROUTE_LABELS
+)
+request_view_duration = Histogram(
+    'http_request_view_duration_seconds',
+    'Time spent in the view, including its SQL queries.',
+    ROUTE_LABELS
+)
+request_render_duration = Histogram(
+    'http_request_render_duration_seconds',
+    'Time spent rendering response bodies.',
+    ROUTE_LABELS
+)
+request_queries = Histogram(
+    'http_request_db_queries',
+    'Number of SQL queries run while handling requests.',
+    ROUTE_LABELS,
+    buckets=QUERY_BUCKETS
+)
+responses = Counter(
+    'http_responses_total',
+    'Responses sent, by status code.',
+    ROUTE_LABELS + ('status',)
+)
+
+
+def record_request(labels, status, total, db, view, render, queries):
+    """Record the timings of one request"""
+    with LOCK:
+        request_duration._observe(total, labels)
+        request_db_duration._observe(db, labels)
+        request_view_duration._observe(view, labels)
+        request_render_duration._observe(render, labels)
+        request_queries._observe(queries, labels)
+        responses._inc((*labels, status), 1)
@@ -0,0 +1,127 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from core import metrics
+from core.routers import replica_reads, is_sticky, stick_to_primary
+
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+# Other methods share a label, so arbitrary ones can't add series.
+KNOWN_METHODS = SAFE_METHODS + ('POST', 'PUT', 'PATCH', 'DELETE')
+
+# Timings of the request the thread is handling, see record_query.
+_timing = threading.local()
+
+
+class ReplicaRoutingMiddleware:
+    """Read from the replicas while handling safe method requests"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        client = self.client_key(request)
+        if request.method in SAFE_METHODS:
+            if is_sticky(client):
+                return self.get_response(request)
+            with replica_reads():
+                return self.get_response(request)
+
+        response = self.get_response(request)
+        # Any write may have changed rows, even when it failed part way.
+        stick_to_primary(client)
+        return response
+
+    def client_key(self, request):
+        """Identify the client for read-your-writes stickiness"""
+        # Authentication runs in the views, after routing is decided, so
+        # use the credentials sent rather than the user they belong to.
+        return request.META.get('HTTP_AUTHORIZATION') or \
+            request.COOKIES.get(settings.SESSION_COOKIE_NAME) or \
+            request.META.get('REMOTE_ADDR', '')
+
+
+def record_query(execute, sql, params, many, context):
+    """Add a query's duration to the timings of the current request"""
+    # Installed on every connection by core.signals, rather than for
+    # each request, to keep the per-request cost down.
+    timing = getattr(_timing, 'current', None)
+    if timing is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timing['db'] += time.perf_counter() - start
+        timing['queries'] += 1
+
+
+class RequestTimingMiddleware:
+    """Time the SQL, view and rendering of each request"""
+    # Adds a Server-Timing header and records the timings in the
+    # per-route histograms of core.metrics, served at /metrics.
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timing = request._timing = {
+            'queries': 0, 'db': 0.0, 'view_start': None, 'view_end': None,
+            'action': '',
+        }
+        _timing.current = timing
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _timing.current = None
+        end = time.perf_counter()
+
+        # Queries run while a streaming body is sent aren't included.
+        view_start = timing['view_start'] or start
+        view_end = timing['view_end'] or end
+        db = timing['db']
+        view = view_end - view_start
+        render = end - view_end
+        total = end - start
+        metrics.record_request(
+            self.route_labels(request), str(response.status_code),
+            total, db, view, render, timing['queries']
+        )
+
+        if settings.SERVER_TIMING_ENABLED:
+            response['Server-Timing'] = (
+                f'db;dur={db * 1000:.2f};desc="{timing["queries"]} '
+                f'queries", view;dur={view * 1000:.2f}, '
+                f'render;dur={render * 1000:.2f}, total;dur={total * 1000:.2f}'
+            )
+
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._timing['view_start'] = time.perf_counter()
+        # Viewsets map each HTTP method to an action on the view function
+        actions = getattr(view_func, 'actions', None)
+        if actions:
+            request._timing['action'] = \
+                actions.get(request.method.lower(), '')
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered once this returns, so the view is
+        # done here.
+        request._timing['view_end'] = time.perf_counter()
+        return response
+
+    def route_labels(self, request):
+        """Return the view, action and method labels for a request"""
+        # The URL name rather than the path, so IDs don't add series.
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unmatched'
+        method = request.method if request.method in KNOWN_METHODS \
+            else 'other'
+        return view, request._timing['action'], method
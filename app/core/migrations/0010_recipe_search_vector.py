@@ -0,0 +1,43 @@
+# Generated by Django 2.1.15 on 2026-10-18 20:49
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.conf import settings
+from django.db import migrations
+
+
+def build_search_vectors(apps, schema_editor):
+    """Fill in the search vector of every existing recipe"""
+    schema_editor.execute(
+        "UPDATE core_recipe r SET search_vector = "
+        "setweight(to_tsvector(%(config)s, r.title), 'A') || "
+        "setweight(to_tsvector(%(config)s, coalesce(("
+        "SELECT string_agg(i.name, ' ') FROM core_ingredient i "
+        "JOIN core_recipe_ingredients l ON l.ingredient_id = i.id "
+        "WHERE l.recipe_id = r.id), '')), 'B') || "
+        "setweight(to_tsvector(%(config)s, coalesce(("
+        "SELECT string_agg(t.name, ' ') FROM core_tag t "
+        "JOIN core_recipe_tags l ON l.tag_id = t.id "
+        "WHERE l.recipe_id = r.id), '')), 'C')",
+        params={'config': settings.RECIPE_SEARCH_CONFIG}
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_drop_redundant_user_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='core_recipe_search__c01407_gin'),
+        ),
+        migrations.RunPython(build_search_vectors, migrations.RunPython.noop),
+    ]
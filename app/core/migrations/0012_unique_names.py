@@ -0,0 +1,53 @@
+# Generated by Django 2.1.15 on 2026-10-18 21:16
+
+from django.db import migrations
+
+
+def merge_duplicate_names(apps, schema_editor):
+    """Fold each user's same-named tags and ingredients into the oldest"""
+    for table, through, column in (
+            ('core_tag', 'core_recipe_tags', 'tag_id'),
+            ('core_ingredient', 'core_recipe_ingredients', 'ingredient_id')):
+        schema_editor.execute(
+            f"CREATE TEMPORARY TABLE merged AS "
+            f"SELECT id, keep FROM (SELECT id, MIN(id) OVER "
+            f"(PARTITION BY user_id, name) AS keep FROM {table}) d "
+            f"WHERE id <> keep"
+        )
+        # Move the links over, skipping recipes linked to both already
+        schema_editor.execute(
+            f"INSERT INTO {through} (recipe_id, {column}) "
+            f"SELECT DISTINCT l.recipe_id, m.keep FROM {through} l "
+            f"JOIN merged m ON m.id = l.{column} "
+            f"ON CONFLICT DO NOTHING"
+        )
+        schema_editor.execute(
+            f"DELETE FROM {through} l USING merged m "
+            f"WHERE l.{column} = m.id"
+        )
+        schema_editor.execute(
+            f"DELETE FROM {table} t USING merged m WHERE t.id = m.id"
+        )
+        schema_editor.execute("DROP TABLE merged")
+    # Run the deferred foreign key checks now, PostgreSQL won't alter a
+    # table with some still pending.
+    schema_editor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_import_progress'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_names, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='ingredient',
+            unique_together={('user', 'name')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='tag',
+            unique_together={('user', 'name')},
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 2.1.15 on 2026-10-18 21:33
+
+from django.db import migrations, models
+
+
+def count_recipes(apps, schema_editor):
+    """Fill in the recipe count of every existing tag and ingredient"""
+    for table, through, column in (
+            ('core_tag', 'core_recipe_tags', 'tag_id'),
+            ('core_ingredient', 'core_recipe_ingredients', 'ingredient_id')):
+        schema_editor.execute(
+            f"UPDATE {table} t SET recipe_count = c.recipe_count "
+            f"FROM (SELECT {column} AS id, count(*) AS recipe_count "
+            f"FROM {through} GROUP BY {column}) c WHERE t.id = c.id"
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_unique_names'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingredient',
+            name='recipe_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='recipe_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_recipes, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='ingredient',
+            index=models.Index(fields=['user', '-recipe_count', 'name'], name='core_ingred_user_id_67104a_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tag',
+            index=models.Index(fields=['user', '-recipe_count', 'name'], name='core_tag_user_id_6175d2_idx'),
+        ),
+    ]
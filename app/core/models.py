@@ -1,7 +1,10 @@
 import os
 import uuid
 
-from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.db import connections, models, router
+from django.utils import timezone
 from django.contrib.auth.models import \
     AbstractBaseUser, \
     BaseUserManager, \
@@ -49,6 +52,31 @@ class UserManager(BaseUserManager):
         return user
 
 
+class NamedObjectManager(models.Manager):
+    """Manager for the tags and ingredients a user names"""
+
+    def upsert_names(self, user_id, names):
+        """Return a name to ID map for `names`, creating missing ones"""
+        # A single INSERT ... ON CONFLICT resolves existing names and
+        # creates the rest, without racing concurrent requests.  The
+        # no-op update makes existing rows come back from RETURNING.
+        names = list(dict.fromkeys(names))
+        if not names:
+            return {}
+        db = router.db_for_write(self.model)
+        table = connections[db].ops.quote_name(self.model._meta.db_table)
+        with connections[db].cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} (user_id, name, modified, recipe_count) '
+                f'SELECT %s, UNNEST(%s::varchar[]), %s, 0 '
+                f'ON CONFLICT (user_id, name) '
+                f'DO UPDATE SET name = EXCLUDED.name '
+                f'RETURNING name, id',
+                [user_id, names, timezone.now()]
+            )
+            return dict(cursor.fetchall())
+
+
 # Custom user model.
 # NOTE: this also needs to be added to settings.py to tell Django that
 #       we intend to use this model instead of the default user model.
@@ -68,10 +96,32 @@ class User(AbstractBaseUser, PermissionsMixin):
 class Tag(models.Model):
     """Tag to be used for a recipe"""
     name = models.CharField(max_length=255)
+    # The composite indexes below all lead with user, so the default
+    # single column index would be redundant.
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
+        db_index=False,
     )
+    # Also touched when the object is linked to or unlinked from a
+    # recipe, see recipe.signals.
+    modified = models.DateTimeField(auto_now=True)
+    # Number of recipes linked, kept up to date by recipe.signals.
+    recipe_count = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = NamedObjectManager()
+
+    class Meta:
+        # Names are unique per user so recipes can refer to them by name.
+        # The constraint's index also backs the per-user name ordering
+        # used to paginate the list.
+        unique_together = [('user', 'name')]
+        # Back the last modified lookup for conditional requests and the
+        # most used objects.
+        indexes = [
+            models.Index(fields=['user', 'modified']),
+            models.Index(fields=['user', '-recipe_count', 'name']),
+        ]
 
     def __str__(self):
         return self.name
@@ -80,10 +130,32 @@ class Tag(models.Model):
 class Ingredient(models.Model):
     """Ingredient to be used in recipe"""
     name = models.CharField(max_length=255)
+    # The composite indexes below all lead with user, so the default
+    # single column index would be redundant.
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
+        db_index=False,
     )
+    # Also touched when the object is linked to or unlinked from a
+    # recipe, see recipe.signals.
+    modified = models.DateTimeField(auto_now=True)
+    # Number of recipes linked, kept up to date by recipe.signals.
+    recipe_count = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = NamedObjectManager()
+
+    class Meta:
+        # Names are unique per user so recipes can refer to them by name.
+        # The constraint's index also backs the per-user name ordering
+        # used to paginate the list.
+        unique_together = [('user', 'name')]
+        # Back the last modified lookup for conditional requests and the
+        # most used objects.
+        indexes = [
+            models.Index(fields=['user', 'modified']),
+            models.Index(fields=['user', '-recipe_count', 'name']),
+        ]
 
     def __str__(self):
         return self.name
@@ -93,7 +165,8 @@ class Recipe(models.Model):
     """Recipe object"""
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
-        on_delete=models.CASCADE
+        on_delete=models.CASCADE,
+        db_index=False,
     )
     title = models.CharField(max_length=255)
     time_minutes = models.IntegerField()
@@ -102,6 +175,38 @@ class Recipe(models.Model):
     ingredients = models.ManyToManyField('Ingredient')
     tags = models.ManyToManyField('Tag')
     image = models.ImageField(null=True, upload_to=recipe_image_file_path)
+    # Also touched when tags or ingredients are linked, unlinked or
+    # changed, see recipe.signals.
+    modified = models.DateTimeField(auto_now=True)
+    # Title plus linked ingredient and tag names, kept up to date by
+    # recipe.signals so searches never build vectors on the fly.
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta:
+        # Backs the per-user, newest first ordering used to paginate,
+        # the price and time range filters on the recipe list, the last
+        # modified lookup for conditional requests, text search and the
+        # image lookup done before serving media.
+        indexes = [
+            models.Index(fields=['user', 'id']),
+            models.Index(fields=['user', 'price']),
+            models.Index(fields=['user', 'time_minutes']),
+            models.Index(fields=['user', 'modified']),
+            GinIndex(fields=['search_vector']),
+            models.Index(fields=['image']),
+        ]
 
     def __str__(self):
         return self.title
+
+
+class ImportProgress(models.Model):
+    """How far the import_recipes command got through a source"""
+    source = models.CharField(max_length=255, unique=True)
+    # Records committed so far, saved in the same transaction as them.
+    records = models.PositiveIntegerField(default=0)
+    completed = models.BooleanField(default=False)
+    modified = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.source
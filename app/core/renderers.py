@@ -0,0 +1,72 @@
+import math
+
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+def _has_non_finite(data):
+    """Return whether a float in `data` is NaN or infinite"""
+    stack = [data]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, float):
+            if not math.isfinite(value):
+                return True
+        elif isinstance(value, dict):
+            stack.extend(value.values())
+        elif isinstance(value, (list, tuple)):
+            stack.extend(value)
+
+    return False
+
+
+class FastJSONRenderer(JSONRenderer):
+    """JSONRenderer that encodes with orjson when it is installed"""
+    # Dates, decimals and lazy strings go through DRF's encoder, so the
+    # output matches the stock renderer.  Indented, ASCII only or
+    # non-compact output, and anything orjson rejects, such as integers
+    # wider than 64 bits, is left to the stock renderer.
+    options = 0 if orjson is None else \
+        orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        """Render `data` into JSON, returning a bytestring"""
+        if data is None:
+            return bytes()
+
+        renderer_context = renderer_context or {}
+        indent = self.get_indent(accepted_media_type, renderer_context)
+        if orjson is None or indent is not None or self.ensure_ascii or \
+                not self.compact:
+            return super().render(
+                data, accepted_media_type, renderer_context
+            )
+
+        try:
+            ret = orjson.dumps(
+                data, default=self.encoder_class().default,
+                option=self.options
+            )
+        except orjson.JSONEncodeError:
+            return super().render(
+                data, accepted_media_type, renderer_context
+            )
+        # orjson writes NaN and infinities as null, where the stock
+        # renderer raises under STRICT_JSON or writes them out.  Only
+        # output with a null can hold one, which saves most scans.
+        if b'null' in ret and _has_non_finite(data):
+            return super().render(
+                data, accepted_media_type, renderer_context
+            )
+
+        # The stock renderer escapes these so the output is also valid
+        # javascript.  Both are encoded starting with these two bytes.
+        if b'\xe2\x80' in ret:
+            ret = ret.replace('\u2028'.encode(), b'\\u2028').replace(
+                '\u2029'.encode(), b'\\u2029'
+            )
+        return ret
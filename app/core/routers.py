@@ -0,0 +1,101 @@
+import hashlib
+import random
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import cache
+
+
+# Models whose rows a client needs right after creating them, like the
+# token it just obtained, are always read from the primary.
+PRIMARY_MODELS = {'authtoken.Token', 'sessions.Session'}
+
+# Caches only seen by the process they live in.  A client's next request
+# may go to another worker, which would not know it has to stick.
+LOCAL_CACHE_BACKENDS = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+}
+
+_state = threading.local()
+
+
+def current_replica():
+    """Return the replica reads go to right now, or None"""
+    return getattr(_state, 'replica', None)
+
+
+@contextmanager
+def replica_reads():
+    """Let reads in the block go to one of the replicas"""
+    # Off by default, so management commands, tests and anything outside
+    # a request keep reading from the primary.  One replica serves the
+    # whole block, so a request's validators, page and prefetches all
+    # see the same replication lag.
+    previous = current_replica()
+    _state.replica = random.choice(settings.REPLICA_DATABASES) \
+        if settings.REPLICA_DATABASES else None
+    try:
+        yield _state.replica
+    finally:
+        _state.replica = previous
+
+
+@checks.register()
+def check_sticky_cache(app_configs, **kwargs):
+    """Require a shared cache for the read-your-writes flags"""
+    backend = settings.CACHES['default']['BACKEND']
+    if settings.REPLICA_DATABASES and backend in LOCAL_CACHE_BACKENDS:
+        return [checks.Error(
+            'Read replicas need a cache shared by every worker to keep '
+            'clients on the primary after they write.',
+            hint='Use a memcached, Redis or, with a single host, file '
+                 'based default cache.',
+            obj=backend,
+            id='core.E001',
+        )]
+
+    return []
+
+
+def _sticky_key(client):
+    return 'replica:sticky:' + hashlib.md5(client.encode()).hexdigest()
+
+
+def stick_to_primary(client):
+    """Keep a client's reads on the primary after it writes"""
+    if settings.REPLICA_DATABASES:
+        cache.set(_sticky_key(client), True, settings.REPLICA_STICKY_SECONDS)
+
+
+def is_sticky(client):
+    """Return whether a client wrote recently enough to need the primary"""
+    return bool(settings.REPLICA_DATABASES) and \
+        cache.get(_sticky_key(client), False)
+
+
+class PrimaryReplicaRouter:
+    """Send writes to the primary and request reads to a replica"""
+
+    def db_for_read(self, model, **hints):
+        replica = current_replica()
+        if replica is None:
+            return 'default'
+        if model._meta.label in PRIMARY_MODELS or \
+                model._meta.label == settings.AUTH_USER_MODEL:
+            return 'default'
+
+        return replica
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # every alias holds the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # replicas receive the schema through replication
+        return db == 'default'
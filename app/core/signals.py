@@ -0,0 +1,49 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.signals import request_started
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from rest_framework.authtoken.models import Token
+
+from core.authentication import token_cache
+from core.middleware import record_query
+
+
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def invalidate_token(sender, instance, **kwargs):
+    """Drop a changed or deleted token from the auth cache"""
+    token_cache.invalidate(instance.key)
+
+
+@receiver(post_save, sender=get_user_model())
+@receiver(post_delete, sender=get_user_model())
+def invalidate_user_tokens(sender, instance, **kwargs):
+    """Drop the cached tokens of a changed or deleted user"""
+    # Covers deactivation as well as profile updates through the
+    # ManageUserView, so the next request sees the new values.
+    token_cache.invalidate_user(instance.pk)
+
+
+@receiver(request_started)
+def check_stale_connections(sender, **kwargs):
+    """Have reused connections checked before the request uses them"""
+    # Runs after Django closes connections past their CONN_MAX_AGE.  The
+    # check itself waits for a connection's first use in the request,
+    # see core.backends.postgresql, so aliases the request never touches
+    # cost nothing.
+    for connection in connections.all():
+        if connection.settings_dict.get('CONN_HEALTH_CHECKS'):
+            connection.health_check_pending = True
+
+
+@receiver(connection_created)
+def time_queries(sender, connection, **kwargs):
+    """Let RequestTimingMiddleware time the queries on a connection"""
+    # The wrappers outlive reconnects, so only add it the first time.
+    if settings.REQUEST_METRICS_ENABLED and \
+            record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
@@ -1,8 +1,27 @@
-from unittest.mock import patch
+import csv
+import json
+import os
+import shutil
+import tempfile
+from io import StringIO
+from unittest.mock import MagicMock, patch
 
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
 from django.db.utils import OperationalError
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.urls import get_resolver
+
+from core.management.commands import benchmark_metrics
+from core.middleware import record_query
+from core.models import Tag, Ingredient, Recipe, ImportProgress
+
+from recipe.cache import get_list_version
+from recipe.tests.utils import run_on_commit
 
 
 class CommandTests(TestCase):
@@ -10,9 +29,11 @@ class CommandTests(TestCase):
     def test_wait_for_db_ready(self):
         """Test waiting for db until db is available"""
         with patch('django.db.utils.ConnectionHandler.__getitem__') as gi:
-            gi.return_value = True
-            call_command('wait_for_db')
-            self.assertEqual(gi.call_count, 1)
+            call_command('wait_for_db', stdout=StringIO())
+            # the connection has to be opened and queried
+            cursor = gi.return_value.cursor
+            self.assertEqual(cursor.call_count, 1)
+            cursor().__enter__().execute.assert_called_with('SELECT 1')
 
     # Using 'patch' as a decorator is basically the same as using within
     # the context manager above, however, this allows you to pass in an
@@ -23,6 +44,354 @@ class CommandTests(TestCase):
         with patch('django.db.utils.ConnectionHandler.__getitem__') as gi:
             # simulate not connecting to the db 5 times, then connecting
             # on the last try.
-            gi.side_effect = [OperationalError] * 5 + [True]
-            call_command('wait_for_db')
-            self.assertEqual(gi.call_count, 6)
+            cursor = gi.return_value.cursor
+            cursor.side_effect = [OperationalError] * 5 + [MagicMock()]
+            call_command('wait_for_db', stdout=StringIO())
+            self.assertEqual(cursor.call_count, 6)
+
+        # the wait doubles after each failure up to the maximum
+        waits = [call[0][0] for call in ts.call_args_list]
+        self.assertEqual(waits, [0.5, 1, 2, 4, 5])
+
+    @patch('time.sleep', return_value=True)
+    def test_wait_for_db_timeout(self, ts):
+        """Test giving up once the timeout has passed"""
+        with patch('django.db.utils.ConnectionHandler.__getitem__') as gi, \
+                patch('time.monotonic', side_effect=[0, 1, 2]):
+            cursor = gi.return_value.cursor
+            cursor.side_effect = OperationalError
+            with self.assertRaises(CommandError):
+                call_command('wait_for_db', timeout=2, stdout=StringIO())
+
+        self.assertEqual(cursor.call_count, 2)
+
+    def test_seed_data(self):
+        """Test seeding users with recipes, tags and ingredients"""
+        call_command(
+            'seed_data', users=2, recipes=5, tags=4, ingredients=3, links=2,
+            stdout=StringIO()
+        )
+
+        self.assertEqual(get_user_model().objects.count(), 2)
+        self.assertEqual(Recipe.objects.count(), 10)
+        self.assertEqual(Tag.objects.count(), 8)
+        self.assertEqual(Ingredient.objects.count(), 6)
+        self.assertEqual(Recipe.tags.through.objects.count(), 20)
+        self.assertEqual(Recipe.ingredients.through.objects.count(), 20)
+        for recipe in Recipe.objects.all():
+            for tag in recipe.tags.all():
+                self.assertEqual(tag.user_id, recipe.user_id)
+
+    def test_seed_data_counts_recipes(self):
+        """Test seeded tags and ingredients count their recipes"""
+        call_command(
+            'seed_data', users=1, recipes=5, tags=2, ingredients=2, links=2,
+            stdout=StringIO()
+        )
+
+        for tag in Tag.objects.all():
+            self.assertEqual(tag.recipe_count, tag.recipe_set.count())
+        for ingredient in Ingredient.objects.all():
+            self.assertEqual(
+                ingredient.recipe_count, ingredient.recipe_set.count()
+            )
+
+    def test_recount_usage(self):
+        """Test the repair command recomputes drifted recipe counts"""
+        user = get_user_model().objects.create_user('t@test.com', 'pass')
+        used = Tag.objects.create(user=user, name='Used')
+        unused = Tag.objects.create(user=user, name='Unused')
+        ingredient = Ingredient.objects.create(user=user, name='Salt')
+        for i in range(3):
+            recipe = Recipe.objects.create(
+                user=user, title=f'Recipe {i}', time_minutes=5, price=1
+            )
+            recipe.tags.add(used)
+            recipe.ingredients.add(ingredient)
+        Tag.objects.filter(pk=used.pk).update(recipe_count=7)
+        Tag.objects.filter(pk=unused.pk).update(recipe_count=2)
+        ingredient.refresh_from_db()
+        cache.clear()
+        tag_version = get_list_version(user.id, Tag)
+        ingredient_version = get_list_version(user.id, Ingredient)
+        out = StringIO()
+
+        with run_on_commit():
+            call_command('recount_usage', batch_size=1, stdout=out)
+
+        modified = used.modified
+        used.refresh_from_db()
+        unused.refresh_from_db()
+        self.assertEqual(used.recipe_count, 3)
+        self.assertEqual(unused.recipe_count, 0)
+        # repaired rows are touched and their lists invalidated, so
+        # neither a cached body nor a 304 keeps the old counts
+        self.assertGreater(used.modified, modified)
+        self.assertGreater(get_list_version(user.id, Tag), tag_version)
+        # counts that were right are left alone
+        self.assertEqual(
+            Ingredient.objects.get(pk=ingredient.pk).modified,
+            ingredient.modified
+        )
+        self.assertEqual(
+            get_list_version(user.id, Ingredient), ingredient_version
+        )
+        self.assertIn('Fixed 2 tag counts', out.getvalue())
+        self.assertIn('Fixed 0 ingredient counts', out.getvalue())
+        self.assertEqual(Ingredient.objects.get().recipe_count, 3)
+
+    def media_root(self):
+        """Point MEDIA_ROOT at a directory removed after the test"""
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_benchmark_api(self):
+        """Test benchmarking writes results for every route"""
+        self.media_root()
+        call_command('seed_data', users=1, recipes=3, stdout=StringIO())
+        users = get_user_model().objects.count()
+
+        with tempfile.NamedTemporaryFile(suffix='.json') as output:
+            call_command(
+                'benchmark_api', iterations=3, warmup=1,
+                output=output.name, stdout=StringIO()
+            )
+            report = json.load(output)
+
+        # every named route of the recipe and user apps
+        resolver = get_resolver()
+        routes = {
+            f'{namespace}:{name}'
+            for namespace in ('recipe', 'user')
+            for name in resolver.namespace_dict[namespace][1].reverse_dict
+            if isinstance(name, str) and name != 'api-root'
+        }
+        self.assertEqual(set(report['results']), routes)
+        self.assertGreater(
+            report['results']['recipe:recipe-list']['queries'], 0
+        )
+        self.assertGreater(
+            report['results']['recipe:recipe-export']['queries'], 0
+        )
+        self.assertEqual(report['results']['user:create']['status'], 201)
+        for result in report['results'].values():
+            self.assertIn(result['status'], (200, 201))
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+            self.assertGreater(result['peak_memory_kb'], 0)
+        # the users signed up along the way are gone again
+        self.assertEqual(get_user_model().objects.count(), users)
+
+    def test_benchmark_api_no_iterations(self):
+        """Test benchmarking needs at least one timed request"""
+        with self.assertRaises(CommandError):
+            call_command('benchmark_api', iterations=0, stdout=StringIO())
+
+    def test_benchmark_metrics(self):
+        """Test benchmarking the timing middleware reports its overhead"""
+        self.media_root()
+        call_command('seed_data', users=1, recipes=3, stdout=StringIO())
+
+        with tempfile.NamedTemporaryFile(suffix='.json') as output:
+            # timings this short are too noisy for the default bound
+            call_command(
+                'benchmark_metrics', iterations=2, warmup=1,
+                max_overhead=1000, output=output.name, stdout=StringIO()
+            )
+            report = json.load(output)
+
+        self.assertIn('recipe:recipe-list', report['results'])
+        self.assertIn('overhead_pct', report)
+
+    def test_benchmark_metrics_baseline_untimed(self):
+        """Test the baseline runs queries without the timing wrapper"""
+        self.media_root()
+        call_command('seed_data', users=1, recipes=3, stdout=StringIO())
+        request = benchmark_metrics.Command._request
+        installed = []
+
+        def record(command, *args):
+            installed.append((
+                settings.REQUEST_METRICS_ENABLED,
+                record_query in connection.execute_wrappers
+            ))
+            return request(command, *args)
+
+        with tempfile.NamedTemporaryFile(suffix='.json') as output, \
+                patch.object(benchmark_metrics.Command, '_request', record):
+            call_command(
+                'benchmark_metrics', iterations=2, warmup=0,
+                max_overhead=1000, output=output.name, stdout=StringIO()
+            )
+
+        self.assertEqual(set(installed), {(True, True), (False, False)})
+        self.assertIn(record_query, connection.execute_wrappers)
+
+    def test_benchmark_serializers(self):
+        """Test comparing the recipe list serializers writes a report"""
+        call_command('seed_data', users=1, recipes=5, stdout=StringIO())
+
+        with tempfile.NamedTemporaryFile(suffix='.json') as output:
+            call_command(
+                'benchmark_serializers', iterations=2, output=output.name,
+                stdout=StringIO()
+            )
+            report = json.load(output)
+
+        self.assertEqual(report['config']['recipes'], 5)
+        self.assertIn('serializer', report['results'])
+        self.assertIn('values', report['results'])
+        self.assertGreater(report['speedup'], 0)
+
+    def test_benchmark_json(self):
+        """Test comparing the JSON renderers writes a report"""
+        call_command('seed_data', users=1, recipes=5, stdout=StringIO())
+
+        with tempfile.NamedTemporaryFile(suffix='.json') as output:
+            call_command(
+                'benchmark_json', iterations=2, output=output.name,
+                stdout=StringIO()
+            )
+            report = json.load(output)
+
+        self.assertEqual(report['config']['recipes'], 5)
+        self.assertGreater(report['speedup']['render'], 0)
+        self.assertGreater(report['speedup']['parse'], 0)
+
+
+class ImportRecipesTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'partner@test.com', 'testpass'
+        )
+        self.existing = Tag.objects.create(user=self.user, name='Vegan')
+        self.records = [
+            {'title': f'Recipe {i}', 'time_minutes': 10 + i,
+             'price': '4.50', 'tags': ['Vegan', f'Tag {i % 2}'],
+             'ingredients': ['Salt', 'Salt']}
+            for i in range(5)
+        ]
+
+    def write(self, records, suffix='.jsonl'):
+        """Write records to a temporary JSONL file and return its path"""
+        source = tempfile.NamedTemporaryFile(
+            'w', suffix=suffix, delete=False
+        )
+        with source:
+            for record in records:
+                source.write(json.dumps(record) + '\n')
+        self.addCleanup(os.remove, source.name)
+        return source.name
+
+    def import_recipes(self, path, **options):
+        options.setdefault('user', self.user.email)
+        call_command('import_recipes', path, stdout=StringIO(), **options)
+
+    def assertImported(self, count=5):
+        self.assertEqual(Recipe.objects.count(), count)
+        # names map to one object per user, reusing existing ones
+        self.assertEqual(
+            sorted(Tag.objects.values_list('name', flat=True)),
+            ['Tag 0', 'Tag 1', 'Vegan']
+        )
+        self.assertEqual(Ingredient.objects.count(), 1)
+        recipe = Recipe.objects.get(title='Recipe 3')
+        self.assertEqual(recipe.time_minutes, 13)
+        self.assertEqual(str(recipe.price), '4.50')
+        self.assertEqual(
+            sorted(tag.name for tag in recipe.tags.all()),
+            ['Tag 1', 'Vegan']
+        )
+        self.assertIn(self.existing, recipe.tags.all())
+        self.assertEqual(recipe.ingredients.count(), 1)
+        self.assertEqual(
+            Recipe.objects.filter(search_vector__isnull=True).count(), 0
+        )
+        self.assertEqual(
+            dict(Tag.objects.values_list('name', 'recipe_count')),
+            {'Vegan': count, 'Tag 0': 3, 'Tag 1': 2}
+        )
+        self.assertEqual(Ingredient.objects.get().recipe_count, count)
+
+    def test_import_jsonl(self):
+        """Test importing records in batches with name lookups"""
+        self.import_recipes(self.write(self.records), batch_size=2)
+
+        self.assertImported()
+
+    def test_import_copy(self):
+        """Test importing with COPY gives the same result"""
+        self.import_recipes(self.write(self.records), batch_size=2,
+                            copy=True)
+
+        self.assertImported()
+
+    def test_import_csv(self):
+        """Test importing CSV with names joined like the export"""
+        with tempfile.NamedTemporaryFile(
+                'w', suffix='.csv', newline='', delete=False) as source:
+            writer = csv.DictWriter(source, fieldnames=list(self.records[0]))
+            writer.writeheader()
+            for record in self.records:
+                writer.writerow({
+                    key: '; '.join(value) if isinstance(value, list)
+                    else value
+                    for key, value in record.items()
+                })
+        self.addCleanup(os.remove, source.name)
+
+        self.import_recipes(source.name)
+
+        self.assertImported()
+
+    def test_import_resumes_after_crash(self):
+        """Test a failed run resumes after the last committed batch"""
+        path = self.write(self.records)
+        with patch('core.management.commands.import_recipes.'
+                   'update_search_vectors',
+                   side_effect=[None, RuntimeError]):
+            with self.assertRaises(RuntimeError):
+                self.import_recipes(path, batch_size=3)
+
+        self.assertEqual(Recipe.objects.count(), 3)
+        progress = ImportProgress.objects.get(source=path)
+        self.assertEqual(progress.records, 3)
+        self.assertFalse(progress.completed)
+
+        self.import_recipes(path, batch_size=3)
+
+        self.assertEqual(Recipe.objects.count(), 5)
+        self.assertTrue(ImportProgress.objects.get(source=path).completed)
+
+        # completed imports are not repeated
+        self.import_recipes(path)
+        self.assertEqual(Recipe.objects.count(), 5)
+
+    def test_import_crash_invalidates_committed_batches(self):
+        """Test lists are invalidated as each batch commits"""
+        path = self.write(self.records)
+        cache.clear()
+        version = get_list_version(self.user.id, Tag)
+
+        with run_on_commit():
+            with patch('core.management.commands.import_recipes.'
+                       'update_search_vectors',
+                       side_effect=[None, RuntimeError]):
+                with self.assertRaises(RuntimeError):
+                    self.import_recipes(path, batch_size=3)
+
+        # the first batch is in, so lists showing its tags are stale
+        self.assertGreater(get_list_version(self.user.id, Tag), version)
+
+    def test_import_invalid_record(self):
+        """Test a bad record stops the import and names the record"""
+        self.records[3]['price'] = 'free'
+        path = self.write(self.records)
+
+        with self.assertRaisesRegex(CommandError, 'Record 4: price'):
+            self.import_recipes(path, batch_size=2)
+
+        self.assertEqual(Recipe.objects.count(), 2)
@@ -0,0 +1,101 @@
+from unittest.mock import patch
+
+from django.db.utils import OperationalError
+from django.db import connections
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+
+from core.backends.postgresql.base import DatabaseWrapper
+from core.signals import check_stale_connections
+
+
+READY_URL = reverse('ready')
+
+
+class ReadinessTests(TestCase):
+
+    def test_ready(self):
+        """Test the readiness endpoint reports a reachable database"""
+        res = self.client.get(READY_URL)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json(), {'status': 'ok'})
+        self.assertIn('no-cache', res['Cache-Control'])
+
+    def test_ready_database_down(self):
+        """Test the readiness endpoint fails when queries fail"""
+        with patch('django.db.backends.base.base.BaseDatabaseWrapper.'
+                   'cursor', side_effect=OperationalError):
+            res = self.client.get(READY_URL)
+
+        self.assertEqual(res.status_code, 503)
+        self.assertIn('default', res.json()['databases'])
+
+    def test_ready_get_only(self):
+        """Test the readiness endpoint rejects writes"""
+        res = self.client.post(READY_URL)
+
+        self.assertEqual(res.status_code, 405)
+
+
+class ConnectionHealthCheckTests(SimpleTestCase):
+    allow_database_queries = True
+
+    def setUp(self):
+        # A connection of its own, outside any test transaction
+        self.connection = DatabaseWrapper(
+            connections['default'].settings_dict.copy(), alias='default'
+        )
+        self.addCleanup(self.connection.close)
+
+    def check(self, *conns):
+        """Run the request_started handler over `conns`"""
+        with patch('core.signals.connections') as connections:
+            connections.all.return_value = conns
+            check_stale_connections(sender=None)
+
+    def test_stale_connection_replaced_on_first_use(self):
+        """Test a dropped connection is replaced when a request uses it"""
+        self.connection.ensure_connection()
+        stale = self.connection.connection
+
+        self.check(self.connection)
+        with patch.object(self.connection, 'is_usable',
+                          return_value=False) as is_usable:
+            with self.connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            with self.connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+
+        # checked once, on the first query only
+        is_usable.assert_called_once_with()
+        self.assertIsNot(self.connection.connection, stale)
+        self.assertTrue(stale.closed)
+
+    def test_no_round_trip_until_used(self):
+        """Test starting a request doesn't query any connection"""
+        self.connection.ensure_connection()
+
+        with patch.object(self.connection, 'is_usable') as is_usable:
+            self.check(self.connection)
+
+        is_usable.assert_not_called()
+        self.assertTrue(self.connection.health_check_pending)
+
+    def test_healthy_connection_kept(self):
+        """Test a working connection is reused"""
+        self.connection.ensure_connection()
+        healthy = self.connection.connection
+
+        self.check(self.connection)
+        self.connection.cursor().close()
+
+        self.assertIs(self.connection.connection, healthy)
+
+    def test_health_checks_disabled(self):
+        """Test connections are left alone without CONN_HEALTH_CHECKS"""
+        self.connection.settings_dict['CONN_HEALTH_CHECKS'] = False
+
+        self.check(self.connection)
+
+        self.assertFalse(self.connection.health_check_pending)
@@ -0,0 +1,152 @@
+import os
+import shutil
+import tempfile
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from core.models import Recipe
+
+from recipe import images
+
+
+IMAGE_NAME = 'uploads/recipe/1f0c3e6a-56b1-4b7e-9d4e-2a7c1d8e9f00.jpg'
+
+
+def media_url(name):
+    """Return the URL a media file is served at"""
+    return reverse('media', args=[name])
+
+
+class MediaTests(TestCase):
+    """Test serving recipe images"""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            MEDIA_ROOT=self.media_root
+        )
+        self.settings_override.enable()
+        user = get_user_model().objects.create_user(
+            'test@test.com',
+            'testpass'
+        )
+        self.recipe = Recipe.objects.create(
+            user=user, title='Toast', time_minutes=2, price=Decimal('1.00'),
+            image=IMAGE_NAME
+        )
+        self.write(IMAGE_NAME)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+
+    def write(self, name, content=b'jpeg'):
+        """Create a file in the media root"""
+        path = os.path.join(self.media_root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(content)
+
+    def assertImmutable(self, res):
+        cache_control = {
+            directive.strip() for directive in res['Cache-Control'].split(',')
+        }
+        self.assertEqual(cache_control, {
+            'private', 'immutable', 'max-age=31536000'
+        })
+
+    def test_serve_image(self):
+        """Test an image is served with headers to cache it for good"""
+        res = self.client.get(media_url(IMAGE_NAME))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(b''.join(res.streaming_content), b'jpeg')
+        self.assertEqual(res['Content-Type'], 'image/jpeg')
+        self.assertImmutable(res)
+
+    def test_serve_derivative(self):
+        """Test resized copies are served along with their image"""
+        name = images.derivative_name(IMAGE_NAME, 160)
+        self.write(name, b'small')
+
+        res = self.client.get(media_url(name))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(b''.join(res.streaming_content), b'small')
+
+    def test_file_without_recipe_not_found(self):
+        """Test files no recipe refers to are not served"""
+        name = 'uploads/recipe/orphan.jpg'
+        self.write(name)
+        self.write(images.derivative_name(name, 160))
+
+        for path in (name, images.derivative_name(name, 160)):
+            res = self.client.get(media_url(path))
+
+            self.assertEqual(res.status_code, 404)
+        self.recipe.delete()
+        res = self.client.get(media_url(IMAGE_NAME))
+        self.assertEqual(res.status_code, 404)
+
+    def test_path_traversal_not_found(self):
+        """Test paths leaving the media root are rejected"""
+        for path in ('../secret.jpg', 'uploads/../' + IMAGE_NAME,
+                     'uploads/recipe/./' + os.path.basename(IMAGE_NAME)):
+            res = self.client.get('/media/' + path)
+
+            self.assertEqual(res.status_code, 404)
+
+    def test_unsafe_method_not_allowed(self):
+        """Test media can only be read"""
+        res = self.client.post(media_url(IMAGE_NAME))
+
+        self.assertEqual(res.status_code, 405)
+
+    @override_settings(MEDIA_DELIVERY='x-accel-redirect')
+    def test_x_accel_redirect(self):
+        """Test nginx is told which internal location to send"""
+        res = self.client.get(media_url(IMAGE_NAME))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res['X-Accel-Redirect'], '/protected-media/' +
+                         IMAGE_NAME)
+        self.assertEqual(res['Content-Type'], 'image/jpeg')
+        self.assertEqual(res.content, b'')
+        self.assertImmutable(res)
+
+    @override_settings(MEDIA_DELIVERY='x-sendfile')
+    def test_x_sendfile(self):
+        """Test the front server is given the file's path"""
+        res = self.client.get(media_url(IMAGE_NAME))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res['X-Sendfile'],
+                         os.path.join(self.media_root, IMAGE_NAME))
+        self.assertEqual(res.content, b'')
+        self.assertImmutable(res)
+
+    @override_settings(MEDIA_DELIVERY='x-accel-redirect')
+    def test_x_accel_redirect_missing_file(self):
+        """Test files not written yet are not handed to the front server"""
+        res = self.client.get(
+            media_url(images.derivative_name(IMAGE_NAME, 480))
+        )
+
+        self.assertEqual(res.status_code, 404)
+        self.assertNotIn('X-Accel-Redirect', res)
+        self.assertNotIn('immutable', res.get('Cache-Control', ''))
+
+    def test_source_name(self):
+        """Test resized copies map back to the image they came from"""
+        for width in (160, 480, 960):
+            self.assertEqual(
+                images.source_name(images.derivative_name(IMAGE_NAME, width)),
+                IMAGE_NAME
+            )
+        self.assertEqual(images.source_name(IMAGE_NAME), IMAGE_NAME)
+        # only configured widths are resized copies
+        name = 'uploads/recipe/photo_123w.jpg'
+        self.assertEqual(images.source_name(name), name)
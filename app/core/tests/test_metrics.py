@@ -0,0 +1,122 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.urls import reverse
+
+from rest_framework.test import APIClient
+
+from core import metrics
+
+
+METRICS_URL = reverse('metrics')
+TAGS_URL = reverse('recipe:tag-list')
+
+
+class MetricTests(TestCase):
+
+    def setUp(self):
+        self.histogram = metrics.Histogram(
+            'test_seconds', 'Test histogram.', ('view',), buckets=(0.1, 1)
+        )
+        self.addCleanup(metrics.REGISTRY.remove, self.histogram)
+
+    def test_histogram_buckets(self):
+        """Test histogram buckets are rendered cumulatively"""
+        for value in (0.05, 0.1, 0.5, 3):
+            self.histogram.observe(value, 'recipe:tag-list')
+
+        lines = list(self.histogram.collect())
+
+        self.assertEqual(lines, [
+            '# HELP test_seconds Test histogram.',
+            '# TYPE test_seconds histogram',
+            'test_seconds_bucket{view="recipe:tag-list",le="0.1"} 2',
+            'test_seconds_bucket{view="recipe:tag-list",le="1.0"} 3',
+            'test_seconds_bucket{view="recipe:tag-list",le="+Inf"} 4',
+            'test_seconds_sum{view="recipe:tag-list"} 3.65',
+            'test_seconds_count{view="recipe:tag-list"} 4',
+        ])
+
+    def test_label_values_escaped(self):
+        """Test quotes and backslashes in label values are escaped"""
+        self.histogram.observe(1, 'say "hi"\\')
+
+        self.assertIn(
+            'test_seconds_count{view="say \\"hi\\"\\\\"} 1',
+            list(self.histogram.collect())
+        )
+
+
+class RequestTimingTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        for metric in metrics.REGISTRY:
+            metric.clear()
+        self.user = get_user_model().objects.create_user(
+            'test@test.com',
+            'testpass'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    @override_settings(SERVER_TIMING_ENABLED=True)
+    def test_server_timing_header(self):
+        """Test responses carry the SQL, view and render timings"""
+        with CaptureQueriesContext(connection) as context:
+            res = self.client.get(TAGS_URL)
+
+        timings = dict(
+            entry.split(';', 1) for entry in res['Server-Timing'].split(', ')
+        )
+        self.assertEqual(
+            list(timings), ['db', 'view', 'render', 'total']
+        )
+        self.assertIn(
+            f'desc="{len(context.captured_queries)} queries"', timings['db']
+        )
+
+    def test_server_timing_off_by_default(self):
+        """Test the timings aren't sent to clients unless turned on"""
+        res = self.client.get(TAGS_URL)
+
+        self.assertNotIn('Server-Timing', res)
+
+    def test_metrics_by_route(self):
+        """Test timings are aggregated by route and viewset action"""
+        self.client.get(TAGS_URL)
+        self.client.get(TAGS_URL)
+        self.client.get(reverse('recipe:tag-popular'))
+        self.client.get('/api/recipe/tags/12345/nothing/')
+
+        res = self.client.get(METRICS_URL)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res['Content-Type'], metrics.CONTENT_TYPE)
+        body = res.content.decode()
+        self.assertIn(
+            'http_request_duration_seconds_count{view="recipe:tag-list",'
+            'action="list",method="GET"} 2', body
+        )
+        self.assertIn(
+            'http_request_db_queries_count{view="recipe:tag-popular",'
+            'action="popular",method="GET"} 1', body
+        )
+        self.assertIn(
+            'http_responses_total{view="unmatched",action="",method="GET",'
+            'status="404"} 1', body
+        )
+        self.assertNotIn('12345', body)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_metrics_token(self):
+        """Test scrapes need the token when one is configured"""
+        res = self.client.get(METRICS_URL)
+        self.assertEqual(res.status_code, 401)
+
+        res = self.client.get(
+            METRICS_URL, HTTP_AUTHORIZATION='Bearer secret'
+        )
+        self.assertEqual(res.status_code, 200)
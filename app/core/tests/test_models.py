@@ -91,3 +91,18 @@ class ModelTests(TestCase):
 
         exp_path = f'uploads/recipe/{uuid}.jpg'
         self.assertEqual(file_path, exp_path)
+
+    def test_upsert_names(self):
+        """Test names resolve to existing objects or new ones"""
+        user = sample_user()
+        tag = models.Tag.objects.create(user=user, name='Vegan')
+        models.Tag.objects.create(user=sample_user('o@test.com'), name='Hot')
+
+        ids = models.Tag.objects.upsert_names(user.id, ['Vegan', 'Hot'])
+
+        self.assertEqual(ids['Vegan'], tag.id)
+        hot = models.Tag.objects.get(pk=ids['Hot'])
+        self.assertEqual(hot.user, user)
+        self.assertIsNotNone(hot.modified)
+        self.assertEqual(models.Tag.objects.filter(user=user).count(), 2)
+        self.assertEqual(models.Tag.objects.upsert_names(user.id, []), {})
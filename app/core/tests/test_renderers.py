@@ -0,0 +1,107 @@
+import datetime
+from decimal import Decimal
+from io import BytesIO
+from unittest.mock import patch
+
+from django.test import TestCase
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from core.parsers import FastJSONParser
+from core.renderers import FastJSONRenderer
+
+
+class FastJSONRendererTests(TestCase):
+
+    def assertRendersLikeStock(self, data, media_type=None):
+        self.assertEqual(
+            FastJSONRenderer().render(data, media_type),
+            JSONRenderer().render(data, media_type)
+        )
+
+    def test_recipe_payload(self):
+        """Test a recipe list renders exactly like the stock renderer"""
+        self.assertRendersLikeStock({
+            'next': None,
+            'results': [
+                {'id': 2, 'title': 'Crème brûlée', 'tags': [1, 3],
+                 'price': '5.50', 'link': ''},
+            ],
+        })
+
+    def test_python_types(self):
+        """Test types JSON lacks are encoded like the stock renderer"""
+        self.assertRendersLikeStock({
+            'decimal': Decimal('1.25'),
+            'aware': timezone.now(),
+            'naive': datetime.datetime(2020, 1, 2, 3, 4, 5, 6),
+            'date': datetime.date(2020, 1, 2),
+            'lazy': _('This field is required.'),
+            1: 'integer key',
+        })
+
+    def test_line_separators_escaped(self):
+        """Test U+2028 and U+2029 are escaped for javascript"""
+        data = {'title': 'a\u2028b\u2029c'}
+
+        self.assertIn(b'\\u2028', FastJSONRenderer().render(data))
+        self.assertRendersLikeStock(data)
+
+    def test_fallbacks(self):
+        """Test output orjson can't produce comes from the stock renderer"""
+        self.assertRendersLikeStock({'big': 2 ** 70})
+        self.assertRendersLikeStock(
+            {'a': [1, 2]}, 'application/json; indent=4'
+        )
+
+    def test_non_finite_floats(self):
+        """Test NaN and infinities are refused or written like stock"""
+        for value in (float('nan'), float('inf'), float('-inf')):
+            data = {'next': None, 'results': [{'rank': value}]}
+            with self.assertRaises(ValueError):
+                FastJSONRenderer().render(data)
+            with self.assertRaises(ValueError):
+                JSONRenderer().render(data)
+
+            with patch.object(JSONRenderer, 'strict', False):
+                self.assertRendersLikeStock(data)
+
+    def test_none(self):
+        """Test no data renders an empty body"""
+        self.assertEqual(FastJSONRenderer().render(None), b'')
+
+
+class FastJSONParserTests(TestCase):
+
+    def parse(self, body, parser_class=FastJSONParser, **context):
+        return parser_class().parse(BytesIO(body), parser_context=context)
+
+    def test_parse(self):
+        """Test a body parses like the stock parser"""
+        body = '{"title": "Crème", "price": 1.5, "big": %d}' % 2 ** 70
+
+        self.assertEqual(
+            self.parse(body.encode()),
+            self.parse(body.encode(), JSONParser)
+        )
+
+    def test_parse_other_encoding(self):
+        """Test bodies in other charsets are decoded first"""
+        data = self.parse('{"title": "Crème"}'.encode('latin-1'),
+                          encoding='latin-1')
+
+        self.assertEqual(data, {'title': 'Crème'})
+
+    def test_parse_error(self):
+        """Test invalid bodies give the stock parser's error"""
+        for body in (b'{"title": ', b'', b'NaN'):
+            with self.assertRaises(ParseError) as fast:
+                self.parse(body)
+            with self.assertRaises(ParseError) as stock:
+                self.parse(body, JSONParser)
+
+            self.assertEqual(str(fast.exception), str(stock.exception))
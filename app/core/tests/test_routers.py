@@ -0,0 +1,124 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, RequestFactory, override_settings
+
+from rest_framework.authtoken.models import Token
+
+from core.middleware import ReplicaRoutingMiddleware
+from core.models import Recipe
+from core.routers import PrimaryReplicaRouter, check_sticky_cache, \
+    replica_reads
+
+
+REPLICAS = ['replica1', 'replica2']
+
+
+@override_settings(REPLICA_DATABASES=REPLICAS)
+class PrimaryReplicaRouterTests(TestCase):
+
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+
+    def test_reads_use_primary_outside_requests(self):
+        """Test reads stay on the primary unless replicas are enabled"""
+        self.assertEqual(self.router.db_for_read(Recipe), 'default')
+
+    def test_reads_use_one_replica_per_block(self):
+        """Test a block reads from one replica, blocks spread over all"""
+        picked = set()
+        for _ in range(50):
+            with replica_reads() as replica:
+                aliases = {
+                    self.router.db_for_read(Recipe) for _ in range(10)
+                }
+            self.assertEqual(aliases, {replica})
+            picked.add(replica)
+
+        self.assertEqual(picked, set(REPLICAS))
+        self.assertEqual(self.router.db_for_read(Recipe), 'default')
+
+    def test_nested_blocks_restore_replica(self):
+        """Test leaving a nested block goes back to the outer replica"""
+        with replica_reads() as outer:
+            with replica_reads():
+                pass
+            self.assertEqual(self.router.db_for_read(Recipe), outer)
+
+    def test_sticky_flags_need_shared_cache(self):
+        """Test replicas with a per process cache fail the checks"""
+        errors = check_sticky_cache(None)
+        self.assertEqual([error.id for error in errors], ['core.E001'])
+
+        shared = {'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.'
+                       'FileBasedCache',
+            'LOCATION': '/tmp/recipe-app',
+        }}
+        with override_settings(CACHES=shared):
+            self.assertEqual(check_sticky_cache(None), [])
+        with override_settings(REPLICA_DATABASES=[]):
+            self.assertEqual(check_sticky_cache(None), [])
+
+    @override_settings(REPLICA_DATABASES=[])
+    def test_no_replicas_configured(self):
+        """Test everything uses the primary without replicas"""
+        with replica_reads():
+            self.assertEqual(self.router.db_for_read(Recipe), 'default')
+
+    def test_auth_models_use_primary(self):
+        """Test tokens and users are always read from the primary"""
+        with replica_reads():
+            self.assertEqual(self.router.db_for_read(Token), 'default')
+            self.assertEqual(
+                self.router.db_for_read(get_user_model()), 'default'
+            )
+
+    def test_writes_and_migrations_use_primary(self):
+        """Test only the primary is written to and migrated"""
+        with replica_reads():
+            self.assertEqual(self.router.db_for_write(Recipe), 'default')
+        self.assertTrue(self.router.allow_migrate('default', 'core'))
+        self.assertFalse(self.router.allow_migrate('replica1', 'core'))
+
+
+@override_settings(REPLICA_DATABASES=REPLICAS, REPLICA_STICKY_SECONDS=5)
+class ReplicaRoutingMiddlewareTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+        self.middleware = ReplicaRoutingMiddleware(
+            lambda request: PrimaryReplicaRouter().db_for_read(Recipe)
+        )
+
+    def request(self, method, token='a'):
+        """Return the alias recipes are read from while handling a request"""
+        request = getattr(self.factory, method)(
+            '/api/recipe/recipes/', HTTP_AUTHORIZATION=f'Token {token}'
+        )
+        return self.middleware(request)
+
+    def test_safe_requests_read_replicas(self):
+        """Test GET requests read from a replica"""
+        self.assertIn(self.request('get'), REPLICAS)
+        self.assertIn(self.request('head'), REPLICAS)
+
+    def test_writes_read_primary(self):
+        """Test reads made while writing use the primary"""
+        self.assertEqual(self.request('post'), 'default')
+        self.assertEqual(self.request('delete'), 'default')
+
+    def test_reads_stick_to_primary_after_write(self):
+        """Test a client reads its own writes from the primary"""
+        self.request('patch')
+
+        self.assertEqual(self.request('get'), 'default')
+        # other clients keep using the replicas
+        self.assertIn(self.request('get', token='b'), REPLICAS)
+
+    def test_stickiness_expires(self):
+        """Test a client returns to the replicas after the window"""
+        with override_settings(REPLICA_STICKY_SECONDS=0):
+            self.request('put')
+
+        self.assertIn(self.request('get'), REPLICAS)
@@ -0,0 +1,109 @@
+import mimetypes
+import os
+import posixpath
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections
+from django.db.utils import DatabaseError
+from django.http import Http404, HttpResponse, JsonResponse
+from django.utils.cache import patch_cache_control
+from django.utils.crypto import constant_time_compare
+from django.views import static
+from django.views.decorators.cache import never_cache
+from django.views.decorators.http import require_safe
+
+from core import metrics
+from core.models import Recipe
+
+from recipe import images
+
+
+@never_cache
+@require_safe
+def ready(request):
+    """Report whether every database accepts queries"""
+    # Deliberately a plain Django view: no authentication, serializers
+    # or model queries, just a round trip on each connection.
+    unavailable = []
+    for connection in connections.all():
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+        except DatabaseError:
+            # Django closes the failed connection once the request ends
+            unavailable.append(connection.alias)
+
+    if unavailable:
+        return JsonResponse(
+            {'status': 'unavailable', 'databases': unavailable}, status=503
+        )
+
+    return JsonResponse({'status': 'ok'})
+
+
+@never_cache
+@require_safe
+def metrics_view(request):
+    """Serve the request metrics in the Prometheus text format"""
+    if settings.METRICS_TOKEN:
+        sent = request.META.get('HTTP_AUTHORIZATION', '')
+        if not constant_time_compare(
+                sent, f'Bearer {settings.METRICS_TOKEN}'):
+            return HttpResponse(status=401)
+
+    return HttpResponse(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
+def send_media(request, name, content_type=None):
+    """Return a response sending a media file as MEDIA_DELIVERY says"""
+    delivery = settings.MEDIA_DELIVERY
+    if delivery == 'django':
+        response = static.serve(
+            request, name, document_root=settings.MEDIA_ROOT
+        )
+    elif delivery in ('x-accel-redirect', 'x-sendfile'):
+        # The front server sends the file, the worker only checks it
+        # exists so a missing one isn't answered as cacheable.
+        full_path = os.path.join(settings.MEDIA_ROOT, name)
+        if not os.path.isfile(full_path):
+            raise Http404
+        response = HttpResponse()
+        if delivery == 'x-accel-redirect':
+            response['X-Accel-Redirect'] = \
+                settings.MEDIA_ACCEL_PREFIX + quote(name)
+        else:
+            response['X-Sendfile'] = full_path
+    else:
+        raise ImproperlyConfigured(f'Unknown MEDIA_DELIVERY {delivery!r}')
+
+    if response.status_code == 200:
+        if content_type is None:
+            content_type, _ = mimetypes.guess_type(name)
+        response['Content-Type'] = \
+            content_type or 'application/octet-stream'
+    return response
+
+
+@require_safe
+def media(request, path):
+    """Serve a recipe image or one of its resized copies"""
+    # There is no owner check: an upload's random UUID name is what
+    # grants access, like a capability URL, since <img> tags can't send
+    # the API token. Only files of existing recipes are served, so
+    # images stop being reachable as soon as their recipe is deleted.
+    if posixpath.normpath(path) != path or path.startswith(('/', '../')):
+        raise Http404
+    if not Recipe.objects.filter(image=images.source_name(path)).exists():
+        raise Http404
+
+    response = send_media(request, path)
+    # Every upload gets a new UUID name and resized copies are named
+    # after it, so a URL's content never changes. Shared caches must
+    # not keep it though, or it would outlive its recipe there.
+    patch_cache_control(
+        response, private=True, immutable=True,
+        max_age=settings.MEDIA_CACHE_MAX_AGE
+    )
+    return response
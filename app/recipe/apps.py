@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class RecipeConfig(AppConfig):
+    name = 'recipe'
+
+    def ready(self):
+        # connect the signal receivers
+        from recipe import signals  # noqa: F401
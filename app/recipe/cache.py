@@ -0,0 +1,75 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from core.routers import current_replica
+
+
+def _version_key(user_id, model):
+    """Return the cache key holding a user's list version for a model"""
+    return f'recipe:version:{model._meta.label_lower}:{user_id}'
+
+
+def get_list_version(user_id, model):
+    """Return the current list version for a user and model"""
+    key = _version_key(user_id, model)
+    version = cache.get(key)
+    if version is None:
+        # Start from the clock rather than 1 so a version evicted from
+        # the cache can never come back and match stale entries.
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+
+    return version
+
+
+def bump_list_version(user_id, model):
+    """Invalidate every cached list of `model` for a user on commit"""
+    # Bumping inside the writer's transaction would let a concurrent
+    # reader cache the list as it was before the commit under the new
+    # version.  Outside a transaction this runs right away.
+    transaction.on_commit(lambda: _incr_list_version(user_id, model))
+
+
+def _incr_list_version(user_id, model):
+    """Move a user's list version for a model on"""
+    try:
+        cache.incr(_version_key(user_id, model))
+    except ValueError:
+        # Nothing is cached against a missing version, so the next
+        # read starting a fresh one is enough.
+        pass
+
+
+def list_cache_key(request, model):
+    """Return the response cache key for a list request"""
+    # The absolute URI covers the cursor and filters as well as the
+    # host used to build the pagination links.
+    uri = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+    version = get_list_version(request.user.id, model)
+    return (
+        f'recipe:list:{model._meta.label_lower}:'
+        f'{request.user.id}:{version}:{uri}'
+    )
+
+
+def get_cached_list(request, model):
+    """Return the cached list data for a request, or None"""
+    return cache.get(list_cache_key(request, model))
+
+
+def set_cached_list(request, model, data):
+    """Store the list data for a request read from the primary"""
+    # Stickiness is kept per credential but the cache per user, so a
+    # list another token read from a lagging replica would be served to
+    # the client that just wrote as well.
+    if current_replica() is not None:
+        return
+    cache.set(
+        list_cache_key(request, model),
+        data,
+        timeout=settings.RECIPE_LIST_CACHE_TIMEOUT
+    )
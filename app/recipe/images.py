@@ -0,0 +1,320 @@
+import glob
+import logging
+import os
+import posixpath
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+
+from PIL import Image
+
+
+logger = logging.getLogger(__name__)
+
+# Each format cached copies can be made in, with Pillow's name for it,
+# its content type and the image modes it saves.  Other modes are
+# converted to RGBA if they have transparency and it is listed, or RGB.
+FORMATS = {
+    'jpeg': ('JPEG', 'image/jpeg', ('RGB', 'L')),
+    'png': ('PNG', 'image/png', ('RGBA', 'RGB', 'LA', 'L', 'P', 'I', '1')),
+    'webp': ('WEBP', 'image/webp', ('RGBA', 'RGB')),
+}
+# Seconds between marking the same cached copy as used, which saves a
+# write to the inode on every hit for popular images.
+CACHE_TOUCH_INTERVAL = 60
+# Eviction makes room down to this share of the byte budget, so a full
+# cache isn't scanned again on every new copy.
+CACHE_LOW_WATERMARK = 0.9
+# Seconds a process goes by its own count of the cache size before
+# scanning again to see the copies other processes wrote.
+CACHE_RESCAN_INTERVAL = 60
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# Futures of the cached copies being made by this process, by name.
+_pending = {}
+_pending_lock = threading.Lock()
+# Bytes this process thinks the cache holds, None until it is scanned,
+# and the time.monotonic() of that scan.
+_cache_size = None
+_cache_scanned = None
+_cache_size_lock = threading.Lock()
+
+
+def get_executor():
+    """Return the pool that resizes images off the request thread"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.RECIPE_IMAGE_WORKERS,
+                thread_name_prefix='recipe-images'
+            )
+
+    return _executor
+
+
+def derivative_name(name, width):
+    """Return the storage name of an image resized to `width`"""
+    root, ext = os.path.splitext(name)
+    return f'{root}_{width}w{ext}'
+
+
+def source_name(name):
+    """Return the name of the image a stored file was made from"""
+    # Undoes derivative_name() for the configured widths; any other
+    # name is taken to be an original.
+    match = re.fullmatch(r'(?P<root>.+)_(?P<width>\d+)w(?P<ext>\.[^./]+)?',
+                         name)
+    if match and int(match['width']) in settings.RECIPE_IMAGE_WIDTHS:
+        return match['root'] + (match['ext'] or '')
+
+    return name
+
+
+def derivative_urls(name):
+    """Map each configured width to its URL, or None until it exists"""
+    urls = {}
+    for width in settings.RECIPE_IMAGE_WIDTHS:
+        derivative = derivative_name(name, width)
+        if default_storage.exists(derivative):
+            urls[width] = default_storage.url(derivative)
+        else:
+            urls[width] = None
+
+    return urls
+
+
+def generate_derivatives(name):
+    """Write a resized copy of an image for every configured width"""
+    source = default_storage.path(name)
+    try:
+        image = Image.open(source)
+    except FileNotFoundError:
+        # deleted or replaced before the job ran
+        return
+
+    with image:
+        image_format = image.format
+        for width in settings.RECIPE_IMAGE_WIDTHS:
+            target = default_storage.path(derivative_name(name, width))
+            if not os.path.exists(source):
+                return
+            if os.path.exists(target):
+                continue
+            resized = image.copy()
+            # thumbnail() keeps the aspect ratio and never upscales, so
+            # images narrower than `width` are just re-encoded.
+            resized.thumbnail((width, image.height), Image.LANCZOS)
+            # Write next to the target and rename, so readers never see
+            # a half written file.
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target))
+            try:
+                with os.fdopen(fd, 'wb') as tmp:
+                    resized.save(tmp, format=image_format)
+                os.replace(tmp_path, target)
+            except Exception:
+                os.remove(tmp_path)
+                raise
+            # delete_image() removes the image before its copies, so a
+            # copy written once the image is gone may have been missed.
+            if not os.path.exists(source):
+                _remove(target)
+                return
+
+
+def schedule_derivatives(name):
+    """Queue the resized copies of an image on the worker pool"""
+    future = get_executor().submit(generate_derivatives, name)
+    # Nothing waits on the result, so failures would go unnoticed and
+    # the thumbnails stay missing.
+    future.add_done_callback(lambda future: _log_failure(future, name))
+    return future
+
+
+def _log_failure(future, name):
+    """Log the error a resize job on the worker pool raised"""
+    if future.cancelled():
+        return
+    exc = future.exception()
+    if exc is not None:
+        logger.error(
+            'Resizing recipe image %s failed', name,
+            exc_info=(type(exc), exc, exc.__traceback__)
+        )
+
+
+def delete_image(name):
+    """Delete an image along with any resized copies of it"""
+    # The image goes first, which tells generate_derivatives() to stop
+    # and to drop any copy it writes after this.
+    default_storage.delete(name)
+    for width in settings.RECIPE_IMAGE_WIDTHS:
+        default_storage.delete(derivative_name(name, width))
+    prefix = default_storage.path(_cache_prefix(name))
+    for path in glob.glob(glob.escape(prefix) + '_*w.*'):
+        _remove(path)
+
+
+def _cache_prefix(name):
+    """Return the start of the cache names of an image's copies"""
+    # Upload names are unique, so the copies of different images, or of
+    # an image and the one replacing it, never share a name.  The first
+    # characters spread the files over subdirectories.
+    root = os.path.splitext(posixpath.basename(name))[0]
+    return posixpath.join(settings.RECIPE_IMAGE_CACHE_DIR, root[:2], root)
+
+
+def cache_name(name, width, image_format):
+    """Return the storage name of an image cached at a width and format"""
+    return f'{_cache_prefix(name)}_{width}w.{image_format}'
+
+
+def cached_derivative(name, width, image_format):
+    """Return the storage name of a cached copy, making it if needed"""
+    target_name = cache_name(name, width, image_format)
+    target = default_storage.path(target_name)
+    try:
+        _touch(target)
+        return target_name
+    except FileNotFoundError:
+        pass
+
+    # Requests for a copy that is being made wait for it, rather than
+    # resizing the same image again.  Other processes may still make
+    # their own, which is only wasted work as the files are identical.
+    with _pending_lock:
+        future = _pending.get(target_name)
+        making = future is None
+        if making:
+            future = _pending[target_name] = Future()
+    if not making:
+        return future.result()
+
+    try:
+        size = _write_derivative(name, target, width, image_format)
+    except BaseException as exc:
+        future.set_exception(exc)
+        raise
+    finally:
+        with _pending_lock:
+            del _pending[target_name]
+    future.set_result(target_name)
+    _account(size)
+
+    return target_name
+
+
+def _touch(path):
+    """Mark a cached copy as used, raising FileNotFoundError if gone"""
+    # The access time is what eviction goes by.  It is set by hand, as
+    # mounts often don't keep it, and the modified time is left alone
+    # for conditional requests.
+    stat = os.stat(path)
+    now = time.time()
+    if now - stat.st_atime > CACHE_TOUCH_INTERVAL:
+        os.utime(path, (now, stat.st_mtime))
+
+
+def _write_derivative(name, target, width, image_format):
+    """Resize an image into `target`, returning the bytes written"""
+    pil_format, _, modes = FORMATS[image_format]
+    with Image.open(default_storage.path(name)) as image:
+        resized = image.copy()
+    resized.thumbnail((width, resized.height), Image.LANCZOS)
+    if resized.mode not in modes:
+        resized = resized.convert(_convert_mode(resized, modes))
+
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    # The dot keeps files being written out of eviction scans.
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target), prefix='.')
+    try:
+        with os.fdopen(fd, 'wb') as tmp:
+            resized.save(tmp, format=pil_format)
+            size = tmp.tell()
+        os.replace(tmp_path, target)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+    return size
+
+
+def _convert_mode(image, modes):
+    """Return the mode to save an image in that `modes` don't include"""
+    transparent = 'A' in image.mode or 'a' in image.mode or \
+        'transparency' in image.info
+    if transparent and 'RGBA' in modes:
+        return 'RGBA'
+
+    return 'RGB'
+
+
+def _account(size):
+    """Add a new copy to the cache size, evicting if over budget"""
+    global _cache_size, _cache_scanned
+    with _cache_size_lock:
+        now = time.monotonic()
+        if _cache_size is not None and \
+                now - _cache_scanned < CACHE_RESCAN_INTERVAL and \
+                _cache_size + size <= settings.RECIPE_IMAGE_CACHE_MAX_BYTES:
+            _cache_size += size
+            return
+        # Other processes write to the cache too, so its real size is
+        # only known from a scan.  Rescanning now and then stops every
+        # worker filling its own budget on top of the others'.
+        _cache_size = evict_cache(
+            settings.RECIPE_IMAGE_CACHE_MAX_BYTES * CACHE_LOW_WATERMARK
+        )
+        _cache_scanned = now
+
+
+def evict_cache(target=None):
+    """Delete the least recently used cached copies, returning the size
+
+    Copies are deleted until the cache holds at most `target` bytes, or
+    RECIPE_IMAGE_CACHE_MAX_BYTES if not given.
+    """
+    if target is None:
+        target = settings.RECIPE_IMAGE_CACHE_MAX_BYTES
+    root = default_storage.path(settings.RECIPE_IMAGE_CACHE_DIR)
+    entries = []
+    total = 0
+    for directory, _, files in os.walk(root):
+        for filename in files:
+            if filename.startswith('.'):
+                continue
+            path = os.path.join(directory, filename)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_atime, stat.st_size, path))
+            total += stat.st_size
+    if total <= target:
+        return total
+
+    entries.sort()
+    for _, size, path in entries:
+        if total <= target:
+            break
+        if _remove(path):
+            total -= size
+
+    return total
+
+
+def _remove(path):
+    """Delete a file, returning whether this call deleted it"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        return False
+
+    return True
@@ -0,0 +1,25 @@
+from rest_framework.pagination import CursorPagination
+
+
+class RecipeCursorPagination(CursorPagination):
+    """Keyset pagination over a user's recipes, newest first"""
+    # Each page is fetched with a `WHERE id < <cursor>` condition on the
+    # (user, id) index, so deep pages cost the same as the first one.
+    ordering = '-id'
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+    def get_ordering(self, request, queryset, view):
+        """Order text search results by relevance"""
+        if 'rank' in queryset.query.annotations:
+            return ('-rank', '-id')
+
+        return super().get_ordering(request, queryset, view)
+
+
+class RecipeAttrCursorPagination(RecipeCursorPagination):
+    """Keyset pagination over tags and ingredients by name"""
+    # Names are unique per user, so the order is stable on its own and
+    # the (user, name) unique index serves every page.
+    ordering = '-name'
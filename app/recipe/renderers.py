@@ -0,0 +1,74 @@
+import csv
+import io
+
+from rest_framework.renderers import BaseRenderer
+
+from core.renderers import FastJSONRenderer
+
+
+class StreamingRenderer(BaseRenderer):
+    """Renderer that can also stream an iterable of rows"""
+    # Rows are gathered into chunks of roughly this many bytes, so the
+    # server isn't asked to write one tiny chunk per row.
+    buffer_size = 64 * 1024
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        """Render a single object or list of objects, such as an error"""
+        if data is None:
+            return bytes()
+        rows = data if isinstance(data, list) else [data]
+        return b''.join(self.stream(rows))
+
+    def stream(self, rows):
+        """Yield the rendered rows as chunks of bytes"""
+        # The first row goes out on its own, so clients get bytes as
+        # soon as the query starts returning.
+        buffer = io.BytesIO()
+        first = True
+        for chunk in self.render_rows(rows):
+            buffer.write(chunk)
+            if first or buffer.tell() >= self.buffer_size:
+                yield buffer.getvalue()
+                buffer = io.BytesIO()
+                first = False
+        if buffer.tell():
+            yield buffer.getvalue()
+
+    def render_rows(self, rows):
+        """Yield the bytes of each row, and any header before them"""
+        raise NotImplementedError('render_rows() must be implemented.')
+
+
+class NDJSONRenderer(StreamingRenderer):
+    """Render rows as newline delimited JSON, one object per line"""
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = None
+
+    def render_rows(self, rows):
+        renderer = FastJSONRenderer()
+        for row in rows:
+            yield renderer.render(row) + b'\n'
+
+
+class CSVRenderer(StreamingRenderer):
+    """Render rows of dicts as CSV with a header from the first row"""
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render_rows(self, rows):
+        text = io.StringIO()
+        writer = None
+        for row in rows:
+            if writer is None:
+                writer = csv.DictWriter(text, fieldnames=list(row))
+                writer.writeheader()
+            writer.writerow({
+                # the names of linked tags and ingredients
+                key: '; '.join(value) if isinstance(value, list) else value
+                for key, value in row.items()
+            })
+            yield text.getvalue().encode(self.charset)
+            text.seek(0)
+            text.truncate()
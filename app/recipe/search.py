@@ -0,0 +1,52 @@
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection
+from django.db.models import F, FloatField
+from django.db.models.functions import Cast
+
+from core.models import Recipe
+
+
+def _names_sql(field):
+    """Return SQL aggregating the names linked to recipe `r` by `field`"""
+    relation = Recipe._meta.get_field(field)
+    through = relation.remote_field.through._meta.db_table
+    target = relation.related_model._meta.db_table
+    return (
+        f"(SELECT string_agg(t.name, ' ') FROM {target} t "
+        f"JOIN {through} l ON l.{relation.m2m_reverse_name()} = t.id "
+        f"WHERE l.{relation.m2m_column_name()} = r.id)"
+    )
+
+
+def update_search_vectors(recipe_ids=None):
+    """Rebuild the stored search vector of the given recipes"""
+    # Titles weigh most, then ingredient names, then tag names.  Passing
+    # no IDs rebuilds every recipe.
+    if recipe_ids is not None and not recipe_ids:
+        return
+    sql = (
+        f"UPDATE {Recipe._meta.db_table} r SET search_vector = "
+        f"setweight(to_tsvector(%(config)s, r.title), 'A') || "
+        f"setweight(to_tsvector(%(config)s, "
+        f"coalesce({_names_sql('ingredients')}, '')), 'B') || "
+        f"setweight(to_tsvector(%(config)s, "
+        f"coalesce({_names_sql('tags')}, '')), 'C')"
+    )
+    params = {'config': settings.RECIPE_SEARCH_CONFIG}
+    if recipe_ids is not None:
+        sql += ' WHERE r.id = ANY(%(ids)s)'
+        params['ids'] = list(recipe_ids)
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def search_recipes(queryset, terms):
+    """Filter recipes by a search phrase and annotate their rank"""
+    query = SearchQuery(terms, config=settings.RECIPE_SEARCH_CONFIG)
+    # ts_rank returns a real, cast to double precision so the value
+    # survives a round trip through the pagination cursor unchanged.
+    return queryset.filter(search_vector=query).annotate(
+        rank=Cast(SearchRank(F('search_vector'), query), FloatField())
+    )
@@ -1,15 +1,206 @@
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.contrib.postgres.fields import ArrayField
+from django.db import transaction
+from django.db.models import IntegerField, OuterRef, Subquery
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
 from rest_framework import serializers
+from rest_framework.settings import api_settings
+from rest_framework.utils.serializer_helpers import ReturnList
 
 from core.models import Tag, Ingredient, Recipe
 
+from recipe import images
+from recipe.usage import adjust_usage
+
+
+def link_array(name, column=None):
+    """Return a subquery collecting an array for each recipe's links"""
+    # The IDs of the linked tags or ingredients, or the given column of
+    # them, in no particular order.
+    field = Recipe._meta.get_field(name)
+    if column is None:
+        lookup, output_field = field.m2m_reverse_name(), IntegerField()
+    else:
+        lookup = f'{field.m2m_reverse_field_name()}__{column}'
+        output_field = field.related_model._meta.get_field(column).clone()
+    recipe = field.m2m_field_name()
+
+    return Subquery(
+        field.remote_field.through.objects.filter(
+            **{recipe: OuterRef('pk')}
+        ).values(recipe).annotate(values=ArrayAgg(lookup)).values('values'),
+        output_field=ArrayField(output_field)
+    )
+
+
+class BatchPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """Primary key field that reuses objects loaded for a whole batch"""
+
+    def to_internal_value(self, data):
+        """Return the prefetched object, falling back to a lookup"""
+        prefetched = getattr(self.root, '_prefetched', {})
+        objects = prefetched.get(self.parent.field_name, {})
+        try:
+            obj = objects.get(int(data))
+        except (TypeError, ValueError):
+            obj = None
+        if obj is not None:
+            return obj
+
+        return super().to_internal_value(data)
+
+
+class BulkCreateListSerializer(serializers.ListSerializer):
+    """Create a list of objects with a single multi row INSERT"""
+    # Items are still validated one by one, so errors come back as a
+    # list lined up with the submitted items.
+
+    def to_internal_value(self, data):
+        """Validate a batch, loading referenced objects up front"""
+        limit = settings.RECIPE_BULK_CREATE_MAX_ITEMS
+        if isinstance(data, list) and len(data) > limit:
+            msg = _('Ensure there are no more than {limit} items.')
+            raise serializers.ValidationError({
+                api_settings.NON_FIELD_ERRORS_KEY: [msg.format(limit=limit)]
+            })
+        if isinstance(data, list):
+            self._prefetched = self._prefetch_related(data)
+
+        validated = super().to_internal_value(data)
+        self._check_unique_names(validated)
+        return validated
+
+    def _check_unique_names(self, validated):
+        """Reject names repeated in the batch or the user already has"""
+        # One query for the whole batch, so each item gets its own error
+        # instead of the INSERT failing on the unique constraint.
+        model = self.child.Meta.model
+        if ('user', 'name') not in model._meta.unique_together:
+            return
+        names = [attrs['name'] for attrs in validated]
+        existing = set(model.objects.filter(
+            user=self.context['request'].user, name__in=names
+        ).values_list('name', flat=True))
+
+        errors = []
+        seen = set()
+        for name in names:
+            if name in existing:
+                errors.append({'name': [
+                    _('You already have an object with this name.')
+                ]})
+            elif name in seen:
+                errors.append({'name': [
+                    _('This name is repeated in the list.')
+                ]})
+            else:
+                errors.append({})
+            seen.add(name)
+        if any(errors):
+            raise serializers.ValidationError(errors)
+
+    def _prefetch_related(self, data):
+        """Load every object referenced by PK in the batch in one query"""
+        prefetched = {}
+        for name, field in self.child.fields.items():
+            relation = getattr(field, 'child_relation', None)
+            if not isinstance(relation, BatchPrimaryKeyRelatedField):
+                continue
+            pks = set()
+            for item in data:
+                values = item.get(name) if isinstance(item, dict) else None
+                for value in values if isinstance(values, list) else ():
+                    try:
+                        pks.add(int(value))
+                    except (TypeError, ValueError):
+                        pass
+            prefetched[name] = relation.get_queryset().in_bulk(pks)
+
+        return prefetched
+
+    def create(self, validated_data):
+        """Insert all objects and their M2M links in one transaction"""
+        model = self.child.Meta.model
+        m2m_fields = [
+            field.name for field in model._meta.many_to_many
+            if field.name in self.child.fields
+        ]
+        links = {name: [] for name in m2m_fields}
+        resolve_names = getattr(self.child, 'resolve_names', None)
+        if resolve_names is not None and validated_data:
+            resolve_names(validated_data, validated_data[0]['user'].id)
+        objs = []
+        for attrs in validated_data:
+            for name in m2m_fields:
+                links[name].append(attrs.pop(name, []))
+            objs.append(model(**attrs))
+
+        with transaction.atomic():
+            # PostgreSQL returns the new primary keys from the INSERT,
+            # which the through rows below rely on.
+            objs = model.objects.bulk_create(objs)
+            for name, related in links.items():
+                through = getattr(model, name).through
+                source, target = self._through_columns(model, name)
+                rows = [
+                    through(**{source: obj.pk, target: pk})
+                    for obj, items in zip(objs, related)
+                    # objects, or IDs when resolved from names
+                    for pk in {getattr(item, 'pk', item) for item in items}
+                ]
+                through.objects.bulk_create(rows)
+                # Bulk inserts send no m2m_changed, see recipe.signals.
+                # Touching the linked objects moves their lists' ETags
+                # along with the counts.
+                adjust_usage(
+                    model._meta.get_field(name).related_model,
+                    Counter(getattr(row, target) for row in rows),
+                    modified=timezone.now()
+                )
+
+        if not m2m_fields:
+            return objs
+
+        # Read the rows back with their relations prefetched so the
+        # response does not query each object's links one by one.
+        ids = [obj.pk for obj in objs]
+        saved = model.objects.filter(pk__in=ids).prefetch_related(*m2m_fields)
+        by_id = {obj.pk: obj for obj in saved}
+        return [by_id[pk] for pk in ids]
+
+    @staticmethod
+    def _through_columns(model, name):
+        """Return the through table columns for both ends of an M2M"""
+        field = model._meta.get_field(name)
+        return (
+            field.m2m_column_name(),
+            field.m2m_reverse_name(),
+        )
+
+
+class SparseFieldsMixin:
+    """Serializer mixin that drops the fields a client didn't ask for"""
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
 
 class TagSerializer(serializers.ModelSerializer):
     """Serializer for tag objects"""
 
     class Meta:
         model = Tag
-        fields = ('id', 'name')
-        read_only_fields = ('id',)
+        fields = ('id', 'name', 'recipe_count')
+        read_only_fields = ('id', 'recipe_count')
+        list_serializer_class = BulkCreateListSerializer
 
 
 class IngredientSerializer(serializers.ModelSerializer):
@@ -17,28 +208,134 @@ class IngredientSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Ingredient
-        fields = ('id', 'name')
-        read_only_fields = ('id',)
+        fields = ('id', 'name', 'recipe_count')
+        read_only_fields = ('id', 'recipe_count')
+        list_serializer_class = BulkCreateListSerializer
 
 
-class RecipeSerializer(serializers.ModelSerializer):
+class RecipeSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Serialize a Recipe"""
-    ingredients = serializers.PrimaryKeyRelatedField(
+    ingredients = BatchPrimaryKeyRelatedField(
         many=True,
+        required=False,
         queryset=Ingredient.objects.all()
     )
-    tags = serializers.PrimaryKeyRelatedField(
+    tags = BatchPrimaryKeyRelatedField(
         many=True,
+        required=False,
         queryset=Tag.objects.all()
     )
+    # Names are linked alongside any IDs given, creating the tags and
+    # ingredients that don't exist yet.
+    ingredient_names = serializers.ListField(
+        child=serializers.CharField(max_length=255),
+        required=False,
+        write_only=True
+    )
+    tag_names = serializers.ListField(
+        child=serializers.CharField(max_length=255),
+        required=False,
+        write_only=True
+    )
+
+    # (relation, names field, model) for each relation set by name
+    name_fields = (
+        ('ingredients', 'ingredient_names', Ingredient),
+        ('tags', 'tag_names', Tag),
+    )
 
     class Meta:
         model = Recipe
         fields = (
             'id', 'title', 'ingredients', 'tags', 'time_minutes',
-            'price', 'link'
+            'price', 'link', 'ingredient_names', 'tag_names'
         )
         read_only_fields = ('id', )
+        list_serializer_class = BulkCreateListSerializer
+
+    def create(self, validated_data):
+        """Create a recipe, linking tags and ingredients given by name"""
+        self.resolve_names([validated_data], validated_data['user'].id)
+        return super().create(validated_data)
+
+    def update(self, instance, validated_data):
+        """Update a recipe, linking tags and ingredients given by name"""
+        self.resolve_names([validated_data], instance.user_id)
+        return super().update(instance, validated_data)
+
+    def resolve_names(self, items, user_id):
+        """Swap the names in validated items for IDs, one query each"""
+        for relation, names_field, model in self.name_fields:
+            if not any(names_field in attrs for attrs in items):
+                continue
+            ids = model.objects.upsert_names(user_id, [
+                name for attrs in items
+                for name in attrs.get(names_field, ())
+            ])
+            for attrs in items:
+                if names_field in attrs:
+                    attrs[relation] = [*attrs.get(relation, ()), *(
+                        ids[name] for name in attrs.pop(names_field)
+                    )]
+
+
+class RecipeValuesSerializer:
+    """Read only stand-in for RecipeSerializer working on values() rows"""
+    # Building model instances and running each field's serializer
+    # dominates list time, so rows are mapped straight to the layout
+    # RecipeSerializer produces, link IDs in ascending order.
+    output = (
+        'id', 'title', 'ingredients', 'tags', 'time_minutes', 'price', 'link'
+    )
+    columns = ('id', 'title', 'time_minutes', 'price', 'link')
+    links = ('ingredients', 'tags')
+
+    def __init__(self, rows, fields=None):
+        self.rows = rows
+        self.fields = [
+            name for name in self.output if fields is None or name in fields
+        ]
+
+    @classmethod
+    def get_columns(cls, fields=None):
+        """Return the columns to select for the requested fields"""
+        # the ID is needed to look up links and for the cursor
+        return [
+            name for name in cls.columns
+            if fields is None or name in fields or name == 'id'
+        ]
+
+    @property
+    def data(self):
+        """Return the rows rendered like RecipeSerializer(many=True)"""
+        price = RecipeSerializer().fields['price']
+        links = [name for name in self.links if name in self.fields]
+        link_ids = self._link_ids([row['id'] for row in self.rows], links)
+        data = []
+        for row in self.rows:
+            row_links = link_ids.get(row['id'], {})
+            item = OrderedDict()
+            for name in self.fields:
+                if name in self.links:
+                    item[name] = sorted(row_links.get(name) or ())
+                elif name == 'price':
+                    item[name] = price.to_representation(row[name])
+                else:
+                    item[name] = row[name]
+            data.append(item)
+
+        return ReturnList(data, serializer=self)
+
+    def _link_ids(self, recipe_ids, links):
+        """Return the linked IDs of each recipe using a single query"""
+        if not recipe_ids or not links:
+            return {}
+        subqueries = {f'{name}_ids': link_array(name) for name in links}
+        rows = Recipe.objects.filter(pk__in=recipe_ids).annotate(
+            **subqueries
+        ).values_list('pk', *subqueries)
+
+        return {row[0]: dict(zip(links, row[1:])) for row in rows}
 
 
 class RecipeDetailSerializer(RecipeSerializer):
@@ -46,3 +343,26 @@ class RecipeDetailSerializer(RecipeSerializer):
     # In DRF you can nest serializers, like so...
     ingredients = IngredientSerializer(many=True, read_only=True)
     tags = TagSerializer(many=True, read_only=True)
+
+
+class RecipeImageSerializer(serializers.ModelSerializer):
+    """Serializer for uploading images to recipes"""
+    thumbnails = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Recipe
+        fields = ('id', 'image', 'thumbnails')
+        read_only_fields = ('id',)
+        extra_kwargs = {'image': {'required': True}}
+
+    def get_thumbnails(self, obj):
+        """Return the URL of each resized copy that is ready"""
+        if not obj.image:
+            return {}
+        request = self.context.get('request')
+        urls = images.derivative_urls(obj.image.name)
+
+        return {
+            str(width): request.build_absolute_uri(url) if url else None
+            for width, url in urls.items()
+        }
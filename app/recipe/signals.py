@@ -0,0 +1,188 @@
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.db.models.signals import post_save, post_delete, \
+    pre_delete, m2m_changed
+from django.dispatch import receiver
+from django.utils import timezone
+
+from core.models import Tag, Ingredient, Recipe
+
+from recipe.cache import bump_list_version
+from recipe.search import update_search_vectors
+from recipe.usage import adjust_usage
+
+
+# Maps each recipe M2M through model to the model on the far side and
+# the name of the relation on Recipe.
+RECIPE_LINKS = {
+    Recipe.tags.through: (Tag, 'tags'),
+    Recipe.ingredients.through: (Ingredient, 'ingredients'),
+}
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_attr_lists(sender, instance, **kwargs):
+    """Invalidate cached lists when a tag or ingredient changes"""
+    bump_list_version(instance.user_id, sender)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def invalidate_assigned_lists(sender, instance, action, **kwargs):
+    """Invalidate cached lists when recipe links change"""
+    # Lists filtered with assigned_only depend on which objects are
+    # linked to a recipe.
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        model = Tag if sender is Recipe.tags.through else Ingredient
+        bump_list_version(instance.user_id, model)
+
+
+@receiver(post_delete, sender=Recipe)
+def invalidate_lists_for_recipe(sender, instance, **kwargs):
+    """Invalidate cached lists when a recipe and its links go away"""
+    bump_list_version(instance.user_id, Tag)
+    bump_list_version(instance.user_id, Ingredient)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def touch_linked_objects(sender, instance, action, reverse, pk_set,
+                         **kwargs):
+    """Touch both sides of a recipe link that is added or removed"""
+    model, name = RECIPE_LINKS[sender]
+    now = timezone.now()
+    if action == 'pre_clear':
+        # pk_set is not given when clearing, so touch whatever is
+        # linked now, before the rows go away.
+        if reverse:
+            instance.recipe_set.update(modified=now)
+        else:
+            getattr(instance, name).update(modified=now)
+        type(instance).objects.filter(pk=instance.pk).update(modified=now)
+    elif action in ('post_add', 'post_remove') and pk_set:
+        other = Recipe if reverse else model
+        other.objects.filter(pk__in=pk_set).update(modified=now)
+        type(instance).objects.filter(pk=instance.pk).update(modified=now)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+def touch_recipes_for_attr(sender, instance, created, **kwargs):
+    """Touch the recipes showing a tag or ingredient that was changed"""
+    if not created:
+        instance.recipe_set.update(modified=timezone.now())
+
+
+@receiver(pre_delete, sender=Tag)
+@receiver(pre_delete, sender=Ingredient)
+def touch_recipes_for_deleted_attr(sender, instance, **kwargs):
+    """Touch the recipes about to lose a tag or ingredient"""
+    instance.recipe_set.update(modified=timezone.now())
+
+
+@receiver(pre_delete, sender=Recipe)
+def touch_attrs_for_deleted_recipe(sender, instance, **kwargs):
+    """Touch the tags and ingredients about to lose a recipe"""
+    now = timezone.now()
+    instance.tags.update(modified=now)
+    instance.ingredients.update(modified=now)
+
+
+@receiver(post_save, sender=Recipe)
+def update_recipe_search_vector(sender, instance, created, update_fields,
+                                **kwargs):
+    """Rebuild the search vector of a recipe whose title may have changed"""
+    if created or update_fields is None or 'title' in update_fields:
+        update_search_vectors([instance.pk])
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def update_linked_search_vectors(sender, instance, action, reverse, pk_set,
+                                 **kwargs):
+    """Rebuild the search vectors of recipes whose links changed"""
+    if action == 'pre_clear' and reverse:
+        # Clearing from the tag or ingredient side gives no pk_set, so
+        # note the recipes before their links go away.
+        instance._search_recipe_ids = list(
+            instance.recipe_set.values_list('id', flat=True)
+        )
+    elif action == 'post_clear':
+        if reverse:
+            update_search_vectors(instance.__dict__.pop(
+                '_search_recipe_ids', []
+            ))
+        else:
+            update_search_vectors([instance.pk])
+    elif action in ('post_add', 'post_remove'):
+        update_search_vectors(pk_set if reverse else [instance.pk])
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+def update_search_vectors_for_attr(sender, instance, created, **kwargs):
+    """Rebuild the search vectors of recipes showing a renamed object"""
+    if not created:
+        update_search_vectors(
+            list(instance.recipe_set.values_list('id', flat=True))
+        )
+
+
+@receiver(pre_delete, sender=Tag)
+@receiver(pre_delete, sender=Ingredient)
+def note_recipes_for_deleted_attr(sender, instance, **kwargs):
+    """Note the recipes about to lose a tag or ingredient"""
+    instance._search_recipe_ids = list(
+        instance.recipe_set.values_list('id', flat=True)
+    )
+
+
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def update_search_vectors_for_deleted_attr(sender, instance, **kwargs):
+    """Rebuild the search vectors of recipes that lost a tag or ingredient"""
+    update_search_vectors(instance.__dict__.pop('_search_recipe_ids', []))
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def count_linked_recipes(sender, instance, action, reverse, pk_set,
+                         **kwargs):
+    """Keep recipe counts in step with links that are added or removed"""
+    model, name = RECIPE_LINKS[sender]
+    key = f'_usage_removed_{name}'
+    if action == 'post_add' and pk_set:
+        # pk_set leaves out objects that were already linked
+        if reverse:
+            adjust_usage(model, {instance.pk: len(pk_set)})
+        else:
+            adjust_usage(model, dict.fromkeys(pk_set, 1))
+    elif action in ('pre_remove', 'pre_clear') and not reverse:
+        # Unlike when adding, pk_set may name objects that aren't
+        # linked, so note the ones that are before the rows go away.
+        linked = getattr(instance, name).all()
+        if action == 'pre_remove':
+            linked = linked.filter(pk__in=pk_set)
+        instance.__dict__[key] = list(linked.values_list('pk', flat=True))
+    elif action == 'pre_remove':
+        instance.__dict__[key] = \
+            instance.recipe_set.filter(pk__in=pk_set).count()
+    elif action in ('post_remove', 'post_clear') and not reverse:
+        adjust_usage(model, dict.fromkeys(instance.__dict__.pop(key, ()), -1))
+    elif action == 'post_remove':
+        adjust_usage(model, {instance.pk: -instance.__dict__.pop(key, 0)})
+    elif action == 'post_clear':
+        model.objects.filter(pk=instance.pk).update(recipe_count=0)
+
+
+@receiver(pre_delete, sender=Recipe)
+def uncount_deleted_recipe(sender, instance, **kwargs):
+    """Take a recipe about to be deleted off its tags and ingredients"""
+    # The links go with the recipe without sending m2m_changed.
+    for name in ('tags', 'ingredients'):
+        getattr(instance, name).update(recipe_count=Greatest(
+            F('recipe_count') - 1, Value(0)
+        ))
@@ -0,0 +1,178 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest.mock import patch
+
+from PIL import Image
+
+from django.test import SimpleTestCase, override_settings
+
+from recipe import images
+
+
+IMAGE_NAME = 'uploads/recipe/abcdef.jpg'
+
+
+class ImageCacheTests(SimpleTestCase):
+    """Test the cache of images resized on demand"""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            MEDIA_ROOT=self.media_root
+        )
+        self.settings_override.enable()
+        images._cache_size = None
+        images._cache_scanned = None
+        path = os.path.join(self.media_root, IMAGE_NAME)
+        os.makedirs(os.path.dirname(path))
+        Image.new('RGBA', (800, 400)).save(path, format='PNG')
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+        images._cache_size = None
+        images._cache_scanned = None
+
+    def cached_path(self, width, image_format):
+        return os.path.join(
+            self.media_root, images.cache_name(IMAGE_NAME, width, image_format)
+        )
+
+    def write_cached(self, width, size, used):
+        """Put a file of `size` bytes in the cache, last used at `used`"""
+        path = self.cached_path(width, 'jpeg')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'x' * size)
+        os.utime(path, (used, used))
+        return path
+
+    def test_made_once(self):
+        """Test a cached copy is only resized the first time"""
+        with patch('recipe.images._write_derivative',
+                   wraps=images._write_derivative) as write:
+            first = images.cached_derivative(IMAGE_NAME, 160, 'jpeg')
+            second = images.cached_derivative(IMAGE_NAME, 160, 'jpeg')
+
+        self.assertEqual(first, second)
+        write.assert_called_once()
+        with Image.open(self.cached_path(160, 'jpeg')) as image:
+            # JPEG has no alpha channel to keep
+            self.assertEqual((image.format, image.mode), ('JPEG', 'RGB'))
+            self.assertEqual(image.size, (160, 80))
+
+    def test_unsupported_mode_converted(self):
+        """Test modes a format can't save are converted to one it can"""
+        Image.new('CMYK', (800, 400)).save(
+            os.path.join(self.media_root, IMAGE_NAME), format='JPEG'
+        )
+
+        for image_format in images.FORMATS:
+            images.cached_derivative(IMAGE_NAME, 160, image_format)
+
+            with Image.open(self.cached_path(160, image_format)) as image:
+                self.assertEqual(image.mode, 'RGB')
+                self.assertEqual(image.size, (160, 80))
+
+    def test_concurrent_requests_share_resize(self):
+        """Test requests for a copy being made wait for it"""
+        started = threading.Event()
+        release = threading.Event()
+        write = images._write_derivative
+
+        def slow_write(*args):
+            started.set()
+            release.wait(5)
+            return write(*args)
+
+        results = []
+        with patch('recipe.images._write_derivative',
+                   side_effect=slow_write) as mock_write:
+            threads = [
+                threading.Thread(target=lambda: results.append(
+                    images.cached_derivative(IMAGE_NAME, 320, 'webp')
+                ))
+                for _ in range(4)
+            ]
+            threads[0].start()
+            started.wait(5)
+            for thread in threads[1:]:
+                thread.start()
+            # give the others time to find the copy being made
+            time.sleep(0.1)
+            release.set()
+            for thread in threads:
+                thread.join(5)
+
+        self.assertEqual(mock_write.call_count, 1)
+        self.assertEqual(
+            results, [images.cache_name(IMAGE_NAME, 320, 'webp')] * 4
+        )
+        self.assertEqual(images._pending, {})
+
+    def test_failed_resize_not_kept(self):
+        """Test a failed resize is raised and leaves nothing behind"""
+        os.remove(os.path.join(self.media_root, IMAGE_NAME))
+
+        with self.assertRaises(FileNotFoundError):
+            images.cached_derivative(IMAGE_NAME, 160, 'jpeg')
+
+        self.assertEqual(images._pending, {})
+        self.assertFalse(os.path.exists(self.cached_path(160, 'jpeg')))
+
+    def test_hit_marks_copy_used(self):
+        """Test serving a copy moves its access time, not its mtime"""
+        old = time.time() - 3600
+        path = self.write_cached(160, 10, old)
+
+        images.cached_derivative(IMAGE_NAME, 160, 'jpeg')
+
+        stat = os.stat(path)
+        self.assertGreater(stat.st_atime, old + 3000)
+        self.assertEqual(int(stat.st_mtime), int(old))
+
+    def test_evict_least_recently_used(self):
+        """Test the copies used longest ago are deleted first"""
+        now = time.time()
+        oldest = self.write_cached(80, 400, now - 300)
+        older = self.write_cached(160, 400, now - 200)
+        recent = self.write_cached(320, 400, now - 100)
+
+        total = images.evict_cache(900)
+
+        self.assertEqual(total, 800)
+        self.assertFalse(os.path.exists(oldest))
+        self.assertTrue(os.path.exists(older))
+        self.assertTrue(os.path.exists(recent))
+
+    def test_new_copy_over_budget_evicts(self):
+        """Test making a copy past the byte budget makes room"""
+        old = self.write_cached(80, 5000, time.time() - 300)
+
+        with override_settings(RECIPE_IMAGE_CACHE_MAX_BYTES=6000):
+            images.cached_derivative(IMAGE_NAME, 160, 'png')
+            self.assertTrue(os.path.exists(old))
+            images.cached_derivative(IMAGE_NAME, 960, 'png')
+
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(self.cached_path(160, 'png')))
+        self.assertTrue(os.path.exists(self.cached_path(960, 'png')))
+        self.assertLessEqual(images._cache_size, 6000 * 0.9)
+
+    def test_rescan_sees_other_processes(self):
+        """Test copies written by other processes count once rescanned"""
+        with override_settings(RECIPE_IMAGE_CACHE_MAX_BYTES=6000):
+            images.cached_derivative(IMAGE_NAME, 80, 'png')
+            # another worker fills the cache without this one knowing
+            other = self.write_cached(960, 5500, time.time() - 300)
+            images.cached_derivative(IMAGE_NAME, 160, 'png')
+            self.assertTrue(os.path.exists(other))
+
+            images._cache_scanned -= images.CACHE_RESCAN_INTERVAL
+            images.cached_derivative(IMAGE_NAME, 320, 'png')
+
+        self.assertFalse(os.path.exists(other))
+        self.assertLessEqual(images._cache_size, 6000 * 0.9)
@@ -1,13 +1,15 @@
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.urls import reverse
 from django.test import TestCase
 
 from rest_framework import status
 from rest_framework.test import APIClient
 
-from core.models import Ingredient
+from core.models import Ingredient, Recipe
 
 from recipe.serializers import IngredientSerializer
+from recipe.tests.utils import run_on_commit
 
 
 INGREDIENTS_URL = reverse('recipe:ingredient-list')
@@ -31,6 +33,7 @@ class PrivateIngredientsApiTests(TestCase):
     """Test the private ingredients API"""
 
     def setUp(self):
+        cache.clear()
         self.client = APIClient()
         self.user = get_user_model().objects.create_user(
             'test@test.com',
@@ -49,7 +52,7 @@ class PrivateIngredientsApiTests(TestCase):
         ingredients = Ingredient.objects.all().order_by('-name')
         serializer = IngredientSerializer(ingredients, many=True)
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(res.data, serializer.data)
+        self.assertEqual(res.data['results'], serializer.data)
 
     def test_ingredient_limited_to_user(self):
         """Test that ingredients for the authenticated user are returned"""
@@ -63,8 +66,8 @@ class PrivateIngredientsApiTests(TestCase):
         res = self.client.get(INGREDIENTS_URL)
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(res.data), 1)
-        self.assertEqual(res.data[0]['name'], ingredient.name)
+        self.assertEqual(len(res.data['results']), 1)
+        self.assertEqual(res.data['results'][0]['name'], ingredient.name)
 
     def test_create_ingredient_successful(self):
         """Test if an ingredient can be created"""
@@ -83,3 +86,68 @@ class PrivateIngredientsApiTests(TestCase):
         res = self.client.post(INGREDIENTS_URL, payload)
 
         self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_retrieve_ingredients_assigned_to_recipes(self):
+        """Test filtering ingredients by those assigned to recipes"""
+        ingredient1 = Ingredient.objects.create(user=self.user, name='Apples')
+        ingredient2 = Ingredient.objects.create(user=self.user, name='Turkey')
+        for title in ('Apple crumble', 'Apple pie'):
+            recipe = Recipe.objects.create(
+                title=title,
+                time_minutes=5,
+                price=10,
+                user=self.user
+            )
+            recipe.ingredients.add(ingredient1)
+
+        res = self.client.get(INGREDIENTS_URL, {'assigned_only': 1})
+
+        names = [ingredient['name'] for ingredient in res.data['results']]
+        self.assertEqual(names, [ingredient1.name])
+        self.assertNotIn(ingredient2.name, names)
+
+    def test_update_ingredient_invalidates_cache(self):
+        """Test renaming an ingredient refreshes the cached list"""
+        ingredient = Ingredient.objects.create(user=self.user, name='Kale')
+        self.client.get(INGREDIENTS_URL)
+
+        ingredient.name = 'Chard'
+        with run_on_commit():
+            ingredient.save()
+        res = self.client.get(INGREDIENTS_URL)
+
+        self.assertEqual(res.data['results'][0]['name'], 'Chard')
+
+    def test_bulk_create_ingredients(self):
+        """Test creating a list of ingredients in one request"""
+        payload = [{'name': 'Flour'}, {'name': 'Sugar'}, {'name': 'Eggs'}]
+
+        res = self.client.post(INGREDIENTS_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        names = Ingredient.objects.filter(
+            user=self.user
+        ).values_list('name', flat=True)
+        self.assertCountEqual(names, ['Flour', 'Sugar', 'Eggs'])
+
+    def test_popular_ingredients(self):
+        """Test listing the ingredients used by the most recipes"""
+        salt = Ingredient.objects.create(user=self.user, name='Salt')
+        kale = Ingredient.objects.create(user=self.user, name='Kale')
+        Ingredient.objects.create(user=self.user, name='Saffron')
+        for i in range(3):
+            recipe = Recipe.objects.create(
+                user=self.user, title=f'Recipe {i}', time_minutes=5, price=1
+            )
+            recipe.ingredients.add(salt)
+        recipe.ingredients.add(kale)
+
+        res = self.client.get(reverse('recipe:ingredient-popular'))
+
+        salt.refresh_from_db()
+        kale.refresh_from_db()
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            res.data, IngredientSerializer([salt, kale], many=True).data
+        )
+        self.assertEqual(res.data[0]['recipe_count'], 3)
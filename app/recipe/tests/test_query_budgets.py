@@ -0,0 +1,124 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Recipe, Tag, Ingredient
+
+from recipe.tests.utils import QueryBudgetMixin, QueryRecorder, query_budget
+
+
+RECIPES = 10
+
+
+class QueryBudgetTests(QueryBudgetMixin, TestCase):
+    """Test the API stays within its query budgets as data grows"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            'test@test.com',
+            'testpass'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        tags = [
+            Tag.objects.create(user=self.user, name=f'Tag {i}')
+            for i in range(3)
+        ]
+        ingredients = [
+            Ingredient.objects.create(user=self.user, name=f'Ingredient {i}')
+            for i in range(3)
+        ]
+        self.recipes = []
+        for i in range(RECIPES):
+            recipe = Recipe.objects.create(
+                user=self.user, title=f'Recipe {i}', time_minutes=5, price=1
+            )
+            recipe.tags.add(*tags[:i % 3 + 1])
+            recipe.ingredients.add(*ingredients[:i % 3 + 1])
+            self.recipes.append(recipe)
+
+    def get(self, name, *args, **params):
+        res = self.client.get(reverse(name, args=args), params)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return res
+
+    @query_budget()
+    def test_recipe_budgets(self):
+        """Test the recipe endpoints stay within their budgets"""
+        self.get('recipe:recipe-list')
+        self.get('recipe:recipe-list', fields='id,title')
+        self.get('recipe:recipe-list', tags=self.recipes[0].tags.get().id)
+        self.get('recipe:recipe-detail', self.recipes[0].id)
+        self.get('recipe:recipe-upload-image', self.recipes[0].id)
+        b''.join(self.get('recipe:recipe-export').streaming_content)
+        self.get('recipe:recipe-shopping-list', recipes=','.join(
+            str(recipe.id) for recipe in self.recipes
+        ))
+
+    @query_budget()
+    def test_attr_budgets(self):
+        """Test the tag and ingredient endpoints stay within their budgets"""
+        for name in ('tag', 'ingredient'):
+            self.get(f'recipe:{name}-list')
+            self.get(f'recipe:{name}-list', assigned_only=1)
+            self.get(f'recipe:{name}-popular')
+
+    @query_budget()
+    def test_user_budgets(self):
+        """Test the profile endpoint stays within its budget"""
+        self.get('user:me')
+
+    def test_n_plus_one_detected(self):
+        """Test a query repeated for each row is reported"""
+        with self.assertRaises(AssertionError) as cm:
+            with self.assertNoNPlusOne():
+                for recipe in Recipe.objects.all():
+                    list(recipe.tags.all())
+
+        message = str(cm.exception)
+        self.assertIn(f'{RECIPES} queries shaped like', message)
+        self.assertIn('test_query_budgets.py', message)
+
+    def test_prefetch_not_flagged(self):
+        """Test queries with growing IN lists are not reported"""
+        with self.assertNoNPlusOne():
+            for count in (1, 5, 10):
+                list(Recipe.objects.filter(
+                    pk__in=[recipe.pk for recipe in self.recipes[:count]]
+                ).prefetch_related('tags'))
+                list(Recipe.objects.filter(pk=self.recipes[0].pk))
+
+    def test_budget_exceeded(self):
+        """Test going over an endpoint budget fails with the queries"""
+        decorated = query_budget(budget=1)(
+            lambda self: self.get('recipe:recipe-detail', self.recipes[0].id)
+        )
+
+        with self.assertRaises(AssertionError) as cm:
+            decorated(self)
+
+        message = str(cm.exception)
+        self.assertIn(
+            f'executed by GET /api/recipe/recipes/{self.recipes[0].id}/',
+            message
+        )
+        self.assertIn('budget is 1', message)
+        # each query names the app code that ran it
+        self.assertIn('recipe/views.py', message)
+
+    def test_recorder_call_sites(self):
+        """Test recorded queries carry their SQL and call site"""
+        with QueryRecorder() as recorder:
+            Recipe.objects.filter(title='Recipe 1').count()
+
+        query, = recorder.captured_queries
+        self.assertIn("'Recipe 1'", query['sql'])
+        self.assertIn('%s', query['shape'])
+        self.assertTrue(any(
+            'test_query_budgets.py' in site for site in query['call_site']
+        ))
@@ -0,0 +1,175 @@
+from unittest import skipUnless
+
+from django.contrib.auth import get_user_model
+from django.contrib.postgres.search import SearchQuery
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core.authentication import token_cache
+from core.models import Recipe, Tag, Ingredient
+
+from recipe.search import update_search_vectors
+from recipe.usage import recount_usage
+from recipe.tests.utils import QueryPlanMixin, explain, plan_nodes
+
+
+USERS = 20
+RECIPES_PER_USER = 300
+ATTRS_PER_USER = 100
+LINKS_PER_RECIPE = 3
+
+# Tables large enough that reading them in full is a regression.
+HOT_TABLES = {
+    'core_recipe', 'core_tag', 'core_ingredient',
+    'core_recipe_tags', 'core_recipe_ingredients',
+}
+
+
+@skipUnless(connection.vendor == 'postgresql', 'needs PostgreSQL plans')
+class QueryPlanTests(QueryPlanMixin, TestCase):
+    """Test the hot API queries are answered from indexes"""
+
+    @classmethod
+    def setUpTestData(cls):
+        users = get_user_model().objects.bulk_create(
+            get_user_model()(email=f'user{i}@test.com', name=f'User {i}')
+            for i in range(USERS)
+        )
+        Token.objects.bulk_create(
+            Token(user=user, key=Token().generate_key()) for user in users
+        )
+        tags = Tag.objects.bulk_create(
+            Tag(user=user, name=f'Tag {i}')
+            for user in users for i in range(ATTRS_PER_USER)
+        )
+        ingredients = Ingredient.objects.bulk_create(
+            Ingredient(user=user, name=f'Ingredient {i}')
+            for user in users for i in range(ATTRS_PER_USER)
+        )
+        recipes = Recipe.objects.bulk_create(
+            Recipe(user=user, title=f'Recipe {i}', time_minutes=i % 90,
+                   price=i % 50)
+            for user in users for i in range(RECIPES_PER_USER)
+        )
+
+        tag_links = []
+        ingredient_links = []
+        for n, recipe in enumerate(recipes):
+            base = (n // RECIPES_PER_USER) * ATTRS_PER_USER
+            for k in range(LINKS_PER_RECIPE):
+                offset = base + (n + k) % ATTRS_PER_USER
+                tag_links.append(Recipe.tags.through(
+                    recipe_id=recipe.id, tag_id=tags[offset].id
+                ))
+                ingredient_links.append(Recipe.ingredients.through(
+                    recipe_id=recipe.id, ingredient_id=ingredients[offset].id
+                ))
+        Recipe.tags.through.objects.bulk_create(tag_links)
+        Recipe.ingredients.through.objects.bulk_create(ingredient_links)
+        # Without statistics the planner may scan the link tables once
+        # per recipe while rebuilding the vectors.
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        update_search_vectors()
+        recount_usage(Tag)
+        recount_usage(Ingredient)
+
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+        cls.user = users[0]
+        cls.recipe = recipes[0]
+
+    def setUp(self):
+        cache.clear()
+        token_cache.clear()
+        self.client = APIClient()
+        token = Token.objects.get(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def assert_endpoint_indexed(self, url, params=None):
+        """Request `url` and check the plan of every query it ran"""
+        with CaptureQueriesContext(connection) as context:
+            res = self.client.get(url, params)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertIndexedPlans(context, HOT_TABLES)
+
+    def test_recipe_list_plans(self):
+        """Test listing recipes uses indexes only"""
+        self.assert_endpoint_indexed(reverse('recipe:recipe-list'))
+
+    def test_recipe_detail_plans(self):
+        """Test retrieving a recipe uses indexes only"""
+        self.assert_endpoint_indexed(
+            reverse('recipe:recipe-detail', args=[self.recipe.id])
+        )
+
+    def test_tag_list_plans(self):
+        """Test listing tags uses indexes only"""
+        self.assert_endpoint_indexed(reverse('recipe:tag-list'))
+
+    def test_ingredient_list_plans(self):
+        """Test listing ingredients uses indexes only"""
+        self.assert_endpoint_indexed(reverse('recipe:ingredient-list'))
+
+    def test_popular_tags_plans(self):
+        """Test listing the most used tags uses indexes only"""
+        self.assert_endpoint_indexed(reverse('recipe:tag-popular'))
+
+    def test_shopping_list_plans(self):
+        """Test merging ingredients reads only the selected recipes"""
+        # The merged rows are sorted by name, but only those matched.
+        recipes = Recipe.objects.filter(user=self.user)[:5]
+        with CaptureQueriesContext(connection) as context:
+            res = self.client.get(reverse('recipe:recipe-shopping-list'), {
+                'recipes': ','.join(str(recipe.id) for recipe in recipes)
+            })
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertTrue(res.data)
+        self.assertIndexedPlans(context, HOT_TABLES, allow_sort=True)
+
+    def test_user_profile_plans(self):
+        """Test retrieving the profile uses indexes only"""
+        self.assert_endpoint_indexed(reverse('user:me'))
+
+    def test_unindexed_query_flagged(self):
+        """Test the harness fails on a query no index can serve"""
+        with CaptureQueriesContext(connection) as context:
+            list(Recipe.objects.filter(user=self.user).order_by('title'))
+
+        with self.assertRaises(AssertionError):
+            self.assertIndexedPlans(context, HOT_TABLES)
+
+    def test_recipe_search_plans(self):
+        """Test text search avoids full scans"""
+        # Ordering by rank needs a sort, but only over the matches.
+        with CaptureQueriesContext(connection) as context:
+            res = self.client.get(
+                reverse('recipe:recipe-list'), {'q': 'recipe 7'}
+            )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertIndexedPlans(context, HOT_TABLES, allow_sort=True)
+
+    def test_search_vector_gin_index(self):
+        """Test search matches can be read from the GIN index"""
+        with CaptureQueriesContext(connection) as context:
+            list(Recipe.objects.filter(
+                search_vector=SearchQuery('recipe 7', config='english')
+            ))
+
+        plan = explain(context.captured_queries[0]['sql'])
+
+        names = {node.get('Index Name') for node in plan_nodes(plan)}
+        self.assertTrue(
+            any(name and name.endswith('_gin') for name in names), names
+        )
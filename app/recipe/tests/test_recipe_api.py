@@ -1,16 +1,38 @@
+import csv
+import io
+import json
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+from PIL import Image
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.cache import cache
+from django.db import connections
+from django.test import TestCase, override_settings
 from django.urls import reverse
+from django.utils.http import http_date
 
 from rest_framework import status
 from rest_framework.test import APIClient
+from rest_framework.renderers import JSONRenderer
 
 from core.models import Recipe, Tag, Ingredient
 
-from recipe.serializers import RecipeSerializer, RecipeDetailSerializer
+from recipe import images
+from recipe.pagination import RecipeCursorPagination
+from recipe.serializers import RecipeSerializer, RecipeDetailSerializer, \
+    RecipeValuesSerializer
+from recipe.tests.utils import QueryBudgetMixin, query_budget
 
 
 RECIPES_URL = reverse('recipe:recipe-list')
+EXPORT_URL = reverse('recipe:recipe-export')
+SHOPPING_LIST_URL = reverse('recipe:recipe-shopping-list')
 
 
 def detail_url(recipe_id):
@@ -18,6 +40,18 @@ def detail_url(recipe_id):
     return reverse('recipe:recipe-detail', args=[recipe_id])
 
 
+def image_upload_url(recipe_id):
+    """Return URL for recipe image upload"""
+    return reverse('recipe:recipe-upload-image', args=[recipe_id])
+
+
+def image_url(recipe_id, width, image_format):
+    """Return URL for a recipe image resized on demand"""
+    return reverse(
+        'recipe:recipe-image', args=[recipe_id, width, image_format]
+    )
+
+
 def sample_tag(user, name='Main Course'):
     """Create a sample tag"""
     return Tag.objects.create(user=user, name=name)
@@ -53,7 +87,7 @@ class PublicRecipeApiTests(TestCase):
         self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
 
 
-class PrivateRecipeApiTests(TestCase):
+class PrivateRecipeApiTests(QueryBudgetMixin, TestCase):
     """Test authenticated API requests"""
 
     def setUp(self):
@@ -77,7 +111,7 @@ class PrivateRecipeApiTests(TestCase):
         serializer = RecipeSerializer(recipes, many=True)
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(res.data, serializer.data)
+        self.assertEqual(res.data['results'], serializer.data)
 
     def test_recipes_limited_to_user(self):
         """Test retrieving recipes for user"""
@@ -94,8 +128,8 @@ class PrivateRecipeApiTests(TestCase):
         serializer = RecipeSerializer(recipes, many=True)
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(res.data), 1)
-        self.assertEqual(res.data, serializer.data)
+        self.assertEqual(len(res.data['results']), 1)
+        self.assertEqual(res.data['results'], serializer.data)
 
     def test_view_recipe_detail(self):
         """Test viewing a recipe detail"""
@@ -161,6 +195,86 @@ class PrivateRecipeApiTests(TestCase):
         self.assertIn(ingredient1, ingredients)
         self.assertIn(ingredient2, ingredients)
 
+    def test_create_recipe_with_names(self):
+        """Test tags and ingredients given by name are found or created"""
+        existing = sample_tag(user=self.user, name='Vegan')
+        other_user = get_user_model().objects.create_user('o@test.com', 'pw')
+        sample_ingredient(user=other_user, name='Tofu')
+        payload = {
+            'title': 'Tofu scramble',
+            'tag_names': ['Vegan', 'Breakfast', 'Breakfast'],
+            'ingredient_names': ['Tofu'],
+            'time_minutes': 15,
+            'price': '3.00',
+        }
+
+        # one upsert for each relation on top of a plain create
+        with self.assertMaxQueries(20):
+            res = self.client.post(RECIPES_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertNotIn('tag_names', res.data)
+        recipe = Recipe.objects.get(id=res.data['id'])
+        self.assertEqual(
+            sorted(tag.name for tag in recipe.tags.all()),
+            ['Breakfast', 'Vegan']
+        )
+        self.assertIn(existing, recipe.tags.all())
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 2)
+        ingredient = recipe.ingredients.get()
+        self.assertEqual(ingredient.user, self.user)
+        self.assertEqual(ingredient.name, 'Tofu')
+
+    def test_create_recipe_with_ids_and_names(self):
+        """Test names are linked alongside IDs"""
+        tag = sample_tag(user=self.user, name='Quick')
+        payload = {
+            'title': 'Omelette',
+            'tags': [tag.id],
+            'tag_names': ['Eggs'],
+            'time_minutes': 5,
+            'price': '2.00',
+        }
+
+        res = self.client.post(RECIPES_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(res.data['tags']), 2)
+        self.assertIn(tag.id, res.data['tags'])
+
+    def test_update_recipe_tag_names(self):
+        """Test updating with names replaces the linked tags"""
+        recipe = sample_recipe(user=self.user)
+        recipe.tags.add(sample_tag(user=self.user, name='Old'))
+
+        res = self.client.patch(
+            detail_url(recipe.id), {'tag_names': ['New']}, format='json'
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([tag.name for tag in recipe.tags.all()], ['New'])
+
+    def test_bulk_create_recipes_with_names(self):
+        """Test a bulk create resolves every name in one query each"""
+        payload = [
+            {'title': f'Recipe {i}', 'time_minutes': 10, 'price': '5.00',
+             'tag_names': ['Shared', f'Tag {i}'],
+             'ingredient_names': ['Salt']}
+            for i in range(5)
+        ]
+
+        with self.assertMaxQueries(14):
+            res = self.client.post(RECIPES_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Tag.objects.count(), 6)
+        self.assertEqual(Ingredient.objects.count(), 1)
+        shared = Tag.objects.get(name='Shared')
+        self.assertEqual(shared.recipe_set.count(), 5)
+        self.assertEqual(
+            Ingredient.objects.get().recipe_set.count(), 5
+        )
+
     def test_partial_update_recipe(self):
         """test updating a recipe with PATCH method"""
         # NOTE: update functionality is available out of the box with
@@ -211,3 +325,938 @@ class PrivateRecipeApiTests(TestCase):
         # assert that the recipe contains no tags, since we're using
         # PUT method, and not providing new tags, there should be none.
         self.assertEqual(len(tags), 0)
+
+    @query_budget()
+    def test_list_recipes_query_count_constant(self):
+        """Test listing recipes does not issue queries per recipe"""
+        def add_recipes(count):
+            for _ in range(count):
+                title = f'Recipe {Recipe.objects.count()}'
+                recipe = sample_recipe(user=self.user, title=title)
+                recipe.tags.add(sample_tag(user=self.user, name=title))
+                recipe.ingredients.add(
+                    sample_ingredient(user=self.user, name=title)
+                )
+
+        add_recipes(1)
+        baseline = self.count_queries(lambda: self.client.get(RECIPES_URL))
+        add_recipes(10)
+
+        with self.assertMaxQueries(baseline):
+            res = self.client.get(RECIPES_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res.data['results']), 11)
+
+    @query_budget()
+    def test_view_recipe_detail_query_budget(self):
+        """Test recipe detail fetches nested objects in bulk"""
+        recipe = sample_recipe(user=self.user)
+        for name in ('Vegan', 'Dessert', 'Quick'):
+            recipe.tags.add(sample_tag(user=self.user, name=name))
+            recipe.ingredients.add(
+                sample_ingredient(user=self.user, name=name)
+            )
+
+        # one query for the conditional request validators, one for the
+        # recipe and one for each nested relation
+        with self.assertMaxQueries(4):
+            res = self.client.get(detail_url(recipe.id))
+
+        self.assertEqual(len(res.data['tags']), 3)
+        self.assertEqual(len(res.data['ingredients']), 3)
+
+    @query_budget()
+    def test_list_recipes_paginated(self):
+        """Test recipes are returned a page at a time with a cursor"""
+        for i in range(5):
+            sample_recipe(user=self.user, title=f'Recipe {i}')
+
+        res = self.client.get(RECIPES_URL, {'page_size': 2})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        titles = [recipe['title'] for recipe in res.data['results']]
+        self.assertEqual(titles, ['Recipe 4', 'Recipe 3'])
+        self.assertIsNone(res.data['previous'])
+
+        res = self.client.get(res.data['next'])
+
+        titles = [recipe['title'] for recipe in res.data['results']]
+        self.assertEqual(titles, ['Recipe 2', 'Recipe 1'])
+
+    def test_list_recipes_page_size_capped(self):
+        """Test the requested page size cannot exceed the maximum"""
+        for i in range(3):
+            sample_recipe(user=self.user)
+
+        with patch.object(RecipeCursorPagination, 'max_page_size', 2):
+            res = self.client.get(RECIPES_URL, {'page_size': 1000})
+
+        self.assertEqual(len(res.data['results']), 2)
+        self.assertIsNotNone(res.data['next'])
+
+    @query_budget()
+    def test_filter_recipes_by_tags(self):
+        """Test returning recipes with specific tags"""
+        recipe1 = sample_recipe(user=self.user, title='Thai vegetable curry')
+        recipe2 = sample_recipe(user=self.user, title='Aubergine with tahini')
+        recipe3 = sample_recipe(user=self.user, title='Fish and chips')
+        tag1 = sample_tag(user=self.user, name='Vegan')
+        tag2 = sample_tag(user=self.user, name='Vegetarian')
+        recipe1.tags.add(tag1)
+        recipe2.tags.add(tag1, tag2)
+
+        res = self.client.get(RECIPES_URL, {'tags': f'{tag1.id},{tag2.id}'})
+
+        ids = [recipe['id'] for recipe in res.data['results']]
+        self.assertEqual(ids, [recipe2.id, recipe1.id])
+        self.assertNotIn(recipe3.id, ids)
+
+    @query_budget()
+    def test_filter_recipes_by_ingredients(self):
+        """Test returning recipes with specific ingredients"""
+        recipe1 = sample_recipe(user=self.user, title='Posh beans on toast')
+        recipe2 = sample_recipe(user=self.user, title='Chicken cacciatore')
+        recipe3 = sample_recipe(user=self.user, title='Steak and mushrooms')
+        ingredient1 = sample_ingredient(user=self.user, name='Feta cheese')
+        ingredient2 = sample_ingredient(user=self.user, name='Chicken')
+        recipe1.ingredients.add(ingredient1)
+        recipe2.ingredients.add(ingredient2)
+
+        res = self.client.get(
+            RECIPES_URL,
+            {'ingredients': f'{ingredient1.id},{ingredient2.id}'}
+        )
+
+        ids = [recipe['id'] for recipe in res.data['results']]
+        self.assertEqual(ids, [recipe2.id, recipe1.id])
+        self.assertNotIn(recipe3.id, ids)
+
+    def test_filter_recipes_by_price_and_time(self):
+        """Test returning recipes within price and time ranges"""
+        cheap = sample_recipe(user=self.user, price=2, time_minutes=5)
+        sample_recipe(user=self.user, price=20, time_minutes=5)
+        sample_recipe(user=self.user, price=2, time_minutes=90)
+
+        res = self.client.get(
+            RECIPES_URL,
+            {'max_price': '5.50', 'min_time': 1, 'max_time': 30}
+        )
+
+        ids = [recipe['id'] for recipe in res.data['results']]
+        self.assertEqual(ids, [cheap.id])
+
+    def test_filter_recipes_invalid_param(self):
+        """Test malformed filters are rejected"""
+        res = self.client.get(RECIPES_URL, {'tags': '1,two'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('tags', res.data)
+
+    def test_bulk_create_recipes(self):
+        """Test creating a list of recipes with their links"""
+        tag = sample_tag(user=self.user)
+        ingredient = sample_ingredient(user=self.user)
+        payload = [
+            {
+                'title': f'Recipe {i}',
+                'time_minutes': 10,
+                'price': '5.00',
+                'tags': [tag.id],
+                'ingredients': [ingredient.id, ingredient.id],
+            }
+            for i in range(10)
+        ]
+
+        res = self.client.post(RECIPES_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(res.data), 10)
+        self.assertEqual(res.data[0]['tags'], [tag.id])
+        self.assertEqual(res.data[0]['ingredients'], [ingredient.id])
+        recipes = Recipe.objects.filter(user=self.user)
+        self.assertEqual(recipes.count(), 10)
+        self.assertEqual(tag.recipe_set.count(), 10)
+
+    def test_update_with_list_rejected(self):
+        """Test a list sent to update a recipe is a bad request"""
+        recipe = sample_recipe(user=self.user)
+        payload = [{'title': 'Soup', 'time_minutes': 5, 'price': '1.00'}]
+
+        for method in (self.client.put, self.client.patch):
+            res = method(detail_url(recipe.id), payload, format='json')
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.title, 'Sample Recipe')
+
+    def test_bulk_create_recipes_query_count_constant(self):
+        """Test bulk creating recipes does not query per recipe"""
+        tag = sample_tag(user=self.user)
+
+        def post(count):
+            payload = [
+                {'title': 'Soup', 'time_minutes': 5, 'price': '2.00',
+                 'tags': [tag.id], 'ingredients': []}
+                for i in range(count)
+            ]
+            return self.client.post(RECIPES_URL, payload, format='json')
+
+        small = self.count_queries(lambda: post(1))
+        large = self.count_queries(lambda: post(10))
+
+        self.assertEqual(large, small)
+        self.assertEqual(Recipe.objects.count(), 11)
+
+    def test_bulk_create_recipes_invalid_pk(self):
+        """Test unknown PKs are reported against their item"""
+        tag = sample_tag(user=self.user)
+        payload = [
+            {'title': 'Soup', 'time_minutes': 5, 'price': '2.00',
+             'tags': [tag.id], 'ingredients': []},
+            {'title': 'Stew', 'time_minutes': 5, 'price': '2.00',
+             'tags': [tag.id + 100], 'ingredients': []},
+        ]
+
+        res = self.client.post(RECIPES_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res.data[0], {})
+        self.assertIn('tags', res.data[1])
+        self.assertFalse(Recipe.objects.exists())
+
+
+class RecipeValuesSerializerTests(QueryBudgetMixin, TestCase):
+    """Test the values() based recipe list serializer"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'values@test.com',
+            'testpass'
+        )
+        self.client.force_authenticate(self.user)
+        tags = [sample_tag(self.user, f'Tag {i}') for i in range(3)]
+        ingredients = [
+            sample_ingredient(self.user, f'Ingredient {i}') for i in range(3)
+        ]
+        for i in range(4):
+            recipe = sample_recipe(
+                user=self.user, title=f'Recipe {i}', price='1.5',
+                link=f'https://example.com/{i}' if i % 2 else ''
+            )
+            # added out of ID order, rendered in ID order
+            recipe.tags.add(*reversed(tags[:i]))
+            recipe.ingredients.add(*ingredients[i % 3:])
+
+    def model_serializer_data(self):
+        """Return RecipeSerializer output with links in ID order"""
+        data = RecipeSerializer(
+            Recipe.objects.order_by('-id'), many=True
+        ).data
+        for recipe in data:
+            recipe['tags'].sort()
+            recipe['ingredients'].sort()
+
+        return data
+
+    def test_output_identical_to_model_serializer(self):
+        """Test values() rows render exactly like RecipeSerializer"""
+        rows = Recipe.objects.order_by('-id').values(
+            *RecipeValuesSerializer.columns
+        )
+
+        data = RecipeValuesSerializer(list(rows)).data
+
+        renderer = JSONRenderer()
+        self.assertEqual(
+            renderer.render(data),
+            renderer.render(self.model_serializer_data())
+        )
+
+    def test_list_matches_model_serializer(self):
+        """Test the list endpoint renders like RecipeSerializer"""
+        res = self.client.get(RECIPES_URL)
+
+        renderer = JSONRenderer()
+        self.assertEqual(
+            renderer.render(res.data['results']),
+            renderer.render(self.model_serializer_data())
+        )
+
+    def test_list_query_budget(self):
+        """Test listing needs the validators, the page and the links"""
+        with self.assertMaxQueries(3):
+            res = self.client.get(RECIPES_URL, {'q': 'recipe'})
+
+        self.assertEqual(len(res.data['results']), 4)
+
+    def test_empty_list(self):
+        """Test an empty page skips the link query"""
+        Recipe.objects.all().delete()
+
+        with self.assertMaxQueries(2):
+            res = self.client.get(RECIPES_URL)
+
+        self.assertEqual(res.data['results'], [])
+
+
+class SparseFieldsApiTests(QueryBudgetMixin, TestCase):
+    """Test limiting recipe responses to the requested fields"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'fields@test.com',
+            'testpass'
+        )
+        self.client.force_authenticate(self.user)
+        self.recipe = sample_recipe(user=self.user, title='Flatbread')
+        self.recipe.tags.add(sample_tag(self.user))
+        self.recipe.ingredients.add(sample_ingredient(self.user))
+
+    def test_list_fields(self):
+        """Test the list renders only the requested fields"""
+        res = self.client.get(RECIPES_URL, {'fields': 'id,title'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            res.data['results'], [{'id': self.recipe.id, 'title': 'Flatbread'}]
+        )
+
+    def test_list_fields_keep_order(self):
+        """Test fields come in the serializer's order, not the request's"""
+        res = self.client.get(RECIPES_URL, {'fields': 'price,tags'})
+
+        self.assertEqual(list(res.data['results'][0]), ['tags', 'price'])
+        self.assertEqual(
+            res.data['results'][0]['tags'],
+            [tag.id for tag in self.recipe.tags.all()]
+        )
+
+    def test_list_without_links_skips_link_query(self):
+        """Test unrequested relations are never queried"""
+        with self.assertMaxQueries(2) as context:
+            self.client.get(RECIPES_URL, {'fields': 'title'})
+
+        sql = ' '.join(query['sql'] for query in context.captured_queries)
+        self.assertNotIn('recipe_tags', sql)
+        self.assertNotIn('recipe_ingredients', sql)
+        self.assertNotIn('"core_recipe"."link"', sql)
+
+    def test_actions_without_links_skip_prefetch(self):
+        """Test only actions rendering the links prefetch them"""
+        with self.assertMaxQueries(1) as context:
+            self.client.get(image_upload_url(self.recipe.id))
+
+        sql = context.captured_queries[0]['sql']
+        self.assertNotIn('recipe_tags', sql)
+        self.assertNotIn('recipe_ingredients', sql)
+
+    def test_detail_fields(self):
+        """Test the detail narrows the columns and prefetches"""
+        with self.assertMaxQueries(3) as context:
+            res = self.client.get(
+                detail_url(self.recipe.id), {'fields': 'title,tags'}
+            )
+
+        self.assertEqual(list(res.data), ['title', 'tags'])
+        self.assertEqual(res.data['tags'][0]['name'], 'Main Course')
+        sql = ' '.join(query['sql'] for query in context.captured_queries)
+        self.assertNotIn('recipe_ingredients', sql)
+        self.assertNotIn('"core_recipe"."price"', sql)
+
+    def test_unknown_field(self):
+        """Test asking for a field that doesn't exist is rejected"""
+        res = self.client.get(RECIPES_URL, {'fields': 'title,secret'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('secret', str(res.data['fields']))
+
+    def test_fields_ignored_on_write(self):
+        """Test updates still validate and return every field"""
+        res = self.client.patch(
+            detail_url(self.recipe.id) + '?fields=id',
+            {'title': 'Naan'}
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['title'], 'Naan')
+        self.assertIn('tags', res.data)
+
+
+class RecipeExportApiTests(TestCase):
+    """Test streaming exports of a user's recipes"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'export@test.com',
+            'testpass'
+        )
+        self.client.force_authenticate(self.user)
+        self.recipe = sample_recipe(user=self.user, title='Ramen, spicy')
+        self.recipe.tags.add(sample_tag(self.user, 'Soup'),
+                             sample_tag(self.user, 'Dinner'))
+        self.recipe.ingredients.add(sample_ingredient(self.user, 'Noodles'))
+        sample_recipe(user=self.user, title='Toast')
+        other = get_user_model().objects.create_user('other@test.com', 'pw')
+        sample_recipe(user=other, title='Not mine')
+
+    def export(self, **params):
+        """Return the export response and its joined body"""
+        res = self.client.get(EXPORT_URL, params)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return res, b''.join(res.streaming_content).decode()
+
+    def test_export_ndjson(self):
+        """Test exporting one JSON object per line by default"""
+        res, body = self.export()
+
+        self.assertEqual(res['Content-Type'], 'application/x-ndjson')
+        self.assertIn('recipes.ndjson', res['Content-Disposition'])
+        rows = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual([row['title'] for row in rows],
+                         ['Toast', 'Ramen, spicy'])
+        self.assertEqual(rows[1], {
+            'id': self.recipe.id,
+            'title': 'Ramen, spicy',
+            'time_minutes': 10,
+            'price': '5.00',
+            'link': '',
+            'tags': ['Dinner', 'Soup'],
+            'ingredients': ['Noodles'],
+        })
+        self.assertEqual(rows[0]['tags'], [])
+
+    def test_export_csv(self):
+        """Test exporting CSV with the linked names in one column"""
+        res, body = self.export(format='csv')
+
+        self.assertEqual(res['Content-Type'], 'text/csv; charset=utf-8')
+        rows = list(csv.DictReader(io.StringIO(body)))
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[1]['title'], 'Ramen, spicy')
+        self.assertEqual(rows[1]['tags'], 'Dinner; Soup')
+        self.assertEqual(rows[1]['price'], '5.00')
+
+    def test_export_filtered(self):
+        """Test the export honours the list filters"""
+        _, body = self.export(q='ramen')
+
+        self.assertEqual(len(body.splitlines()), 1)
+        self.assertIn('Ramen', body)
+
+    def test_export_server_side_cursor(self):
+        """Test rows are read in chunks through a server side cursor"""
+        connection = connections['default']
+        with patch.object(connection, 'chunked_cursor',
+                          wraps=connection.chunked_cursor) as cursor:
+            self.export()
+
+        cursor.assert_called_once_with()
+
+    def test_export_database_picked_once(self):
+        """Test the rows are read from the database routed in the view"""
+        # Reads are only sent to a replica while the view runs, so a
+        # database picked while streaming could differ from the one the
+        # transaction was opened on.
+        with patch('core.routers.PrimaryReplicaRouter.db_for_read',
+                   return_value='default') as db_for_read:
+            res = self.client.get(EXPORT_URL)
+            routed = db_for_read.call_count
+            body = b''.join(res.streaming_content)
+
+        self.assertGreater(routed, 0)
+        self.assertEqual(db_for_read.call_count, routed)
+        self.assertIn(b'Toast', body)
+
+    def test_export_streams(self):
+        """Test the first row is sent before the rest are rendered"""
+        res = self.client.get(EXPORT_URL)
+
+        self.assertTrue(res.streaming)
+        chunks = list(res.streaming_content)
+        self.assertEqual(len(chunks), 2)
+        self.assertIn(b'Toast', chunks[0])
+
+
+class ShoppingListApiTests(TestCase):
+    """Test merging the ingredients of selected recipes"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'shopper@test.com',
+            'testpass'
+        )
+        self.client.force_authenticate(self.user)
+        self.salt = sample_ingredient(self.user, 'Salt')
+        self.eggs = sample_ingredient(self.user, 'Eggs')
+        self.flour = sample_ingredient(self.user, 'Flour')
+        self.omelette = sample_recipe(user=self.user, title='Omelette')
+        self.omelette.ingredients.add(self.salt, self.eggs)
+        self.bread = sample_recipe(user=self.user, title='Bread')
+        self.bread.ingredients.add(self.salt, self.flour)
+        self.toast = sample_recipe(user=self.user, title='Toast')
+        other = get_user_model().objects.create_user('other@test.com', 'pw')
+        self.theirs = sample_recipe(user=other, title='Not mine')
+        self.theirs.ingredients.add(self.salt)
+
+    def shopping_list(self, *recipes):
+        return self.client.get(SHOPPING_LIST_URL, {
+            'recipes': ','.join(str(recipe.id) for recipe in recipes)
+        })
+
+    def test_shopping_list(self):
+        """Test ingredients are merged with the recipes using them"""
+        with self.assertNumQueries(1):
+            res = self.shopping_list(self.omelette, self.bread, self.toast)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, [
+            {'id': self.eggs.id, 'name': 'Eggs', 'recipe_count': 1,
+             'recipes': [self.omelette.id]},
+            {'id': self.flour.id, 'name': 'Flour', 'recipe_count': 1,
+             'recipes': [self.bread.id]},
+            {'id': self.salt.id, 'name': 'Salt', 'recipe_count': 2,
+             'recipes': sorted([self.omelette.id, self.bread.id])},
+        ])
+
+    def test_shopping_list_limited_to_user(self):
+        """Test other users' recipes add nothing to the list"""
+        res = self.shopping_list(self.omelette, self.omelette, self.theirs)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(item['name'], item['recipe_count']) for item in res.data],
+            [('Eggs', 1), ('Salt', 1)]
+        )
+
+    def test_shopping_list_invalid(self):
+        """Test the recipe IDs are required and bounded"""
+        for params in ({}, {'recipes': 'a,b'},
+                       {'recipes': ','.join(map(str, range(1, 102)))}):
+            res = self.client.get(SHOPPING_LIST_URL, params)
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class RecipeImageUploadTests(TestCase):
+    """Test uploading and resizing recipe images"""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            MEDIA_ROOT=self.media_root
+        )
+        self.settings_override.enable()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'user@test.com',
+            'testpass'
+        )
+        self.client.force_authenticate(self.user)
+        self.recipe = sample_recipe(user=self.user)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+
+    def upload(self, size=(1200, 600)):
+        """Upload a generated JPEG of `size` to the sample recipe"""
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as ntf:
+            Image.new('RGB', size).save(ntf, format='JPEG')
+            ntf.seek(0)
+            with patch('recipe.views.images.schedule_derivatives') as sd:
+                res = self.client.post(
+                    image_upload_url(self.recipe.id),
+                    {'image': ntf},
+                    format='multipart'
+                )
+        self.recipe.refresh_from_db()
+        return res, sd
+
+    def test_upload_image_to_recipe(self):
+        """Test uploading an image and queueing its resized copies"""
+        res, schedule = self.upload()
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertIn('image', res.data)
+        self.assertTrue(os.path.exists(self.recipe.image.path))
+        schedule.assert_called_once_with(self.recipe.image.name)
+        self.assertEqual(
+            res.data['thumbnails'],
+            {'160': None, '480': None, '960': None}
+        )
+
+    def test_thumbnails_exposed_when_ready(self):
+        """Test resized copies are listed once they are generated"""
+        self.upload()
+
+        images.schedule_derivatives(self.recipe.image.name).result()
+        res = self.client.get(image_upload_url(self.recipe.id))
+
+        for width in ('160', '480', '960'):
+            self.assertTrue(res.data['thumbnails'][width].startswith('http'))
+        path = images.derivative_name(self.recipe.image.path, 480)
+        with Image.open(path) as image:
+            self.assertEqual(image.size, (480, 240))
+
+    def test_replacing_image_deletes_old_files(self):
+        """Test uploading again removes the previous image and copies"""
+        self.upload()
+        old_path = self.recipe.image.path
+        images.generate_derivatives(self.recipe.image.name)
+
+        self.upload()
+
+        self.assertFalse(os.path.exists(old_path))
+        self.assertFalse(
+            os.path.exists(images.derivative_name(old_path, 160))
+        )
+
+    def test_failed_resize_logged(self):
+        """Test errors resizing in the background are logged"""
+        self.upload()
+        with open(self.recipe.image.path, 'wb') as f:
+            f.write(b'not an image')
+
+        executor = ThreadPoolExecutor(max_workers=1)
+        with self.assertLogs('recipe.images', 'ERROR') as logs, \
+                patch('recipe.images.get_executor', return_value=executor):
+            future = images.schedule_derivatives(self.recipe.image.name)
+            # callbacks run on the worker, which shutdown() waits for
+            executor.shutdown()
+
+        self.assertIsInstance(future.exception(), OSError)
+        self.assertIn(self.recipe.image.name, logs.output[0])
+
+    def test_deleted_image_not_resized(self):
+        """Test late resize jobs don't bring back deleted copies"""
+        self.upload()
+        name = self.recipe.image.name
+        mkstemp = tempfile.mkstemp
+
+        def delete_then_mkstemp(*args, **kwargs):
+            # the image is deleted while its first copy is being written
+            images.delete_image(name)
+            return mkstemp(*args, **kwargs)
+
+        with patch('recipe.images.tempfile.mkstemp',
+                   side_effect=delete_then_mkstemp):
+            images.generate_derivatives(name)
+        images.generate_derivatives(name)
+
+        self.assertEqual(os.listdir(os.path.dirname(self.recipe.image.path)),
+                         [])
+
+    def test_upload_image_bad_request(self):
+        """Test uploading an invalid image"""
+        res = self.client.post(
+            image_upload_url(self.recipe.id),
+            {'image': 'notimage'},
+            format='multipart'
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class RecipeImageCacheApiTests(QueryBudgetMixin, TestCase):
+    """Test serving recipe images resized on demand"""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            MEDIA_ROOT=self.media_root
+        )
+        self.settings_override.enable()
+        images._cache_size = None
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'user@test.com',
+            'testpass'
+        )
+        self.client.force_authenticate(self.user)
+        self.recipe = sample_recipe(
+            user=self.user, image='uploads/recipe/abcdef.jpg'
+        )
+        os.makedirs(os.path.dirname(self.recipe.image.path))
+        Image.new('RGB', (1200, 600)).save(self.recipe.image.path)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+        images._cache_size = None
+
+    @query_budget()
+    def test_resized_image(self):
+        """Test the image is served at the width and format asked for"""
+        res = self.client.get(image_url(self.recipe.id, 320, 'webp'))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res['Content-Type'], 'image/webp')
+        self.assertIn('ETag', res)
+        self.assertIn('no-cache', res['Cache-Control'])
+        self.assertIn('private', res['Cache-Control'])
+        image = Image.open(io.BytesIO(b''.join(res.streaming_content)))
+        self.assertEqual(image.format, 'WEBP')
+        self.assertEqual(image.size, (320, 160))
+        self.assertTrue(os.path.exists(os.path.join(
+            self.media_root,
+            images.cache_name(self.recipe.image.name, 320, 'webp')
+        )))
+
+    def test_resized_image_not_modified(self):
+        """Test a matching ETag gets a 304 without touching the cache"""
+        url = image_url(self.recipe.id, 160, 'jpeg')
+        etag = self.client.get(url)['ETag']
+
+        with patch('recipe.views.images.cached_derivative') as cached:
+            res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(res['ETag'], etag)
+        cached.assert_not_called()
+
+    def test_resized_image_any_accept_header(self):
+        """Test clients only accepting images aren't refused"""
+        res = self.client.get(
+            image_url(self.recipe.id, 160, 'webp'), HTTP_ACCEPT='image/webp'
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_width_and_format_must_be_allowed(self):
+        """Test only the configured widths and formats are made"""
+        for url, field in ((image_url(self.recipe.id, 321, 'jpeg'), 'width'),
+                           (image_url(self.recipe.id, 320, 'gif'), 'format')):
+            res = self.client.get(url)
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn(field, res.json())
+        self.assertFalse(os.path.exists(os.path.join(
+            self.media_root, settings.RECIPE_IMAGE_CACHE_DIR
+        )))
+
+    def test_resized_image_not_found(self):
+        """Test images of other users or missing images get a 404"""
+        other = sample_recipe(
+            user=get_user_model().objects.create_user(
+                'other@test.com', 'testpass'
+            ),
+            image=self.recipe.image.name
+        )
+        no_image = sample_recipe(user=self.user)
+        missing_file = sample_recipe(
+            user=self.user, image='uploads/recipe/gone.jpg'
+        )
+
+        for recipe in (other, no_image, missing_file):
+            res = self.client.get(image_url(recipe.id, 160, 'jpeg'))
+
+            self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(MEDIA_DELIVERY='x-accel-redirect')
+    def test_resized_image_x_accel_redirect(self):
+        """Test cached copies can be handed to the front server"""
+        res = self.client.get(image_url(self.recipe.id, 160, 'png'))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            res['X-Accel-Redirect'],
+            '/protected-media/' +
+            images.cache_name(self.recipe.image.name, 160, 'png')
+        )
+        self.assertEqual(res['Content-Type'], 'image/png')
+
+    def test_deleting_image_deletes_cached_copies(self):
+        """Test cached copies go along with the image they came from"""
+        self.client.get(image_url(self.recipe.id, 160, 'jpeg'))
+        self.client.get(image_url(self.recipe.id, 320, 'webp'))
+
+        images.delete_image(self.recipe.image.name)
+
+        cache_dir = os.path.join(
+            self.media_root, settings.RECIPE_IMAGE_CACHE_DIR
+        )
+        self.assertEqual(
+            [files for _, _, files in os.walk(cache_dir) if files], []
+        )
+
+
+class ConditionalRecipeApiTests(TestCase):
+    """Test conditional GET requests on the recipe endpoints"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'user@test.com',
+            'testpass'
+        )
+        self.client.force_authenticate(self.user)
+        self.recipe = sample_recipe(user=self.user)
+
+    def test_list_not_modified(self):
+        """Test a matching ETag gets a 304 from a single query"""
+        res = self.client.get(RECIPES_URL)
+        self.assertIn('ETag', res)
+
+        with self.assertNumQueries(1):
+            res = self.client.get(
+                RECIPES_URL, HTTP_IF_NONE_MATCH=res['ETag']
+            )
+
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(res.content, b'')
+
+    def test_detail_if_modified_since(self):
+        """Test If-Modified-Since is answered from the newest change"""
+        url = detail_url(self.recipe.id)
+        res = self.client.get(url)
+
+        res = self.client.get(url, HTTP_IF_MODIFIED_SINCE=res['Last-Modified'])
+
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_list_without_last_modified(self):
+        """Test lists leave out Last-Modified, which misses deletions"""
+        sample_recipe(user=self.user, title='Second')
+        res = self.client.get(RECIPES_URL)
+        self.assertNotIn('Last-Modified', res)
+        since = http_date()
+
+        self.recipe.delete()
+        res = self.client.get(RECIPES_URL, HTTP_IF_MODIFIED_SINCE=since)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res.data['results']), 1)
+
+    def test_list_modified_by_link_change(self):
+        """Test linking a tag changes the list validators"""
+        etag = self.client.get(RECIPES_URL)['ETag']
+
+        self.recipe.tags.add(sample_tag(user=self.user))
+        res = self.client.get(RECIPES_URL, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(res['ETag'], etag)
+
+    def test_list_modified_by_delete(self):
+        """Test deleting a recipe changes the list validators"""
+        sample_recipe(user=self.user, title='Second')
+        etag = self.client.get(RECIPES_URL)['ETag']
+
+        self.recipe.delete()
+        res = self.client.get(RECIPES_URL, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res.data['results']), 1)
+
+    def test_detail_modified_by_tag_rename(self):
+        """Test renaming a linked tag changes the recipe validators"""
+        tag = sample_tag(user=self.user)
+        self.recipe.tags.add(tag)
+        url = detail_url(self.recipe.id)
+        etag = self.client.get(url)['ETag']
+
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        tag.name = 'Renamed'
+        tag.save()
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['tags'][0]['name'], 'Renamed')
+
+    def test_detail_missing_recipe(self):
+        """Test a conditional request for a missing recipe is a 404"""
+        res = self.client.get(detail_url(self.recipe.id + 1))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class RecipeSearchApiTests(TestCase):
+    """Test full text search over recipes"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'user@test.com',
+            'testpass'
+        )
+        self.client.force_authenticate(self.user)
+
+    def search(self, terms, **params):
+        """Return the titles of the recipes matching `terms`"""
+        res = self.client.get(RECIPES_URL, {'q': terms, **params})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return [recipe['title'] for recipe in res.data['results']]
+
+    def test_search_title(self):
+        """Test searching recipe titles with stemming"""
+        sample_recipe(user=self.user, title='Roasted carrots')
+        sample_recipe(user=self.user, title='Beef stew')
+
+        self.assertEqual(self.search('carrot'), ['Roasted carrots'])
+
+    def test_search_linked_names(self):
+        """Test searching the names of linked tags and ingredients"""
+        recipe = sample_recipe(user=self.user, title='Weeknight dinner')
+        sample_recipe(user=self.user, title='Pancakes')
+        recipe.ingredients.add(sample_ingredient(self.user, 'Chickpeas'))
+        recipe.tags.add(sample_tag(self.user, 'Vegan'))
+
+        self.assertEqual(self.search('chickpeas'), ['Weeknight dinner'])
+        self.assertEqual(self.search('vegan'), ['Weeknight dinner'])
+
+    def test_search_ranked_by_relevance(self):
+        """Test title matches rank above ingredient matches"""
+        by_ingredient = sample_recipe(user=self.user, title='Fruit salad')
+        by_ingredient.ingredients.add(sample_ingredient(self.user, 'Lemon'))
+        sample_recipe(user=self.user, title='Lemon tart')
+
+        self.assertEqual(self.search('lemon'), ['Lemon tart', 'Fruit salad'])
+
+    def test_search_paginated(self):
+        """Test paging through ranked results returns each once"""
+        for i in range(5):
+            sample_recipe(user=self.user, title=f'Tomato soup {i}')
+        res = self.client.get(RECIPES_URL, {'q': 'tomato', 'page_size': 2})
+        titles = [recipe['title'] for recipe in res.data['results']]
+        while res.data['next']:
+            res = self.client.get(res.data['next'])
+            titles += [recipe['title'] for recipe in res.data['results']]
+
+        self.assertCountEqual(titles, [f'Tomato soup {i}' for i in range(5)])
+
+    def test_search_vector_follows_changes(self):
+        """Test renames and unlinking update the stored vector"""
+        recipe = sample_recipe(user=self.user, title='Curry')
+        ingredient = sample_ingredient(self.user, 'Paneer')
+        recipe.ingredients.add(ingredient)
+
+        ingredient.name = 'Tofu'
+        ingredient.save()
+        self.assertEqual(self.search('tofu'), ['Curry'])
+        self.assertEqual(self.search('paneer'), [])
+
+        ingredient.recipe_set.clear()
+        self.assertEqual(self.search('tofu'), [])
+
+        recipe.title = 'Dal'
+        recipe.save()
+        self.assertEqual(self.search('dal'), ['Dal'])
+
+    def test_search_bulk_created_recipes(self):
+        """Test recipes created in bulk are searchable"""
+        tag = sample_tag(self.user, 'Breakfast')
+        payload = [
+            {'title': 'Granola', 'time_minutes': 5, 'price': '2.00',
+             'tags': [tag.id], 'ingredients': []},
+        ]
+        self.client.post(RECIPES_URL, payload, format='json')
+
+        self.assertEqual(self.search('breakfast'), ['Granola'])
@@ -1,15 +1,22 @@
+from unittest.mock import patch
+
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.urls import reverse
-from django.test import TestCase
+from django.test import TestCase, override_settings
 
 from rest_framework import status
 from rest_framework.test import APIClient
 
-from core.models import Tag
+from core.models import Tag, Recipe
 
+from recipe.cache import bump_list_version, get_list_version
 from recipe.serializers import TagSerializer
+from recipe.tests.utils import run_on_commit
 
 TAGS_URL = reverse('recipe:tag-list')
+RECIPES_URL = reverse('recipe:recipe-list')
+POPULAR_TAGS_URL = reverse('recipe:tag-popular')
 
 
 class PublicTagsApiTests(TestCase):
@@ -29,6 +36,7 @@ class PrivateTagsApiTests(TestCase):
     """Test the authorized user tags api"""
 
     def setUp(self):
+        cache.clear()
         self.user = get_user_model().objects.create_user(
             'test@test.com',
             'testpass'
@@ -47,7 +55,7 @@ class PrivateTagsApiTests(TestCase):
         serializer = TagSerializer(tags, many=True)
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(res.data, serializer.data)
+        self.assertEqual(res.data['results'], serializer.data)
 
     def test_tags_limited_to_user(self):
         """Test that tags are limited to authenticated user"""
@@ -63,8 +71,8 @@ class PrivateTagsApiTests(TestCase):
         res = self.client.get(TAGS_URL)
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(res.data), 1)
-        self.assertEqual(res.data[0]['name'], tag.name)
+        self.assertEqual(len(res.data['results']), 1)
+        self.assertEqual(res.data['results'][0]['name'], tag.name)
 
     def test_create_tag_succsessful(self):
         """Test creating a new tag"""
@@ -83,3 +91,326 @@ class PrivateTagsApiTests(TestCase):
         res = self.client.post(TAGS_URL, payload)
 
         self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_create_tag_duplicate_name(self):
+        """Test a user can't create two tags with the same name"""
+        Tag.objects.create(user=self.user, name='Vegan')
+
+        res = self.client.post(TAGS_URL, {'name': 'Vegan'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Tag.objects.filter(name='Vegan').count(), 1)
+
+    def test_retrieve_tags_paginated(self):
+        """Test tags are paged by name"""
+        for name in ('Apple', 'Banana', 'Cherry', 'Date'):
+            Tag.objects.create(user=self.user, name=name)
+
+        res = self.client.get(TAGS_URL, {'page_size': 2})
+        first = res.data['results']
+        res = self.client.get(res.data['next'])
+        second = res.data['results']
+
+        tags = Tag.objects.order_by('-name')
+        serializer = TagSerializer(tags, many=True)
+        self.assertEqual(first + second, serializer.data)
+        self.assertIsNone(res.data['next'])
+
+    def test_retrieve_tags_assigned_to_recipes(self):
+        """Test filtering tags by those assigned to recipes"""
+        tag1 = Tag.objects.create(user=self.user, name='Breakfast')
+        tag2 = Tag.objects.create(user=self.user, name='Lunch')
+        recipe = Recipe.objects.create(
+            title='Coriander eggs on toast',
+            time_minutes=10,
+            price=5.00,
+            user=self.user
+        )
+        recipe.tags.add(tag1)
+
+        res = self.client.get(TAGS_URL, {'assigned_only': 1})
+
+        names = [tag['name'] for tag in res.data['results']]
+        self.assertIn(tag1.name, names)
+        self.assertNotIn(tag2.name, names)
+
+    def test_retrieve_tags_assigned_unique(self):
+        """Test filtering tags by assigned returns unique items"""
+        tag = Tag.objects.create(user=self.user, name='Breakfast')
+        Tag.objects.create(user=self.user, name='Lunch')
+        for title in ('Pancakes', 'Porridge'):
+            recipe = Recipe.objects.create(
+                title=title,
+                time_minutes=3,
+                price=2.00,
+                user=self.user
+            )
+            recipe.tags.add(tag)
+
+        res = self.client.get(TAGS_URL, {'assigned_only': 1})
+
+        self.assertEqual(len(res.data['results']), 1)
+
+    def test_retrieve_tags_cached(self):
+        """Test a repeated list request is served from the cache"""
+        Tag.objects.create(user=self.user, name='Vegan')
+        first = self.client.get(TAGS_URL)
+
+        # only the conditional request validators are queried
+        with self.assertNumQueries(1):
+            second = self.client.get(TAGS_URL)
+
+        self.assertEqual(second.data, first.data)
+
+    def test_replica_reads_not_cached(self):
+        """Test lists read from a replica aren't stored for other tokens"""
+        # The replica may lag behind a write made with another of the
+        # user's tokens, which only that token sticks to the primary for.
+        Tag.objects.create(user=self.user, name='Vegan')
+        with patch('recipe.cache.current_replica', return_value='replica1'):
+            self.client.get(TAGS_URL)
+
+        with self.assertNumQueries(2):
+            self.client.get(TAGS_URL)
+        with self.assertNumQueries(1):
+            self.client.get(TAGS_URL)
+
+    def test_create_tag_invalidates_cache(self):
+        """Test creating or deleting a tag refreshes the cached list"""
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        self.client.get(TAGS_URL)
+
+        with run_on_commit():
+            self.client.post(TAGS_URL, {'name': 'Dessert'})
+        res = self.client.get(TAGS_URL)
+        self.assertEqual(len(res.data['results']), 2)
+
+        with run_on_commit():
+            tag.delete()
+        res = self.client.get(TAGS_URL)
+        self.assertEqual(len(res.data['results']), 1)
+
+    def test_assigning_tag_invalidates_cache(self):
+        """Test linking a tag to a recipe refreshes assigned lists"""
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        recipe = Recipe.objects.create(
+            title='Tofu scramble',
+            time_minutes=10,
+            price=4.00,
+            user=self.user
+        )
+        res = self.client.get(TAGS_URL, {'assigned_only': 1})
+        self.assertEqual(len(res.data['results']), 0)
+
+        with run_on_commit():
+            recipe.tags.add(tag)
+        res = self.client.get(TAGS_URL, {'assigned_only': 1})
+        self.assertEqual(len(res.data['results']), 1)
+
+    def test_cache_invalidated_on_commit(self):
+        """Test lists are only invalidated once the write commits"""
+        # Otherwise a concurrent read could cache the list as it was
+        # before the commit under the new version.
+        version = get_list_version(self.user.id, Tag)
+
+        with run_on_commit():
+            bump_list_version(self.user.id, Tag)
+            self.assertEqual(get_list_version(self.user.id, Tag), version)
+
+        self.assertGreater(get_list_version(self.user.id, Tag), version)
+
+    def test_bulk_create_tags(self):
+        """Test creating a list of tags in one request"""
+        payload = [{'name': f'Tag {i}'} for i in range(20)]
+
+        # the duplicate name check, the insert and the savepoints it
+        # rolls back to if a name is taken concurrently
+        with self.assertNumQueries(6):
+            res = self.client.post(TAGS_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(res.data), 20)
+        self.assertTrue(all(tag['id'] for tag in res.data))
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 20)
+
+    def test_bulk_create_tags_invalid_item(self):
+        """Test errors are reported per item and nothing is created"""
+        payload = [{'name': 'Vegan'}, {'name': ''}]
+
+        res = self.client.post(TAGS_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res.data[0], {})
+        self.assertIn('name', res.data[1])
+        self.assertFalse(Tag.objects.exists())
+
+    def test_bulk_recipe_create_refreshes_counts(self):
+        """Test linking tags in a bulk recipe create changes the ETag"""
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        recipe = Recipe.objects.create(
+            user=self.user, title='Salad', time_minutes=5, price=1
+        )
+        recipe.tags.add(tag)
+        res = self.client.get(TAGS_URL)
+        etag = res['ETag']
+
+        payload = [{'title': 'Soup', 'time_minutes': 5, 'price': '1.00',
+                    'tags': [tag.id]}]
+        with run_on_commit():
+            self.client.post(RECIPES_URL, payload, format='json')
+        res = self.client.get(TAGS_URL, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['results'][0]['recipe_count'], 2)
+
+    def test_bulk_create_tags_duplicate_names(self):
+        """Test repeated and existing names are reported per item"""
+        Tag.objects.create(user=self.user, name='Vegan')
+        Tag.objects.create(
+            user=get_user_model().objects.create_user('o@test.com', 'pw'),
+            name='Spicy'
+        )
+        payload = [{'name': 'Vegan'}, {'name': 'Spicy'}, {'name': 'Sweet'},
+                   {'name': 'Spicy'}]
+
+        res = self.client.post(TAGS_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(len(res.data), 4)
+        self.assertIn('already have', str(res.data[0]['name'][0]))
+        self.assertEqual(res.data[1], {})
+        self.assertEqual(res.data[2], {})
+        self.assertIn('repeated', str(res.data[3]['name'][0]))
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 1)
+
+    @override_settings(RECIPE_BULK_CREATE_MAX_ITEMS=2)
+    def test_bulk_create_tags_too_many(self):
+        """Test batches over the limit are rejected"""
+        payload = [{'name': f'Tag {i}'} for i in range(3)]
+
+        res = self.client.post(TAGS_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Tag.objects.exists())
+
+    def test_retrieve_tags_not_modified(self):
+        """Test a matching ETag on the tag list gets a 304"""
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        etag = self.client.get(TAGS_URL)['ETag']
+
+        res = self.client.get(TAGS_URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        tag.delete()
+        res = self.client.get(TAGS_URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_popular_tags(self):
+        """Test listing the tags used by the most recipes"""
+        other_user = get_user_model().objects.create_user('o@test.com', 'pw')
+        Tag.objects.create(user=other_user, name='Theirs', recipe_count=9)
+        Tag.objects.create(user=self.user, name='Unused')
+        for name, count in (('Dinner', 2), ('Vegan', 5), ('Lunch', 2)):
+            Tag.objects.create(user=self.user, name=name, recipe_count=count)
+
+        res = self.client.get(POPULAR_TAGS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(tag['name'], tag['recipe_count']) for tag in res.data],
+            [('Vegan', 5), ('Dinner', 2), ('Lunch', 2)]
+        )
+
+        res = self.client.get(POPULAR_TAGS_URL, {'limit': 1})
+
+        self.assertEqual([tag['name'] for tag in res.data], ['Vegan'])
+
+    def test_popular_tags_invalid_limit(self):
+        """Test the popular tags limit must be within bounds"""
+        for limit in ('0', '1000', 'many'):
+            res = self.client.get(POPULAR_TAGS_URL, {'limit': limit})
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TagUsageCountTests(TestCase):
+    """Test tags keep count of the recipes using them"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@test.com',
+            'testpass'
+        )
+        self.tags = [
+            Tag.objects.create(user=self.user, name=f'Tag {i}')
+            for i in range(3)
+        ]
+        self.recipes = [
+            Recipe.objects.create(
+                user=self.user, title=f'Recipe {i}', time_minutes=5, price=1
+            )
+            for i in range(3)
+        ]
+
+    def assertCounts(self, *counts):
+        for tag, count in zip(self.tags, counts):
+            tag.refresh_from_db()
+            self.assertEqual(tag.recipe_count, count, tag.name)
+
+    def test_add_and_remove_tags(self):
+        """Test counts follow tags added to and removed from recipes"""
+        self.recipes[0].tags.add(*self.tags)
+        self.recipes[1].tags.add(self.tags[0])
+        # linking again changes nothing
+        self.recipes[1].tags.add(self.tags[0])
+        self.assertCounts(2, 1, 1)
+
+        # removing a tag that isn't linked changes nothing either
+        self.recipes[1].tags.remove(self.tags[0], self.tags[1])
+        self.assertCounts(1, 1, 1)
+
+        self.recipes[0].tags.set([self.tags[1]])
+        self.assertCounts(0, 1, 0)
+
+        self.recipes[0].tags.clear()
+        self.assertCounts(0, 0, 0)
+
+    def test_add_and_remove_recipes(self):
+        """Test counts follow recipes added to and removed from a tag"""
+        tag = self.tags[0]
+        tag.recipe_set.add(*self.recipes)
+        self.assertCounts(3)
+
+        tag.recipe_set.remove(self.recipes[0])
+        tag.recipe_set.remove(self.recipes[0])
+        self.assertCounts(2)
+
+        tag.recipe_set.clear()
+        self.assertCounts(0)
+
+    def test_delete_recipe(self):
+        """Test deleting a recipe takes it off its tags' counts"""
+        for recipe in self.recipes:
+            recipe.tags.add(self.tags[0], self.tags[1])
+
+        self.recipes[0].delete()
+        Recipe.objects.filter(pk=self.recipes[1].pk).delete()
+
+        self.assertCounts(1, 1, 0)
+
+    def test_bulk_create_recipes(self):
+        """Test recipes created in bulk count towards their tags"""
+        client = APIClient()
+        client.force_authenticate(self.user)
+        payload = [
+            {'title': f'Bulk {i}', 'time_minutes': 5, 'price': '1.00',
+             'tags': [self.tags[0].id, self.tags[i].id]}
+            for i in range(3)
+        ]
+
+        res = client.post(
+            reverse('recipe:recipe-list'), payload, format='json'
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertCounts(3, 1, 1)
@@ -0,0 +1,289 @@
+import functools
+import json
+import os
+import re
+import traceback
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+from unittest.mock import patch
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test.utils import CaptureQueriesContext
+from django.urls import Resolver404, resolve
+
+from rest_framework.test import APIClient
+
+
+PLANNER_SETTINGS = (
+    'enable_seqscan', 'enable_sort', 'enable_hashjoin', 'enable_mergejoin',
+)
+
+
+# A query shape run this many times in one block, each time with other
+# parameters, is reported as an N+1 pattern.
+N_PLUS_ONE_THRESHOLD = 3
+
+# Most queries each endpoint may run for one request, by URL name.  The
+# query_budget decorator enforces these on every API call a test makes.
+ENDPOINT_QUERY_BUDGETS = {
+    'recipe:recipe-list': 3,
+    'recipe:recipe-detail': 4,
+    'recipe:recipe-export': 3,
+    'recipe:recipe-shopping-list': 1,
+    'recipe:recipe-upload-image': 1,
+    'recipe:recipe-image': 1,
+    'recipe:tag-list': 2,
+    'recipe:tag-popular': 1,
+    'recipe:ingredient-list': 2,
+    'recipe:ingredient-popular': 1,
+    'user:me': 0,
+}
+
+# Runs of placeholders, as in IN (...) lists and multi row VALUES, whose
+# length depends on the data rather than the code path.
+PLACEHOLDER_LIST = re.compile(r'%s(?:, %s)+')
+VALUES_LIST = re.compile(r'(\([^()]*\))(?:, \1)+')
+SAVEPOINT = re.compile(r'^(?:RELEASE |ROLLBACK TO )?SAVEPOINT ')
+
+# Execute wrappers are called from here, below the code running queries.
+DJANGO_BACKENDS = os.path.join('django', 'db', 'backends', '')
+
+
+def query_shape(sql):
+    """Return a query's SQL with data dependent lists collapsed"""
+    shape = PLACEHOLDER_LIST.sub('%s, ...', sql)
+    return VALUES_LIST.sub(r'\1, ...', shape)
+
+
+def _call_site():
+    """Return the innermost project frames that ran a query"""
+    # The stack is cut where it enters the database backend, leaving
+    # out execute wrappers but not signal receivers.  Frames in the
+    # app's own code say more than the test calling it, which is only
+    # used when nothing else is left.
+    frames = []
+    for frame in traceback.extract_stack():
+        if DJANGO_BACKENDS in frame.filename:
+            break
+        if frame.filename.startswith(settings.BASE_DIR):
+            frames.append(frame)
+    app_frames = [
+        frame for frame in frames
+        if f'{os.sep}tests{os.sep}' not in frame.filename
+    ]
+    return [
+        f'{os.path.relpath(frame.filename, settings.BASE_DIR)}:'
+        f'{frame.lineno} in {frame.name}'
+        for frame in (app_frames or frames)[-3:]
+    ]
+
+
+class QueryRecorder:
+    """Record the queries run in a block along with their call sites"""
+    # Like CaptureQueriesContext, but on every alias by default and
+    # keeping the SQL before interpolation to compare query shapes.
+
+    def __init__(self, using=None):
+        self.aliases = [using] if using else list(connections)
+        self.captured_queries = []
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        for alias in self.aliases:
+            self._stack.enter_context(
+                connections[alias].execute_wrapper(self._record)
+            )
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+
+    def __len__(self):
+        return len(self.captured_queries)
+
+    def _record(self, execute, sql, params, many, context):
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            connection = context['connection']
+            self.captured_queries.append({
+                'sql': connection.ops.last_executed_query(
+                    context['cursor'], sql, params
+                ),
+                'shape': query_shape(sql),
+                'params': params,
+                'alias': connection.alias,
+                'call_site': _call_site(),
+            })
+
+    def repeated_queries(self, threshold=N_PLUS_ONE_THRESHOLD):
+        """Return the queries of shapes repeated with other parameters"""
+        by_shape = defaultdict(list)
+        for query in self.captured_queries:
+            if not SAVEPOINT.match(query['shape']):
+                by_shape[query['shape']].append(query)
+
+        return [
+            queries for queries in by_shape.values()
+            if len(queries) >= threshold and
+            len({repr(query['params']) for query in queries}) > 1
+        ]
+
+    def report(self, queries=None):
+        """Format queries with their call sites for a failure message"""
+        lines = []
+        for i, query in enumerate(queries or self.captured_queries, 1):
+            lines.append(f'{i}. {query["sql"]}')
+            lines.extend(f'     at {site}' for site in query['call_site'])
+        return '\n'.join(lines)
+
+
+class QueryBudgetMixin:
+    """TestCase mixin for asserting how many queries a block may issue"""
+
+    @contextmanager
+    def assertMaxQueries(self, budget, using='default'):
+        """Fail if the wrapped block runs more than `budget` queries"""
+        # Unlike assertNumQueries this only puts a ceiling on the count,
+        # so endpoints can get cheaper without the tests breaking.
+        with QueryRecorder(using) as recorder:
+            yield recorder
+
+        self.assertQueryBudget(recorder, budget)
+
+    @contextmanager
+    def assertNoNPlusOne(self, threshold=N_PLUS_ONE_THRESHOLD, using=None):
+        """Fail if the wrapped block repeats a query for each row"""
+        with QueryRecorder(using) as recorder:
+            yield recorder
+
+        self.assertNoRepeatedQueries(recorder, threshold)
+
+    def assertQueryBudget(self, recorder, budget, label='the block'):
+        """Fail if a recorder holds more than `budget` queries"""
+        if len(recorder) > budget:
+            self.fail(
+                f'{len(recorder)} queries executed by {label}, budget is '
+                f'{budget}\n{recorder.report()}'
+            )
+
+    def assertNoRepeatedQueries(self, recorder,
+                                threshold=N_PLUS_ONE_THRESHOLD,
+                                label='the block'):
+        """Fail if a recorder holds an N+1 pattern"""
+        repeated = recorder.repeated_queries(threshold)
+        if repeated:
+            self.fail(f'N+1 queries in {label}:\n' + '\n\n'.join(
+                f'{len(queries)} queries shaped like:\n'
+                f'{recorder.report(queries)}'
+                for queries in repeated
+            ))
+
+    def count_queries(self, func, using='default'):
+        """Call `func` and return how many queries it ran"""
+        with CaptureQueriesContext(connections[using]) as context:
+            func()
+
+        return len(context.captured_queries)
+
+
+def query_budget(budget=None, threshold=N_PLUS_ONE_THRESHOLD):
+    """Check each API call a test makes for N+1 queries and its budget"""
+    # The budget defaults to the endpoint's entry in
+    # ENDPOINT_QUERY_BUDGETS.  For QueryBudgetMixin test methods.
+    def decorator(test):
+        @functools.wraps(test)
+        def wrapper(self, *args, **kwargs):
+            original = APIClient.request
+
+            def request(client, **environ):
+                with QueryRecorder() as recorder:
+                    response = original(client, **environ)
+                    if response.streaming:
+                        # the body's queries run as it is read
+                        response.streaming_content = \
+                            list(response.streaming_content)
+                path = environ['PATH_INFO']
+                try:
+                    name = resolve(path).view_name
+                except Resolver404:
+                    name = None
+                label = f'{environ["REQUEST_METHOD"]} {path}'
+                self.assertNoRepeatedQueries(recorder, threshold, label)
+                limit = ENDPOINT_QUERY_BUDGETS.get(name) \
+                    if budget is None else budget
+                if limit is not None:
+                    self.assertQueryBudget(recorder, limit, label)
+                return response
+
+            with patch.object(APIClient, 'request', request):
+                return test(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+@contextmanager
+def run_on_commit(using=DEFAULT_DB_ALIAS):
+    """Run the on_commit callbacks registered in the block as it ends"""
+    # TestCase wraps each test in a transaction that never commits, so
+    # the callbacks would otherwise never run.
+    callbacks = connections[using].run_on_commit
+    start = len(callbacks)
+    yield
+    pending = callbacks[start:]
+    del callbacks[start:]
+    for _, func in pending:
+        func()
+
+
+def explain(sql, using='default'):
+    """Return PostgreSQL's JSON plan for an already interpolated query"""
+    # With full scans, sorts and hash/merge joins priced out, the planner
+    # only falls back to them when no index can serve the query.  That
+    # keeps the result about the schema rather than the size of the
+    # seeded data.
+    with connections[using].cursor() as cursor:
+        for setting in PLANNER_SETTINGS:
+            cursor.execute(f'SET {setting} = off')
+        try:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}')
+            return cursor.fetchone()[0][0]['Plan']
+        finally:
+            for setting in PLANNER_SETTINGS:
+                cursor.execute(f'RESET {setting}')
+
+
+def plan_nodes(plan):
+    """Yield every node of a plan tree, parents first"""
+    yield plan
+    for child in plan.get('Plans', ()):
+        yield from plan_nodes(child)
+
+
+class QueryPlanMixin:
+    """TestCase mixin asserting the plans of the queries a block runs"""
+
+    def assertIndexedPlans(self, context, tables, allow_sort=False,
+                           using='default'):
+        """Fail if a captured SELECT seq scans `tables` or sorts rows"""
+        for query in context.captured_queries:
+            sql = query['sql']
+            if not sql.startswith('SELECT'):
+                continue
+            plan = explain(sql, using)
+            for node in plan_nodes(plan):
+                # An index scan with no condition reads the whole table.
+                full_scan = node['Node Type'] == 'Seq Scan' or (
+                    'Index' in node['Node Type'] and
+                    not node.get('Index Cond')
+                )
+                bad_scan = full_scan and node.get('Relation Name') in tables
+                bad_sort = node['Node Type'] == 'Sort' and not allow_sort
+                if bad_scan or bad_sort:
+                    self.fail(
+                        f'{node["Node Type"]} in plan for:\n{sql}\n\n'
+                        f'{json.dumps(plan, indent=2)}'
+                    )
@@ -0,0 +1,67 @@
+from collections import defaultdict
+
+from django.db import connection
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from core.models import Tag, Ingredient, Recipe
+
+from recipe.cache import bump_list_version
+
+
+# The relation on Recipe linking each counted model.
+USAGE_LINKS = {Tag: 'tags', Ingredient: 'ingredients'}
+
+
+def adjust_usage(model, counts, **fields):
+    """Add amounts to the recipe counts of tags or ingredients by ID"""
+    # The increments run in the database with F(), so concurrent
+    # requests linking the same object never overwrite each other.
+    # Objects sharing an amount are updated together, along with any
+    # other `fields` given.
+    by_amount = defaultdict(list)
+    for pk, amount in counts.items():
+        if amount:
+            by_amount[amount].append(pk)
+    for amount, ids in by_amount.items():
+        # Counts that drifted, e.g. through links inserted by hand, stay
+        # non-negative until recount_usage repairs them.
+        model.objects.filter(pk__in=ids).update(
+            recipe_count=Greatest(F('recipe_count') + amount, Value(0)),
+            **fields
+        )
+
+
+def recount_usage(model, ids=None):
+    """Recompute recipe counts from the links, returning rows fixed"""
+    # A single grouped pass over the link table.  Passing no IDs
+    # recounts every object; only counts that changed are written, and
+    # touched so the owners' cached lists and validators move on too.
+    if ids is not None and not ids:
+        return 0
+    relation = Recipe._meta.get_field(USAGE_LINKS[model])
+    table = model._meta.db_table
+    through = relation.remote_field.through._meta.db_table
+    column = relation.m2m_reverse_name()
+    where = 'TRUE' if ids is None else 'o.id = ANY(%(ids)s)'
+    sql = (
+        f"UPDATE {table} t "
+        f"SET recipe_count = c.recipe_count, modified = %(now)s "
+        f"FROM (SELECT o.id, count(l.{column}) AS recipe_count "
+        f"FROM {table} o LEFT JOIN {through} l ON l.{column} = o.id "
+        f"WHERE {where} GROUP BY o.id) c "
+        f"WHERE t.id = c.id AND t.recipe_count <> c.recipe_count "
+        f"RETURNING t.user_id"
+    )
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, {
+            'ids': None if ids is None else list(ids),
+            'now': timezone.now(),
+        })
+        user_ids = [row[0] for row in cursor.fetchall()]
+    for user_id in set(user_ids):
+        bump_list_version(user_id, model)
+
+    return len(user_ids)
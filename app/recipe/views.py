@@ -1,26 +1,267 @@
-from rest_framework import viewsets, mixins
-from rest_framework.authentication import TokenAuthentication
+import calendar
+import hashlib
+import posixpath
+from collections import OrderedDict
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Max, Prefetch
+from django.http import StreamingHttpResponse
+from django.utils.cache import get_conditional_response, \
+    patch_cache_control
+from django.utils.http import http_date, quote_etag
+from django.utils.translation import gettext_lazy as _
+
+from rest_framework import viewsets, mixins, status
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.generics import get_object_or_404
+from rest_framework.negotiation import BaseContentNegotiation
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
 
+from core.authentication import CachedTokenAuthentication
 from core.models import Tag, Ingredient, Recipe
+from core.views import send_media
+
+from recipe import images, serializers
+from recipe.search import search_recipes, update_search_vectors
+from recipe.cache import get_cached_list, set_cached_list, \
+    bump_list_version
+from recipe.pagination import RecipeCursorPagination, \
+    RecipeAttrCursorPagination
+from recipe.renderers import NDJSONRenderer, CSVRenderer
+
+
+def _params_to_ints(request, name):
+    """Convert a comma separated list of IDs in a query param to ints"""
+    value = request.query_params.get(name)
+    if not value:
+        return None
+    try:
+        return [int(str_id) for str_id in value.split(',')]
+    except ValueError:
+        raise ValidationError({name: _('Expected comma separated IDs.')})
+
+
+def _param_to_number(request, name, cast):
+    """Convert a single numeric query param with the given cast"""
+    value = request.query_params.get(name)
+    if not value:
+        return None
+    try:
+        return cast(value)
+    except (ValueError, InvalidOperation):
+        raise ValidationError({name: _('Expected a number.')})
+
+
+class FirstRendererNegotiation(BaseContentNegotiation):
+    """Render with the view's first renderer whatever the client accepts"""
+    # For actions sending files, where the renderers only format errors
+    # and an Accept header like image/webp shouldn't fail with a 406.
+
+    def select_parser(self, request, parsers):
+        return parsers[0] if parsers else None
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
+
+
+class BulkCreateMixin:
+    """Accept a list of objects as well as a single one on create"""
+
+    def get_serializer(self, *args, **kwargs):
+        """Return a list serializer when a list payload is posted"""
+        # Only creates take lists; a list sent to update an object is
+        # left for the single object serializer to reject.
+        if self.action == 'create' and isinstance(kwargs.get('data'), list):
+            kwargs['many'] = True
+
+        return super().get_serializer(*args, **kwargs)
+
+
+class ConditionalGetMixin:
+    """Answer conditional GET requests before serializing anything"""
+    # The validators come from a single MAX/COUNT aggregate on the
+    # indexed (user, modified) columns.
+
+    def list(self, request, *args, **kwargs):
+        """List objects, or return 304 if the client's copy is current"""
+        # Lists only get an ETag.  A deletion lowers the count but never
+        # raises the newest `modified`, so Last-Modified would let an
+        # If-Modified-Since request get a 304 for a list still holding
+        # the deleted object.
+        queryset = self.filter_queryset(self.get_queryset())
+        stats = queryset.order_by().aggregate(
+            last_modified=Max('modified'),
+            count=Count('pk')
+        )
+
+        return self.conditional_response(
+            request, stats, False, super().list, *args, **kwargs
+        )
+
+    def conditional_response(self, request, stats, send_last_modified,
+                             view, *args, **kwargs):
+        """Return 304 when validators match, otherwise call the view"""
+        newest = stats['last_modified']
+        etag = quote_etag(hashlib.md5(':'.join([
+            str(request.user.id),
+            str(stats['count']),
+            newest.isoformat() if newest else '',
+            request.get_full_path(),
+            request.accepted_renderer.format,
+        ]).encode()).hexdigest())
+        last_modified = calendar.timegm(newest.utctimetuple()) \
+            if send_last_modified else None
+
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if response is None:
+            response = view(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            if send_last_modified:
+                response['Last-Modified'] = http_date(last_modified)
+
+        return response
+
+
+class CachedListMixin:
+    """Serve repeat list requests from the per-user response cache"""
+
+    def list(self, request, *args, **kwargs):
+        """List objects, serving repeat requests from the cache"""
+        # Saving or deleting an object bumps the user's list version,
+        # which moves every read onto fresh cache keys.
+        model = self.queryset.model
+        data = get_cached_list(request, model)
+        if data is not None:
+            return Response(data)
+
+        response = super().list(request, *args, **kwargs)
+        set_cached_list(request, model, response.data)
+        return response
+
+
+class SparseFieldsMixin:
+    """Render only the serializer fields named in ?fields="""
+    sparse_fields_actions = ('list', 'retrieve')
+
+    def get_requested_fields(self):
+        """Return the requested field names, or None for all of them"""
+        value = self.request.query_params.get('fields')
+        if not value or self.action not in self.sparse_fields_actions:
+            return None
+        fields = [name for name in value.split(',') if name]
+        readable = {
+            name for name, field in self.serializer_class().fields.items()
+            if not field.write_only
+        }
+        unknown = set(fields) - readable
+        if unknown:
+            raise ValidationError({'fields': _('Unknown fields: {}.').format(
+                ', '.join(sorted(unknown))
+            )})
+
+        return fields
 
-from recipe import serializers
+    def get_serializer(self, *args, **kwargs):
+        """Return a serializer limited to the requested fields"""
+        fields = self.get_requested_fields()
+        if fields is not None:
+            kwargs['fields'] = fields
 
+        return super().get_serializer(*args, **kwargs)
 
-class BaseRecipeAttrViewSet(viewsets.GenericViewSet,
+
+class ValuesListMixin:
+    """List objects from values() rows through a read only serializer"""
+    # Expects SparseFieldsMixin, whose requested fields also narrow the
+    # selected columns.
+    values_serializer_class = None
+
+    def list(self, request, *args, **kwargs):
+        """List objects without building model instances"""
+        serializer_class = self.values_serializer_class
+        fields = self.get_requested_fields()
+        queryset = self.filter_queryset(self.get_queryset())
+        # Annotations such as the search rank are kept for the cursor.
+        rows = queryset.prefetch_related(None).values(
+            *serializer_class.get_columns(fields),
+            *queryset.query.annotations
+        )
+
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            serializer = serializer_class(page, fields=fields)
+            return self.get_paginated_response(serializer.data)
+
+        serializer = serializer_class(list(rows), fields=fields)
+        return Response(serializer.data)
+
+
+class BaseRecipeAttrViewSet(ConditionalGetMixin,
+                            CachedListMixin,
+                            BulkCreateMixin,
+                            viewsets.GenericViewSet,
                             mixins.ListModelMixin,
                             mixins.CreateModelMixin):
     """Base viewset for user owned recipe attributes"""
-    authentication_classes = (TokenAuthentication, )
+    authentication_classes = (CachedTokenAuthentication, )
     permission_classes = (IsAuthenticated, )
+    pagination_class = RecipeAttrCursorPagination
 
     def get_queryset(self):
         """Return objects for the current authenticated user"""
-        return self.queryset.filter(user=self.request.user).order_by('-name')
+        queryset = self.queryset.filter(user=self.request.user)
+        assigned_only = bool(
+            _param_to_number(self.request, 'assigned_only', int)
+        )
+        if assigned_only:
+            # The join yields a row per recipe using the object.
+            queryset = queryset.filter(recipe__isnull=False).distinct()
+
+        return queryset.order_by('-name')
 
     def perform_create(self, serializer):
         """Create new object"""
-        serializer.save(user=self.request.user)
+        try:
+            with transaction.atomic():
+                serializer.save(user=self.request.user)
+        except IntegrityError:
+            # Names are unique per user.  Bulk creates check the batch
+            # up front; this catches single creates and concurrent ones.
+            raise ValidationError({'name': [
+                _('You already have an object with this name.')
+            ]})
+        # The post_save receiver in recipe.signals invalidates the
+        # user's cached lists, but bulk inserts send no signals.
+        if isinstance(serializer, serializers.BulkCreateListSerializer):
+            bump_list_version(self.request.user.id, self.queryset.model)
+
+    @action(detail=False)
+    def popular(self, request):
+        """List the objects used by the most recipes"""
+        limit = _param_to_number(request, 'limit', int)
+        if limit is None:
+            limit = settings.RECIPE_POPULAR_LIMIT
+        if not 0 < limit <= settings.RECIPE_POPULAR_MAX_LIMIT:
+            raise ValidationError({'limit': _(
+                'Expected a number from 1 to {max}.'
+            ).format(max=settings.RECIPE_POPULAR_MAX_LIMIT)})
+
+        # Read off the (user, -recipe_count, name) index rather than
+        # counting links.
+        queryset = self.queryset.filter(
+            user=request.user, recipe_count__gt=0
+        ).order_by('-recipe_count', 'name')[:limit]
+        serializer = self.get_serializer(queryset, many=True)
+        return Response(serializer.data)
 
 
 class TagViewSet(BaseRecipeAttrViewSet):
@@ -35,16 +276,96 @@ class IngredientViewSet(BaseRecipeAttrViewSet):
     serializer_class = serializers.IngredientSerializer
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(ConditionalGetMixin,
+                    ValuesListMixin,
+                    SparseFieldsMixin,
+                    BulkCreateMixin,
+                    viewsets.ModelViewSet):
     """Manage recipes in the database"""
     serializer_class = serializers.RecipeSerializer
+    values_serializer_class = serializers.RecipeValuesSerializer
     queryset = Recipe.objects.all()
-    authentication_classes = (TokenAuthentication, )
+    authentication_classes = (CachedTokenAuthentication, )
     permission_classes = (IsAuthenticated, )
+    pagination_class = RecipeCursorPagination
+    # Actions rendering the tags and ingredients of the recipes they read
+    prefetch_actions = ('list', 'retrieve')
 
     def get_queryset(self):
         """Retrive the recipes for the authenticated user"""
-        return self.queryset.filter(user=self.request.user)
+        # Both serializers render the tags and ingredients of every
+        # recipe, so fetch them up front in one query per relation
+        # rather than two extra queries for each recipe in the list.
+        # Ordering them by ID matches the values() list serializer.
+        # Updates drop the prefetched rows before rendering, and the
+        # other actions never render them.
+        fields = self.get_requested_fields()
+        queryset = self.queryset.filter(user=self.request.user)
+        relations = (('tags', Tag), ('ingredients', Ingredient)) \
+            if self.action in self.prefetch_actions else ()
+        for name, model in relations:
+            if fields is None or name in fields:
+                queryset = queryset.prefetch_related(
+                    Prefetch(name, queryset=model.objects.order_by('id'))
+                )
+        if fields is not None:
+            # skip loading the columns that won't be rendered
+            queryset = queryset.only('id', *(
+                name for name in fields
+                if name in serializers.RecipeValuesSerializer.columns
+            ))
+        queryset = self._filter_queryset_by_params(queryset)
+
+        return queryset.order_by('-id')
+
+    def _filter_queryset_by_params(self, queryset):
+        """Narrow the recipes by the filters given in the query string"""
+        tag_ids = _params_to_ints(self.request, 'tags')
+        ingredient_ids = _params_to_ints(self.request, 'ingredients')
+        ranges = (
+            ('price__gte', 'min_price', Decimal),
+            ('price__lte', 'max_price', Decimal),
+            ('time_minutes__gte', 'min_time', int),
+            ('time_minutes__lte', 'max_time', int),
+        )
+
+        for lookup, name, cast in ranges:
+            value = _param_to_number(self.request, name, cast)
+            if value is not None:
+                queryset = queryset.filter(**{lookup: value})
+        if tag_ids:
+            queryset = queryset.filter(tags__id__in=tag_ids)
+        if ingredient_ids:
+            queryset = queryset.filter(ingredients__id__in=ingredient_ids)
+        if tag_ids or ingredient_ids:
+            # A recipe matching several of the IDs would be joined once
+            # for each of them.
+            queryset = queryset.distinct()
+        terms = self.request.query_params.get('q')
+        if terms:
+            # RecipeCursorPagination orders these by relevance
+            queryset = search_recipes(queryset, terms)
+
+        return queryset
+
+    def retrieve(self, request, *args, **kwargs):
+        """Return a recipe, or 304 if the client's copy is current"""
+        try:
+            stats = self.get_queryset().filter(
+                pk=self.kwargs['pk']
+            ).order_by().aggregate(
+                last_modified=Max('modified'),
+                count=Count('pk')
+            )
+        except (TypeError, ValueError):
+            stats = {'count': 0}
+        if not stats['count']:
+            # let the regular lookup produce the 404
+            return super().retrieve(request, *args, **kwargs)
+
+        return self.conditional_response(
+            request, stats, True, super().retrieve, *args, **kwargs
+        )
 
     def get_serializer_class(self):
         """return appropriate serializer class"""
@@ -54,9 +375,186 @@ class RecipeViewSet(viewsets.ModelViewSet):
             # I'm not sure what exactly 'retrieve' is but I assume it
             # is a keyword that sort of translates to a GET request?
             return serializers.RecipeDetailSerializer
+        elif self.action == 'upload_image':
+            return serializers.RecipeImageSerializer
 
         return self.serializer_class
 
     def perform_create(self, serializer):
         """Create new recipe"""
         serializer.save(user=self.request.user)
+        if isinstance(serializer, serializers.BulkCreateListSerializer):
+            # The through rows were bulk inserted without m2m_changed,
+            # so invalidate the assigned_only lists and build the search
+            # vectors here.
+            bump_list_version(self.request.user.id, Tag)
+            bump_list_version(self.request.user.id, Ingredient)
+            update_search_vectors(
+                [recipe.id for recipe in serializer.instance]
+            )
+
+    @action(methods=['GET', 'POST'], detail=True, url_path='upload-image')
+    def upload_image(self, request, pk=None):
+        """Upload an image to a recipe, or poll for its resized copies"""
+        recipe = self.get_object()
+        if request.method == 'GET':
+            return Response(self.get_serializer(recipe).data)
+
+        # Spool the upload to a temporary file in chunks instead of
+        # holding it in memory.  Saving then moves that file into place.
+        request._request.upload_handlers = [
+            TemporaryFileUploadHandler(request._request)
+        ]
+        old_image = recipe.image.name
+        serializer = self.get_serializer(recipe, data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                serializer.errors,
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        serializer.save()
+        if old_image:
+            images.delete_image(old_image)
+        images.schedule_derivatives(recipe.image.name)
+
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+    @action(methods=['GET'], detail=True,
+            url_path=r'image/(?P<width>[0-9]+)w\.(?P<image_format>[a-z]+)',
+            content_negotiation_class=FirstRendererNegotiation)
+    def image(self, request, pk=None, width=None, image_format=None):
+        """Serve the recipe's image resized to a width and format"""
+        width = int(width)
+        if width not in settings.RECIPE_IMAGE_CACHE_WIDTHS:
+            raise ValidationError({'width': _(
+                'Expected one of {widths}.'
+            ).format(widths=', '.join(
+                str(allowed) for allowed in settings.RECIPE_IMAGE_CACHE_WIDTHS
+            ))})
+        if image_format not in settings.RECIPE_IMAGE_CACHE_FORMATS:
+            raise ValidationError({'format': _(
+                'Expected one of {formats}.'
+            ).format(formats=', '.join(settings.RECIPE_IMAGE_CACHE_FORMATS))})
+
+        # Only the image's name is needed, not the recipe with its tags
+        # and ingredients.
+        name = get_object_or_404(
+            self.queryset.filter(user=request.user).values_list(
+                'image', flat=True
+            ),
+            pk=pk
+        )
+        if not name:
+            raise NotFound(_('This recipe has no image.'))
+
+        # Copies are named after the upload, so the name changes along
+        # with the image and doubles as the ETag.
+        etag = quote_etag(
+            posixpath.basename(images.cache_name(name, width, image_format))
+        )
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            try:
+                cached = images.cached_derivative(name, width, image_format)
+            except FileNotFoundError:
+                raise NotFound(_('This recipe has no image.'))
+            response = send_media(
+                request, cached, images.FORMATS[image_format][1]
+            )
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+        # The URL stays the same when the image is replaced, so clients
+        # check back instead of keeping their copy for good.
+        patch_cache_control(response, private=True, no_cache=True)
+
+        return response
+
+    @action(methods=['GET'], detail=False,
+            renderer_classes=(NDJSONRenderer, CSVRenderer))
+    def export(self, request):
+        """Stream the recipes with the names of their tags and ingredients"""
+        # Rows are read through a server side cursor and written out as
+        # they arrive, so memory use doesn't grow with the library.
+        # ?format=csv or an Accept header picks CSV over NDJSON.
+        renderer = request.accepted_renderer
+        rows = self.filter_queryset(self.get_queryset()).prefetch_related(
+            None
+        ).annotate(
+            tag_names=serializers.link_array('tags', 'name'),
+            ingredient_names=serializers.link_array('ingredients', 'name'),
+        ).values_list(
+            'id', 'title', 'time_minutes', 'price', 'link',
+            'tag_names', 'ingredient_names'
+        )
+        # The rows are read after the view returns, once routing has
+        # stopped sending reads to the replicas, so pick the database now
+        # and use it for both the transaction and the cursor.
+        alias = rows.db
+        rows = rows.using(alias)
+
+        content_type = renderer.media_type
+        if renderer.charset:
+            content_type += f'; charset={renderer.charset}'
+        response = StreamingHttpResponse(
+            renderer.stream(self._export_rows(rows, alias)),
+            content_type=content_type
+        )
+        response['Content-Disposition'] = \
+            f'attachment; filename="recipes.{renderer.format}"'
+        return response
+
+    def _export_rows(self, rows, alias):
+        """Yield the exported recipes as dicts, reading from `alias`"""
+        price_field = serializers.RecipeSerializer().fields['price']
+        chunk_size = settings.RECIPE_EXPORT_CHUNK_SIZE
+        # Outside a transaction PostgreSQL runs the whole query before
+        # returning the first chunk of a server side cursor.
+        with transaction.atomic(using=alias):
+            for recipe_id, title, time_minutes, price, link, tags, \
+                    ingredients in rows.iterator(chunk_size=chunk_size):
+                yield OrderedDict((
+                    ('id', recipe_id),
+                    ('title', title),
+                    ('time_minutes', time_minutes),
+                    ('price', price_field.to_representation(price)),
+                    ('link', link),
+                    ('tags', sorted(tags or ())),
+                    ('ingredients', sorted(ingredients or ())),
+                ))
+
+    @action(methods=['GET'], detail=False, url_path='shopping-list')
+    def shopping_list(self, request):
+        """Merge the ingredients of the recipes given in ?recipes="""
+        recipe_ids = _params_to_ints(request, 'recipes')
+        if not recipe_ids:
+            raise ValidationError({
+                'recipes': _('Expected comma separated IDs.')
+            })
+        limit = settings.RECIPE_SHOPPING_LIST_MAX_RECIPES
+        recipe_ids = set(recipe_ids)
+        if len(recipe_ids) > limit:
+            raise ValidationError({'recipes': _(
+                'Ensure there are no more than {limit} recipes.'
+            ).format(limit=limit)})
+
+        # One grouped query over the ingredient links instead of loading
+        # each recipe.  Both conditions apply to the same join, so IDs
+        # of other users' recipes add nothing.
+        rows = Ingredient.objects.filter(
+            recipe__id__in=recipe_ids,
+            recipe__user=request.user
+        ).values('id', 'name').annotate(
+            recipe_count=Count('recipe'),
+            recipes=ArrayAgg('recipe__id')
+        ).order_by('name', 'id')
+
+        return Response([
+            OrderedDict((
+                ('id', row['id']),
+                ('name', row['name']),
+                ('recipe_count', row['recipe_count']),
+                ('recipes', sorted(row['recipes'])),
+            ))
+            for row in rows
+        ])